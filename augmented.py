@@ -0,0 +1,325 @@
+import bisect
+import math
+from bplustree import BPlusTree, BPlusTreeSnapshot, InternalNode, LeafNode
+
+
+class AugmentedLeafNode(LeafNode):
+    __slots__ = ('count', 'total', 'low', 'high')
+
+    def __init__(self, parent = None):
+        super().__init__(parent)
+        self.count = 0
+        self.total = 0
+        self.low = self.high = None
+
+
+class AugmentedInternalNode(InternalNode):
+    __slots__ = ('count', 'total', 'low', 'high')
+
+    def __init__(self, parent = None):
+        super().__init__(parent)
+        self.count = 0
+        self.total = 0
+        self.low = self.high = None
+
+
+class AugmentedBPlusTree(BPlusTree):
+    """BPlusTree whose nodes summarize their subtree for order statistics.
+
+    Every node keeps the number of keys below it, so rank, select and
+    range counts add up the counts of the children left of one
+    root-to-leaf path instead of walking leaves. With a ``measure``
+    (a callable mapping a stored value to a number, or None to leave the
+    entry out), nodes also keep the sum, min and max of the measured
+    values, which makes range sum/min/max O(log n) as well. Summaries are
+    adjusted along the path on every insert, delete and update, and
+    recomputed from the children for nodes touched by a split, borrow or
+    merge.
+    """
+    _leaf_class = AugmentedLeafNode
+    _internal_class = AugmentedInternalNode
+
+    def __init__(self, order = 4, debug = False, measure = None):
+        super().__init__(order, debug)
+        self.measure = measure
+
+    def _snapshot_view(self):
+        return AugmentedBPlusTreeSnapshot(self)
+
+    def _writable(self, node):
+        copy = super()._writable(node)
+        if copy is not node:
+            copy.count, copy.total, copy.low, copy.high = node.count, node.total, node.low, node.high
+        return copy
+
+    # --- Maintenance ---
+
+    def _summarize(self, node):
+        # Recomputes node's summary from its entries or from its children.
+        measure = self.measure
+        if node.is_leaf:
+            node.count = len(node.keys)
+            if measure is None:
+                return
+            measured = [m for m in map(measure, node.values) if m is not None]
+            node.total = sum(measured)
+            node.low = min(measured, default=None)
+            node.high = max(measured, default=None)
+            return
+        children = node.values
+        node.count = sum(child.count for child in children)
+        if measure is None:
+            return
+        node.total = sum(child.total for child in children)
+        node.low = min((child.low for child in children if child.low is not None), default=None)
+        node.high = max((child.high for child in children if child.high is not None), default=None)
+
+    def _summarize_all(self):
+        level = [self.root]
+        levels = []
+        while level:
+            levels.append(level)
+            level = [] if level[0].is_leaf else [child for node in level for child in node.values]
+        for level in reversed(levels):
+            for node in level:
+                self._summarize(node)
+
+    def _insert_at(self, leaf, idx, key, value):
+        if leaf.epoch <= self._shared_epoch:
+            leaf = self._writable(leaf)
+        # Every node on the path gains the entry, however splits later divide it.
+        m = None if self.measure is None else self.measure(value)
+        node = leaf
+        while node is not None:
+            node.count += 1
+            if m is not None:
+                node.total += m
+                if node.low is None or m < node.low:
+                    node.low = m
+                if node.high is None or m > node.high:
+                    node.high = m
+            node = node.parent
+        super()._insert_at(leaf, idx, key, value)
+
+    def _delete_at(self, leaf, idx):
+        if leaf.epoch <= self._shared_epoch:
+            leaf = self._writable(leaf)
+        m = None if self.measure is None else self.measure(leaf.values[idx])
+        leaf.keys.pop(idx)
+        leaf.values.pop(idx)
+        self._size -= 1
+        self._retract(leaf, m)
+        if leaf.is_underflow(self._min_keys):
+            self._handle_underflow(leaf)
+
+    def _retract(self, leaf, m):
+        # Removes one entry measuring m from the summaries on the path, bottom
+        # up; a node whose min or max it was is recomputed from its children.
+        node = leaf
+        while node is not None:
+            if m is not None and (m == node.low or m == node.high):
+                self._summarize(node)
+            else:
+                node.count -= 1
+                if m is not None:
+                    node.total -= m
+            node = node.parent
+
+    def _trim(self, node, start, end, include_start, include_end, edges):
+        # delete_range cuts the nodes on its boundary paths bottom up, so each
+        # is summarized from children that already are.
+        removed = super()._trim(node, start, end, include_start, include_end, edges)
+        self._summarize(node)
+        return removed
+
+    def _subtree_size(self, node):
+        return node.count
+
+    def update(self, key, new_value):
+        leaf = self._find_leaf(key)
+        idx = bisect.bisect_left(leaf.keys, key)
+        if idx < len(leaf.keys) and leaf.keys[idx] == key:
+            leaf = self._writable(leaf)
+            leaf.values[idx] = new_value
+            if self.measure is not None:
+                node = leaf
+                while node is not None:
+                    self._summarize(node)
+                    node = node.parent
+            return True
+        return False
+
+    def _insert_in_parent(self, left_child, key, right_child):
+        # A split divides the entries of left_child; the parent's total is unchanged.
+        self._summarize(left_child)
+        self._summarize(right_child)
+        new_root = left_child.parent is None
+        super()._insert_in_parent(left_child, key, right_child)
+        if new_root:
+            self._summarize(self.root)
+
+    def _borrow_from_left(self, node, left_sibling, parent, node_idx):
+        super()._borrow_from_left(node, left_sibling, parent, node_idx)
+        self._summarize(node)
+        self._summarize(left_sibling)
+
+    def _borrow_from_right(self, node, right_sibling, parent, node_idx):
+        super()._borrow_from_right(node, right_sibling, parent, node_idx)
+        self._summarize(node)
+        self._summarize(right_sibling)
+
+    def _merge_nodes(self, left_node, right_node, parent, left_idx):
+        # Combined before the merge, since it may go on to rebalance the parent.
+        left_node.count += right_node.count
+        if self.measure is not None:
+            left_node.total += right_node.total
+            left_node.low = min((v for v in (left_node.low, right_node.low) if v is not None), default=None)
+            left_node.high = max((v for v in (left_node.high, right_node.high) if v is not None), default=None)
+        super()._merge_nodes(left_node, right_node, parent, left_idx)
+
+    def bulk_load(self, sorted_items, fill_factor=1.0):
+        BPlusTree.bulk_load(self, sorted_items, fill_factor)
+        self._summarize_all()
+
+    def validate(self):
+        """Checks the B+ tree invariants and that every summary matches its subtree."""
+        BPlusTree.validate(self)
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            expected = node.count, node.total, node.low, node.high
+            self._summarize(node)
+            # Totals are kept incrementally, so float sums may differ in rounding.
+            if ((node.count, node.low, node.high) != (expected[0], expected[2], expected[3])
+                    or not math.isclose(node.total, expected[1], rel_tol=1e-9, abs_tol=1e-9)):
+                raise AssertionError(f"Stale summary {expected} for node with keys {node.keys}")
+            if not node.is_leaf:
+                stack.extend(node.values)
+        return True
+
+    # --- Order statistics ---
+
+    def _prefix(self, key, include):
+        # Count and measured total of the keys below key (or up to it, if include).
+        node = self.root
+        count, total, visits = 0, 0, 1
+        while not node.is_leaf:
+            idx = bisect.bisect_right(node.keys, key)
+            for child in node.values[:idx]:
+                count += child.count
+                total += child.total
+            node = node.values[idx]
+            visits += 1
+        idx = (bisect.bisect_right if include else bisect.bisect_left)(node.keys, key)
+        count += idx
+        if self.measure is not None:
+            total += sum(m for m in map(self.measure, node.values[:idx]) if m is not None)
+        if self.metrics is not None:
+            self.metrics.node_visits += visits
+        return count, total
+
+    def _range_prefixes(self, start, end, inclusive):
+        include_start, include_end = inclusive
+        below = (0, 0) if start is None else self._prefix(start, not include_start)
+        upto = (self.root.count, self.root.total) if end is None else self._prefix(end, include_end)
+        return below, upto
+
+    def rank(self, key):
+        """Returns the number of keys smaller than key."""
+        return self._prefix(key, False)[0]
+
+    def select(self, i):
+        """Returns the i-th smallest (key, value) pair; negative i counts from the end."""
+        if i < 0:
+            i += self.root.count
+        if not 0 <= i < self.root.count:
+            raise IndexError("select index out of range")
+        node = self.root
+        visits = 1
+        while not node.is_leaf:
+            for child in node.values:
+                if i < child.count:
+                    break
+                i -= child.count
+            node = child
+            visits += 1
+        if self.metrics is not None:
+            self.metrics.node_visits += visits
+        return node.keys[i], node.values[i]
+
+    def count_range(self, start=None, end=None, inclusive=(True, True)):
+        """Counts keys between start and end; bounds as in scan()."""
+        below, upto = self._range_prefixes(start, end, inclusive)
+        return max(upto[0] - below[0], 0)
+
+    def sum_range(self, start=None, end=None, inclusive=(True, True)):
+        """Sums the measured values of keys between start and end."""
+        self._require_measure()
+        below, upto = self._range_prefixes(start, end, inclusive)
+        return upto[1] - below[1] if upto[0] > below[0] else 0
+
+    def min_range(self, start=None, end=None, inclusive=(True, True)):
+        """Smallest measured value between start and end, or None."""
+        self._require_measure()
+        return self._extreme(self.root, start, end, inclusive, min, 'low')
+
+    def max_range(self, start=None, end=None, inclusive=(True, True)):
+        """Largest measured value between start and end, or None."""
+        self._require_measure()
+        return self._extreme(self.root, start, end, inclusive, max, 'high')
+
+    def _require_measure(self):
+        if self.measure is None:
+            raise ValueError("Range sum, min and max need a tree built with a measure")
+
+    def _extreme(self, node, start, end, inclusive, pick, side):
+        # Children strictly inside the range answer from their summary; at
+        # most the two boundary paths are descended.
+        include_start, include_end = inclusive
+        if self.metrics is not None:
+            self.metrics.node_visits += 1
+        if node.is_leaf:
+            lo = 0 if start is None else (bisect.bisect_left if include_start else bisect.bisect_right)(node.keys, start)
+            hi = len(node.keys) if end is None else (bisect.bisect_right if include_end else bisect.bisect_left)(node.keys, end)
+            measured = [m for m in map(self.measure, node.values[lo:hi]) if m is not None]
+            return pick(measured, default=None)
+        lo = 0 if start is None else bisect.bisect_right(node.keys, start)
+        hi = len(node.keys) if end is None else bisect.bisect_right(node.keys, end)
+        found = []
+        for i in range(lo, hi + 1):
+            child = node.values[i]
+            if lo < i < hi:
+                value = getattr(child, side)
+            else:
+                value = self._extreme(child, start if i == lo else None, end if i == hi else None,
+                                      inclusive, pick, side)
+            if value is not None:
+                found.append(value)
+        return pick(found, default=None)
+
+
+class AugmentedBPlusTreeSnapshot(BPlusTreeSnapshot):
+    """Read-only view of an AugmentedBPlusTree; summaries are shared with the tree."""
+    _leaf_class = AugmentedLeafNode
+    _internal_class = AugmentedInternalNode
+
+    def __init__(self, tree):
+        super().__init__(tree)
+        self.measure = tree.measure
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        AugmentedBPlusTree._summarize_all(self)
+
+    _summarize = AugmentedBPlusTree._summarize
+    _summarize_all = AugmentedBPlusTree._summarize_all
+    _prefix = AugmentedBPlusTree._prefix
+    _range_prefixes = AugmentedBPlusTree._range_prefixes
+    _require_measure = AugmentedBPlusTree._require_measure
+    _extreme = AugmentedBPlusTree._extreme
+    rank = AugmentedBPlusTree.rank
+    select = AugmentedBPlusTree.select
+    count_range = AugmentedBPlusTree.count_range
+    sum_range = AugmentedBPlusTree.sum_range
+    min_range = AugmentedBPlusTree.min_range
+    max_range = AugmentedBPlusTree.max_range
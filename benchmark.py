@@ -0,0 +1,568 @@
+"""Benchmark suite for the B+ tree storage engines.
+
+Replaces the notebook PerformanceTester with reproducible runs:
+
+    python benchmark.py run --sizes 10000 1000000 --orders 8 32 -o new.json
+    python benchmark.py compare base.json new.json --threshold 0.1
+    python benchmark.py search-many
+    python benchmark.py serialization --size 1000000
+    python benchmark.py lookup-cache
+    python benchmark.py delete-range
+
+Every (engine, order, size, workload, distribution) case preloads a tree
+with ``size`` rows, discards ``warmup`` trials, then times ``trials``
+runs of ``ops`` operations each. Per-operation latencies give the
+percentiles; the median trial gives the throughput. Peak traced memory
+is measured in a separate untimed pass, because tracemalloc slows every
+allocation down.
+"""
+import argparse
+import contextlib
+import functools
+import io
+import gc
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from bplustree import BPlusTree
+from db_manager import DatabaseManager
+from paged_bplustree import PagedBPlusTree
+from table import Table
+
+WORKLOADS = ('insert', 'search', 'range', 'delete', 'mixed')
+DISTRIBUTIONS = ('sequential', 'random', 'zipfian')
+ENGINES = ('memory', 'paged')
+PERCENTILES = (50, 90, 99)
+MIXED_RATIOS = (('search', 0.5), ('update', 0.2), ('insert', 0.15), ('delete', 0.15))
+RESULT_VERSION = 1
+
+
+# --- Key distributions ---
+# The preloaded tree holds the even keys 0, 2, ..., 2 * (size - 1). Workloads
+# pick a row position per operation and turn it into a key: even keys hit
+# existing rows, odd keys are new ones.
+
+@functools.lru_cache(maxsize=4)
+def _zipf_cumulative(n, theta):
+    weights = (1.0 / rank ** theta for rank in range(1, n + 1))
+    total, cumulative = 0.0, []
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+    return cumulative
+
+
+def _scatter(n):
+    # Multiplier coprime with n, so popular ranks land all over the key
+    # space instead of clustering at its start.
+    multiplier = 2654435761 % n or 1
+    while math.gcd(multiplier, n) != 1:
+        multiplier += 1
+    return multiplier
+
+
+def positions(distribution, size, count, rng, theta=0.99):
+    """Returns count row positions in [0, size) drawn from distribution."""
+    if distribution == 'sequential':
+        first = rng.randrange(size)
+        return [(first + i) % size for i in range(count)]
+    if distribution == 'random':
+        return [rng.randrange(size) for _ in range(count)]
+    if distribution == 'zipfian':
+        ranks = rng.choices(range(size), cum_weights=_zipf_cumulative(size, theta), k=count)
+        multiplier = _scatter(size)
+        return [rank * multiplier % size for rank in ranks]
+    raise ValueError(f"Unknown distribution '{distribution}', expected one of {DISTRIBUTIONS}")
+
+
+# --- Trees and workloads ---
+
+class _TreeFactory:
+    """Builds preloaded trees for one engine, cleaning up page files afterwards."""
+
+    def __init__(self, engine, order, size):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine '{engine}', expected one of {ENGINES}")
+        self.engine = engine
+        self.order = order
+        self.size = size
+        self._dir = tempfile.mkdtemp(prefix='bptree-bench-') if engine == 'paged' else None
+        self._builds = 0
+
+    def build(self):
+        rows = ((2 * i, i) for i in range(self.size))
+        if self.engine == 'paged':
+            self._builds += 1
+            tree = PagedBPlusTree(os.path.join(self._dir, f'{self._builds}.pages'), order=self.order)
+        else:
+            tree = BPlusTree(order=self.order)
+        tree.bulk_load(rows)
+        return tree
+
+    def discard(self, tree):
+        if self.engine == 'paged':
+            tree.close()
+            os.remove(tree.path)
+
+    def close(self):
+        if self._dir is not None:
+            shutil.rmtree(self._dir, ignore_errors=True)
+
+
+def _operations(tree, workload, distribution, size, count, rng, range_length):
+    # Precomputes (callable, args) pairs so the timed loop only dispatches.
+    picks = positions(distribution, size, count, rng)
+    if workload == 'search':
+        return [(tree.search, (2 * p,)) for p in picks]
+    if workload == 'insert':
+        return [(tree.insert_if_absent, (2 * p + 1, p)) for p in picks]
+    if workload == 'delete':
+        return [(tree.delete, (2 * p,)) for p in picks]
+    if workload == 'range':
+        return [(tree.range_query, (2 * p, 2 * (p + range_length - 1))) for p in picks]
+    if workload == 'mixed':
+        kinds = rng.choices([kind for kind, _ in MIXED_RATIOS],
+                            weights=[ratio for _, ratio in MIXED_RATIOS], k=count)
+        calls = {'search': lambda p: (tree.search, (2 * p,)),
+                 'update': lambda p: (tree.update, (2 * p, -p)),
+                 'insert': lambda p: (tree.insert_if_absent, (2 * p + 1, p)),
+                 'delete': lambda p: (tree.delete, (2 * p,))}
+        return [calls[kind](p) for kind, p in zip(kinds, picks)]
+    raise ValueError(f"Unknown workload '{workload}', expected one of {WORKLOADS}")
+
+
+def _time_operations(operations):
+    clock = time.perf_counter_ns
+    latencies = []
+    append = latencies.append
+    for fn, args in operations:
+        start = clock()
+        fn(*args)
+        append(clock() - start)
+    return latencies
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def _trial_rng(seed, *case):
+    # String seeds are hashed with SHA-512, so runs repeat across processes.
+    return random.Random(':'.join(map(str, (seed,) + case)))
+
+
+def _measure_memory(factory, workload, distribution, ops, seed, range_length):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        tree = factory.build()
+        build_current, build_peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        rng = _trial_rng(seed, 'memory', workload, distribution)
+        operations = _operations(tree, workload, distribution, factory.size, ops, rng, range_length)
+        for fn, args in operations:
+            fn(*args)
+        _, workload_peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    factory.discard(tree)
+    return {'tree_bytes': build_current, 'build_peak_bytes': build_peak,
+            'workload_peak_bytes': workload_peak}
+
+
+def run_case(engine, order, size, workload, distribution, ops=10000, trials=5, warmup=1,
+             seed=0, range_length=100, memory=True):
+    """Benchmarks one case and returns its JSON-ready result dict."""
+    factory = _TreeFactory(engine, order, size)
+    try:
+        trial_seconds, latencies = [], []
+        for trial in range(warmup + trials):
+            tree = factory.build()
+            rng = _trial_rng(seed, engine, order, size, workload, distribution, trial)
+            operations = _operations(tree, workload, distribution, size, ops, rng, range_length)
+            gc.collect()
+            gc.disable()
+            try:
+                trial_latencies = _time_operations(operations)
+            finally:
+                gc.enable()
+            factory.discard(tree)
+            if trial < warmup:
+                continue
+            trial_seconds.append(sum(trial_latencies) / 1e9)
+            latencies.extend(trial_latencies)
+
+        latencies.sort()
+        median_seconds = sorted(trial_seconds)[len(trial_seconds) // 2]
+        result = {
+            'engine': engine, 'order': order, 'size': size,
+            'workload': workload, 'distribution': distribution,
+            'ops': ops, 'trials': trials, 'warmup': warmup,
+            'ops_per_sec': ops / median_seconds if median_seconds else None,
+            'trial_seconds': trial_seconds,
+            'latency_ns': dict({f'p{pct}': percentile(latencies, pct) for pct in PERCENTILES},
+                               mean=sum(latencies) / len(latencies), max=latencies[-1]),
+        }
+        if memory:
+            result['memory'] = _measure_memory(factory, workload, distribution, ops, seed, range_length)
+        return result
+    finally:
+        factory.close()
+
+
+def run_suite(engines=('memory',), orders=(8, 32), sizes=(10000, 100000), workloads=WORKLOADS,
+              distributions=DISTRIBUTIONS, ops=10000, trials=5, warmup=1, seed=0,
+              range_length=100, memory=True, progress=None):
+    """Runs every combination of the given parameters and returns the result document."""
+    config = {'engines': list(engines), 'orders': list(orders), 'sizes': list(sizes),
+              'workloads': list(workloads), 'distributions': list(distributions), 'ops': ops,
+              'trials': trials, 'warmup': warmup, 'seed': seed, 'range_length': range_length}
+    results = []
+    for engine in engines:
+        for order in orders:
+            for size in sizes:
+                for workload in workloads:
+                    for distribution in distributions:
+                        result = run_case(engine, order, size, workload, distribution, ops, trials,
+                                          warmup, seed, range_length, memory)
+                        results.append(result)
+                        if progress is not None:
+                            progress(result)
+    return {
+        'version': RESULT_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'machine': {'python': sys.version.split()[0], 'implementation': platform.python_implementation(),
+                    'platform': platform.platform(), 'processor': platform.processor()},
+        'config': config,
+        'results': results,
+    }
+
+
+# --- Comparing result files ---
+
+def _case_key(result):
+    return (result['engine'], result['order'], result['size'], result['workload'], result['distribution'])
+
+
+def compare_results(base, new, threshold=0.1):
+    """Matches the cases of two result documents.
+
+    Returns (case, base_ops, new_ops, change, base_p99, new_p99, regressed)
+    rows. A case regresses when its throughput falls, or its p99 latency
+    rises, by more than threshold (a fraction).
+    """
+    baseline = {_case_key(result): result for result in base['results']}
+    rows = []
+    for result in new['results']:
+        old = baseline.get(_case_key(result))
+        if old is None or not old['ops_per_sec'] or not result['ops_per_sec']:
+            continue
+        change = result['ops_per_sec'] / old['ops_per_sec'] - 1
+        old_p99, new_p99 = old['latency_ns']['p99'], result['latency_ns']['p99']
+        regressed = change < -threshold or (old_p99 and new_p99 / old_p99 - 1 > threshold)
+        rows.append((_case_key(result), old['ops_per_sec'], result['ops_per_sec'], change,
+                     old_p99, new_p99, bool(regressed)))
+    return rows
+
+
+# --- Microbenchmarks ---
+
+def benchmark_search_many(size=200000, batch=500, order=8, repeat=20, seed=0):
+    """Times a loop of search() calls against one search_many() call.
+
+    Two batch shapes are measured: clustered (a contiguous run of keys, as
+    when a handler fetches neighbouring ids) and uniformly random.
+    Returns {shape: (loop_seconds, batch_seconds)} summed over repeat runs.
+    """
+    rng = random.Random(seed)
+    tree = BPlusTree(order=order)
+    tree.bulk_load((key, key) for key in range(size))
+
+    results = {}
+    for shape in ('clustered', 'random'):
+        loop_time = batch_time = 0.0
+        for _ in range(repeat):
+            if shape == 'clustered':
+                first = rng.randrange(size - batch)
+                keys = list(range(first, first + batch))
+                rng.shuffle(keys)
+            else:
+                keys = [rng.randrange(size) for _ in range(batch)]
+
+            start = time.perf_counter()
+            expected = [tree.search(key) for key in keys]
+            loop_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            found = tree.search_many(keys)
+            batch_time += time.perf_counter() - start
+            assert found == expected
+        results[shape] = (loop_time, batch_time)
+    return results
+
+
+def benchmark_serialization(size=200000, lookups=1000, seed=0):
+    """Saves and reloads one table through each persistence path.
+
+    pickle is save_database/load_database with a .pkl file, binary the
+    same calls with a directory, whose table files use treefile.py, and
+    mmap opens that table file with Table.load(mmap=True). load covers
+    everything up to the first record being readable (for binary, the
+    lazy load of the table); get is the time for lookups random gets
+    afterwards. Returns {path: {'bytes', 'save', 'load', 'get'}} in bytes
+    and seconds.
+    """
+    rng = random.Random(seed)
+    words = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta', 'theta']
+    records = [{'id': key, 'name': f"{rng.choice(words)}-{rng.randrange(10 ** 6)}",
+                'score': rng.random() * 100, 'count': rng.randrange(1000)} for key in range(size)]
+    probes = [rng.randrange(size) for _ in range(lookups)]
+    schema = {'id': int, 'name': str, 'score': float, 'count': int}
+    manager = DatabaseManager()
+    with contextlib.redirect_stdout(io.StringIO()):
+        manager.create_database('bench')
+        manager.create_table('bench', 'rows', schema, order=32, search_key='id')
+        manager.get_table('bench', 'rows').insert_many(records)
+
+    def timed_call(function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        return result, time.perf_counter() - start
+
+    def load_and_get(target):
+        loaded = DatabaseManager()
+        loaded.load_database(target)
+        return loaded.get_table('bench', 'rows').get(probes[0])
+
+    results = {}
+    directory = tempfile.mkdtemp(prefix='bptree-serialization-')
+    try:
+        for path, target in (('pickle', os.path.join(directory, 'db.pkl')),
+                             ('binary', os.path.join(directory, 'db'))):
+            gc.collect()
+            _, save = timed_call(manager.save_database, target)
+            _, load = timed_call(load_and_get, target)
+            loaded = DatabaseManager()
+            loaded.load_database(target)
+            table = loaded.get_table('bench', 'rows')
+            _, get = timed_call(lambda: [table.get(key) for key in probes])
+            if os.path.isdir(target):
+                nbytes = sum(os.path.getsize(os.path.join(root, name))
+                             for root, _, names in os.walk(target) for name in names)
+            else:
+                nbytes = os.path.getsize(target)
+            results[path] = {'bytes': nbytes, 'save': save, 'load': load, 'get': get}
+
+        table_file = os.path.join(directory, 'db', manager._catalog[('bench', 'rows')]['file'])
+        mapped, load = timed_call(Table.load, table_file, True)
+        _, get = timed_call(lambda: [mapped.get(key) for key in probes])
+        mapped.close()
+        results['mmap'] = {'bytes': os.path.getsize(table_file), 'save': results['binary']['save'],
+                           'load': load, 'get': get}
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def benchmark_lookup_cache(size=1000000, gets=200000, capacity=10000, theta=0.99, engines=ENGINES, seed=0):
+    """Times Table.get over zipfian keys without a cache and with each policy.
+
+    Returns {(engine, 'none' or policy): (seconds, hit_ratio)}.
+    """
+    rng = random.Random(seed)
+    keys = positions('zipfian', size, gets, rng, theta)
+    results = {}
+    directory = tempfile.mkdtemp(prefix='bptree-cache-')
+    try:
+        for engine in engines:
+            options = {'path': os.path.join(directory, 'table.pages')} if engine == 'paged' else {}
+            table = Table('bench', {'id': int, 'value': int}, search_key='id', engine=engine, **options)
+            with contextlib.redirect_stdout(io.StringIO()):
+                table.insert_many({'id': key, 'value': key} for key in range(size))
+            for policy in (None, 'lru', 'slru'):
+                cache = None if policy is None else table.enable_cache(capacity, policy=policy)
+                get = table.get
+                start = time.perf_counter()
+                for key in keys:
+                    get(key)
+                elapsed = time.perf_counter() - start
+                results[engine, policy or 'none'] = (elapsed, 0.0 if cache is None else cache.stats()['hit_ratio'])
+                table.disable_cache()
+            table.drop()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def benchmark_delete_range(size=1000000, spans=(1000, 100000, 500000), order=32, seed=0):
+    """Times purging a run of keys with delete() per key against delete_range().
+
+    Each method starts from a fresh tree of size keys; the lazy variant
+    includes the compact() that follows it. Returns {(span, method): seconds}.
+    """
+    rng = random.Random(seed)
+    results = {}
+    for span in spans:
+        first = rng.randrange(size - span)
+        for method in ('delete', 'delete_range', 'lazy'):
+            tree = BPlusTree(order=order)
+            tree.bulk_load((key, key) for key in range(size))
+            start = time.perf_counter()
+            if method == 'delete':
+                for key in range(first, first + span):
+                    tree.delete(key)
+            else:
+                tree.delete_range(first, first + span, (True, False), lazy=method == 'lazy')
+                tree.compact()
+            results[span, method] = time.perf_counter() - start
+            assert len(tree) == size - span
+    return results
+
+
+# --- Command line ---
+
+def _format_case(case):
+    engine, order, size, workload, distribution = case
+    return f"{engine:<6} order={order:<4} size={size:<9} {workload:<7} {distribution:<10}"
+
+
+def _print_result(result):
+    latency = result['latency_ns']
+    line = (f"{_format_case(_case_key(result))} {result['ops_per_sec']:>12,.0f} ops/s  "
+            f"p50 {latency['p50'] / 1e3:8.2f} us  p99 {latency['p99'] / 1e3:8.2f} us")
+    if 'memory' in result:
+        line += f"  peak {result['memory']['build_peak_bytes'] / 2 ** 20:8.1f} MiB"
+    print(line, flush=True)
+
+
+def _cmd_run(args):
+    document = run_suite(args.engines, args.orders, args.sizes, args.workloads, args.distributions,
+                         args.ops, args.trials, args.warmup, args.seed, args.range_length,
+                         not args.no_memory, progress=_print_result)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+        print(f"Results written to {args.output}")
+    return 0
+
+
+def _cmd_compare(args):
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    rows = compare_results(base, new, args.threshold)
+    if not rows:
+        print("No cases in common.")
+        return 0
+    for case, old_ops, new_ops, change, old_p99, new_p99, regressed in rows:
+        flag = 'REGRESSION' if regressed else ''
+        print(f"{_format_case(case)} {old_ops:>12,.0f} -> {new_ops:>12,.0f} ops/s ({change:+7.1%})  "
+              f"p99 {old_p99 / 1e3:8.2f} -> {new_p99 / 1e3:8.2f} us  {flag}")
+    regressions = sum(row[-1] for row in rows)
+    print(f"{regressions} of {len(rows)} cases regressed by more than {args.threshold:.0%}.")
+    return 1 if regressions else 0
+
+
+def _cmd_search_many(args):
+    for shape, (loop_time, batch_time) in benchmark_search_many().items():
+        print(f"{shape:>9}: search loop {loop_time * 1e3:8.2f} ms | "
+              f"search_many {batch_time * 1e3:8.2f} ms | speedup {loop_time / batch_time:5.2f}x")
+    return 0
+
+
+def _cmd_serialization(args):
+    results = benchmark_serialization(args.size, args.lookups)
+    base = results['pickle']
+    for path, result in results.items():
+        print(f"{path:>7}: {result['bytes'] / 2 ** 20:8.2f} MiB ({result['bytes'] / base['bytes']:5.2f}x) | "
+              f"save {result['save'] * 1e3:8.1f} ms | load {result['load'] * 1e3:8.1f} ms "
+              f"({base['load'] / result['load']:6.1f}x faster) | "
+              f"{args.lookups} gets {result['get'] * 1e3:7.2f} ms")
+    return 0
+
+
+def _cmd_lookup_cache(args):
+    results = benchmark_lookup_cache(args.size, args.gets, args.capacity, args.theta, args.engines)
+    for (engine, policy), (elapsed, hit_ratio) in results.items():
+        base = results[engine, 'none'][0]
+        print(f"{engine:<6} {policy:>5}: {args.gets / elapsed:12,.0f} gets/s | hit ratio {hit_ratio:6.1%} | "
+              f"speedup {base / elapsed:5.2f}x")
+    return 0
+
+
+def _cmd_delete_range(args):
+    results = benchmark_delete_range(args.size, args.spans, args.order)
+    for (span, method), elapsed in results.items():
+        base = results[span, 'delete']
+        print(f"{span:>9} keys {method:>12}: {elapsed * 1e3:10.2f} ms | speedup {base / elapsed:8.1f}x")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='run the benchmark matrix')
+    run.add_argument('--engines', nargs='+', choices=ENGINES, default=['memory'])
+    run.add_argument('--orders', nargs='+', type=int, default=[8, 32])
+    run.add_argument('--sizes', nargs='+', type=int, default=[10000, 100000])
+    run.add_argument('--workloads', nargs='+', choices=WORKLOADS, default=list(WORKLOADS))
+    run.add_argument('--distributions', nargs='+', choices=DISTRIBUTIONS, default=list(DISTRIBUTIONS))
+    run.add_argument('--ops', type=int, default=10000, help='operations per trial')
+    run.add_argument('--trials', type=int, default=5)
+    run.add_argument('--warmup', type=int, default=1, help='untimed trials run first')
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--range-length', type=int, default=100, help='rows covered by each range query')
+    run.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    run.add_argument('-o', '--output', help='write JSON results to this file')
+    run.set_defaults(func=_cmd_run)
+
+    compare = commands.add_parser('compare', help='flag regressions between two result files')
+    compare.add_argument('base')
+    compare.add_argument('new')
+    compare.add_argument('--threshold', type=float, default=0.1,
+                         help='allowed slowdown as a fraction (default 0.1)')
+    compare.set_defaults(func=_cmd_compare)
+
+    search_many = commands.add_parser('search-many', help='search() loop versus search_many()')
+    search_many.set_defaults(func=_cmd_search_many)
+
+    serialization = commands.add_parser('serialization',
+                                        help='pickle versus binary table files: size, save and load time')
+    serialization.add_argument('--size', type=int, default=200000, help='rows in the table')
+    serialization.add_argument('--lookups', type=int, default=1000, help='random gets timed after loading')
+    serialization.set_defaults(func=_cmd_serialization)
+
+    lookup_cache = commands.add_parser('lookup-cache', help='Table.get on zipfian keys with and without a cache')
+    lookup_cache.add_argument('--size', type=int, default=1000000, help='rows in the table')
+    lookup_cache.add_argument('--gets', type=int, default=200000)
+    lookup_cache.add_argument('--capacity', type=int, default=10000, help='cache entries')
+    lookup_cache.add_argument('--theta', type=float, default=0.99, help='zipfian skew')
+    lookup_cache.add_argument('--engines', nargs='+', choices=ENGINES, default=list(ENGINES))
+    lookup_cache.set_defaults(func=_cmd_lookup_cache)
+
+    delete_range = commands.add_parser('delete-range', help='per-key delete() versus delete_range()')
+    delete_range.add_argument('--size', type=int, default=1000000, help='keys in the tree')
+    delete_range.add_argument('--spans', nargs='+', type=int, default=[1000, 100000, 500000],
+                              help='keys purged per run')
+    delete_range.add_argument('--order', type=int, default=32)
+    delete_range.set_defaults(func=_cmd_delete_range)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,22 +1,33 @@
 import bisect
+import itertools
 import math
+import sys
+import weakref
 from typing import Any, List, Optional, Tuple, Union
 from graphviz import Digraph
+from keys import shortest_separator
+from metrics import TreeMetrics
 
 NodeValue = Union['BPlusTreeNode', Any] # Child node or actual data
 
 class BPlusTreeNode:
-    """Represents a node in the B+ Tree (Internal or Leaf)."""
-    def __init__(self, order, parent = None, is_leaf = False):
-        self.order = order
+    """Represents a node in the B+ Tree (Internal or Leaf).
+
+    Nodes use __slots__ and leave the order to the tree, so a node costs
+    only its parent pointer, its two lists and the epoch it was created in.
+    """
+    __slots__ = ('parent', 'keys', 'values', 'epoch')
+    is_leaf = False
+    clock = 0  # current snapshot epoch; BPlusTree.snapshot() advances it
+
+    def __init__(self, parent = None):
         self.parent = parent
         self.keys = []
-        self.values = [] 
-        self.is_leaf = is_leaf
-        self.next = None
+        self.values = []
+        self.epoch = BPlusTreeNode.clock
 
-    def is_full(self):
-        return len(self.keys) == self.order - 1
+    def is_full(self, order: int):
+        return len(self.keys) == order - 1
 
     def has_excess_keys(self, min_keys: int):
         return len(self.keys) > min_keys
@@ -25,17 +36,183 @@ class BPlusTreeNode:
         if self.parent is None: return False
         return len(self.keys) < min_keys
 
+    def __setstate__(self, state):
+        # Slotted nodes pickle as (None, slots). Nodes pickled before they
+        # had slots carry an attribute dict (with their order, is_leaf and
+        # next as well); they only live until BPlusTree.__setstate__
+        # rebuilds their tree from its leaves.
+        if isinstance(state, tuple):
+            state = state[1]
+        self.parent = state.get('parent')
+        self.keys = state['keys']
+        self.values = state['values']
+        self.epoch = state.get('epoch', 0)
+        if 'next' in state and self.is_leaf:
+            self.next = state['next']
+
+class LeafNode(BPlusTreeNode):
+    """Leaf holding keys and their values, linked to the next leaf."""
+    __slots__ = ('next',)
+    is_leaf = True
+
+    def __init__(self, parent = None):
+        super().__init__(parent)
+        self.next = None
+
+class InternalNode(BPlusTreeNode):
+    """Internal node whose values are its len(keys) + 1 children."""
+    __slots__ = ()
+
 class BPlusTree:
+    _leaf_class = LeafNode
+    _internal_class = InternalNode
+    metrics = None  # TreeMetrics while enable_metrics() is in effect
+    _pending = frozenset()  # keys whose paths lazy delete_range calls left underfull
 
-    def __init__(self, order = 4):
+    def __init__(self, order = 4, debug = False):
         if order < 3: 
             raise ValueError("B+ Tree order must be at least 3")
         self.order = order
-        self.root = BPlusTreeNode(order, is_leaf=True)
+        self.debug = debug  # check invariants on every descent
+        self.root = self._leaf_class()
         self._min_keys = self.order // 2
+        self._size = 0
+        self._pins = {}  # epoch -> number of live snapshots taken in it
+        self._shared_epoch = -1  # nodes from this epoch or earlier may be shared with a snapshot
+
+    def __len__(self):
+        return self._size
+
+    def __getstate__(self):
+        # Pickling the node graph recurses once per leaf through the next
+        # links, so store the sorted items and rebuild the tree on load.
+        state = self.__dict__.copy()
+        state['root'] = None
+        state['_items'] = self.get_all()
+        state.pop('metrics', None)
+        state.pop('_find_leaf', None)
+        state.pop('_pending', None)  # the rebuilt tree is full
+        return state
+
+    def __setstate__(self, state):
+        if '_items' in state:
+            items = state.pop('_items')
+        else:
+            items = list(self._legacy_items(state['root']))
+        state.setdefault('debug', False)
+        self.__dict__.update(state)
+        self.root = self._leaf_class()
+        self._size = 0
+        self._pins = {}
+        self._shared_epoch = -1
+        self.bulk_load(items)
+
+    @staticmethod
+    def _legacy_items(root):
+        # Trees pickled before nodes had slots arrive as their node graph,
+        # every node a plain BPlusTreeNode; internal ones hold one more value
+        # (a child) than they have keys.
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if len(node.values) == len(node.keys) + 1:
+                stack.extend(reversed(node.values))
+            else:
+                yield from zip(node.keys, node.values)
+
+    def snapshot(self):
+        """Returns a read-only view of the tree as it is now, in O(1).
+
+        The view keeps the current root. From then on the tree copies a
+        node before changing it if any live snapshot can still reach it,
+        and rewires the copy's parent path up to a new root. Unchanged
+        subtrees stay shared, and old versions are freed once the last
+        snapshot that sees them is dropped.
+        """
+        epoch = BPlusTreeNode.clock
+        BPlusTreeNode.clock += 1
+        self._pins[epoch] = self._pins.get(epoch, 0) + 1
+        self._shared_epoch = max(self._shared_epoch, epoch)
+        view = self._snapshot_view()
+        weakref.finalize(view, self._release_snapshot, epoch)
+        return view
+
+    def _snapshot_view(self):
+        return BPlusTreeSnapshot(self)
+
+    def _release_snapshot(self, epoch):
+        self._pins[epoch] -= 1
+        if not self._pins[epoch]:
+            del self._pins[epoch]
+            self._shared_epoch = max(self._pins, default=-1)
+
+    def _writable(self, node):
+        # Returns a version of node that no snapshot can see, copying it and
+        # its ancestors if needed. Snapshots only follow keys and values from
+        # their root, so parent and next links of shared nodes may be rewired.
+        if node.epoch > self._shared_epoch:
+            return node
+        copy = type(node)(node.parent)
+        copy.keys = node.keys[:]
+        copy.values = node.values[:]
+        if node.parent is None:
+            self.root = copy
+        else:
+            parent = self._writable(node.parent)
+            parent.values[parent.values.index(node)] = copy
+            copy.parent = parent
+        if node.is_leaf:
+            copy.next = node.next
+            prev = self._prev_leaf(copy)
+            if prev is not None:
+                prev.next = copy
+        else:
+            for child in copy.values:
+                child.parent = copy
+        return copy
+
+    def _prev_leaf(self, leaf):
+        # Climb to the nearest ancestor with a left sibling subtree, then
+        # descend its rightmost path.
+        node = leaf
+        while node.parent is not None:
+            parent = node.parent
+            idx = parent.values.index(node)
+            if idx > 0:
+                node = parent.values[idx - 1]
+                while not node.is_leaf:
+                    node = node.values[-1]
+                return node
+            node = parent
+        return None
 
-    
     def _find_leaf(self, key: Any):
+        if self.debug:
+            return self._find_leaf_checked(key)
+        bisect_right = bisect.bisect_right
+        node = self.root
+        while not node.is_leaf:
+            node = node.values[bisect_right(node.keys, key)]
+        return node
+
+    def _find_leaf_counted(self, key: Any):
+        # Installed as _find_leaf by enable_metrics(), so the plain descent
+        # pays nothing for the counters while they are off.
+        if self.debug:
+            leaf = self._find_leaf_checked(key)
+            node, visits = leaf, 1
+            while node.parent is not None:
+                node, visits = node.parent, visits + 1
+        else:
+            node, visits = self.root, 1
+            while not node.is_leaf:
+                node = node.values[bisect.bisect_right(node.keys, key)]
+                visits += 1
+            leaf = node
+        self.metrics.node_visits += visits
+        return leaf
+
+    def _find_leaf_checked(self, key: Any):
         
         node = self.root
         while not node.is_leaf:
@@ -47,6 +224,91 @@ class BPlusTree:
             node = next_node
         return node
 
+    def enable_metrics(self, metrics=None):
+        """Starts counting node visits, splits, merges, borrows and leaf hops.
+
+        Pass an existing TreeMetrics to keep accumulating into it, e.g. when
+        a tree is rebuilt. Returns the counters.
+        """
+        self.metrics = metrics if metrics is not None else TreeMetrics()
+        self._find_leaf = self._find_leaf_counted
+        return self.metrics
+
+    def disable_metrics(self):
+        self.__dict__.pop('metrics', None)
+        self.__dict__.pop('_find_leaf', None)
+
+    def stats(self):
+        """Returns structural statistics, plus the counters if metrics are enabled.
+
+        Fill is the share of key slots in use, per level from the root
+        down. bytes_estimate covers the nodes and their lists but not the
+        keys and values they hold. Visits every node.
+        """
+        levels = []
+        level = [self.root]
+        nbytes = 0
+        capacity = self.order - 1
+        while level:
+            keys = sum(len(node.keys) for node in level)
+            levels.append({'nodes': len(level), 'keys': keys, 'fill': keys / (len(level) * capacity)})
+            nbytes += sum(sys.getsizeof(node) + sys.getsizeof(node.keys) + sys.getsizeof(node.values)
+                          for node in level)
+            level = [] if level[0].is_leaf else [child for node in level for child in node.values]
+        stats = {
+            'size': self._size,
+            'order': self.order,
+            'height': len(levels),
+            'nodes': sum(entry['nodes'] for entry in levels),
+            'leaves': levels[-1]['nodes'],
+            'levels': levels,
+            'bytes_estimate': nbytes,
+        }
+        if self.metrics is not None:
+            stats['counters'] = self.metrics.as_dict()
+        return stats
+
+    def validate(self):
+        """Checks every structural invariant, raising AssertionError on the first violation.
+
+        Covers key order, separator bounds, child counts, parent pointers,
+        node capacity, uniform leaf depth, the leaf chain and the size count.
+        """
+        def fail(message):
+            raise AssertionError(message)
+
+        if self.root.parent is not None: fail("Root has a parent")
+        leaves = []
+        depths = set()
+        stack = [(self.root, None, None, 0)]  # (node, low bound inclusive, high bound exclusive, depth)
+        while stack:
+            node, low, high, depth = stack.pop()
+            keys = node.keys
+            if len(keys) >= self.order: fail(f"Overfull node with {len(keys)} keys")
+            if any(keys[i] > keys[i + 1] for i in range(len(keys) - 1)): fail(f"Unsorted keys {keys}")
+            if keys and low is not None and keys[0] < low: fail(f"Key {keys[0]!r} below bound {low!r}")
+            if keys and high is not None and keys[-1] >= high: fail(f"Key {keys[-1]!r} not below bound {high!r}")
+            if node.is_leaf:
+                if len(node.values) != len(keys): fail(f"Leaf has {len(keys)} keys, {len(node.values)} values")
+                depths.add(depth)
+                leaves.append(node)
+                continue
+            if len(node.values) != len(keys) + 1:
+                fail(f"Internal node has {len(keys)} keys, {len(node.values)} children")
+            bounds = [low] + keys + [high]
+            # Pushed right to left so leaves are collected in key order.
+            for i in range(len(node.values) - 1, -1, -1):
+                child = node.values[i]
+                if child.parent is not node: fail(f"Child {child} does not point back to its parent")
+                stack.append((child, bounds[i], bounds[i + 1], depth + 1))
+        if len(depths) != 1: fail(f"Leaves at different depths {sorted(depths)}")
+        for left, right in zip(leaves, leaves[1:]):
+            if left.next is not right: fail("Broken leaf chain")
+        if leaves[-1].next is not None: fail("Last leaf links onward")
+        count = sum(len(leaf.keys) for leaf in leaves)
+        if count != self._size: fail(f"Size {self._size} but {count} keys stored")
+        return True
+
 
     def search(self, key):
         
@@ -58,12 +320,60 @@ class BPlusTree:
             return leaf.values[idx]
         return None
 
+    def search_many(self, keys):
+        """Looks up a batch of keys, returning their values in the caller's order.
+
+        Keys are resolved in sorted order while the current root-to-leaf
+        path is kept with each node's upper bound, so the next key only
+        climbs as far as the lowest ancestor that still covers it instead
+        of restarting at the root. Clustered batches mostly stay in the
+        same leaf or step to a neighbouring one.
+        """
+        results = [None] * len(keys)
+        path = [(self.root, None)]  # (node, exclusive upper bound of its key range)
+        visits = 1
+        for i in sorted(range(len(keys)), key=keys.__getitem__):
+            key = keys[i]
+            while len(path) > 1 and path[-1][1] is not None and key >= path[-1][1]:
+                path.pop()
+            node, high = path[-1]
+            while not node.is_leaf:
+                idx = bisect.bisect_right(node.keys, key)
+                if idx < len(node.keys):
+                    high = node.keys[idx]
+                node = node.values[idx]
+                path.append((node, high))
+                visits += 1
+            idx = bisect.bisect_left(node.keys, key)
+            if idx < len(node.keys) and node.keys[idx] == key:
+                results[i] = node.values[idx]
+        if self.metrics is not None:
+            self.metrics.node_visits += visits
+        return results
+
     def insert(self, key, value):
         
         leaf = self._find_leaf(key)
-        insert_idx = bisect.bisect_left(leaf.keys, key)
-        leaf.keys.insert(insert_idx, key)
-        leaf.values.insert(insert_idx, value)
+        self._insert_at(leaf, bisect.bisect_left(leaf.keys, key), key, value)
+
+    def insert_if_absent(self, key, value):
+        """Inserts key unless it is already present; returns whether it was inserted.
+
+        The duplicate check and the insert share one descent.
+        """
+        leaf = self._find_leaf(key)
+        idx = bisect.bisect_left(leaf.keys, key)
+        if idx < len(leaf.keys) and leaf.keys[idx] == key:
+            return False
+        self._insert_at(leaf, idx, key, value)
+        return True
+
+    def _insert_at(self, leaf, idx, key, value):
+        if leaf.epoch <= self._shared_epoch:
+            leaf = self._writable(leaf)
+        leaf.keys.insert(idx, key)
+        leaf.values.insert(idx, value)
+        self._size += 1
         if len(leaf.keys) == self.order: # Overflow check
             self._split_node(leaf)
 
@@ -74,19 +384,142 @@ class BPlusTree:
         idx = bisect.bisect_left(leaf.keys, key)
         # Verify key exists at that index
         if idx < len(leaf.keys) and leaf.keys[idx] == key:
-            leaf.keys.pop(idx)
-            leaf.values.pop(idx)
-            if leaf.is_underflow(self._min_keys):
-                self._handle_underflow(leaf)
+            self._delete_at(leaf, idx)
             return True 
         return False 
 
+    def _delete_at(self, leaf, idx):
+        if leaf.epoch <= self._shared_epoch:
+            leaf = self._writable(leaf)
+        leaf.keys.pop(idx)
+        leaf.values.pop(idx)
+        self._size -= 1
+        if leaf.is_underflow(self._min_keys):
+            self._handle_underflow(leaf)
+
+    def delete_range(self, start=None, end=None, inclusive=(True, True), lazy=False):
+        """Deletes every key between start and end and returns how many went.
+
+        Bounds and inclusive work as in scan(). Subtrees that lie wholly
+        inside the range are unlinked from their parents without visiting
+        their entries one by one; only the leaves holding the two bounds
+        are cut, and the nodes on the paths to them are rebalanced once,
+        so purging k keys costs about O(log n + k / order) rather than k
+        separate deletes. With lazy=True the rebalancing is left to a later
+        compact(): the tree stays correct for every operation in between,
+        only less full.
+        """
+        include_start, include_end = inclusive
+        if start is not None and end is not None and (end < start or (end == start and not (include_start and include_end))):
+            return 0
+        if next(self.scan(start, end, inclusive, limit=1), None) is None:
+            return 0
+        if start is None and end is None:
+            return self._clear()
+        edges = []  # the leaves the range was cut from, left to right
+        removed = self._trim(self._writable(self.root), start, end, include_start, include_end, edges)
+        if len(edges) == 2:
+            edges[0].next = edges[1]
+        elif end is None:
+            edges[0].next = None
+        self._size -= removed
+        if not self._size:
+            # Nothing left to rebalance; an empty tree is a bare leaf.
+            self._clear()
+            return removed
+        cuts = [key for key in (start, end) if key is not None]
+        if lazy:
+            self._pending = self._pending | set(cuts)
+        else:
+            for key in cuts:
+                self._settle(key)
+        return removed
+
+    def _clear(self):
+        removed = self._size
+        self.root = self._leaf_class()
+        self._size = 0
+        self._pending = set()
+        return removed
+
+    def compact(self):
+        """Rebalances the nodes left underfull by lazy delete_range calls."""
+        for key in sorted(self._pending):
+            self._settle(key)
+        self._pending = set()
+
+    def _trim(self, node, start, end, include_start, include_end, edges):
+        # Removes the keys between start and end from node's subtree, which
+        # is writable, and returns how many there were. Children wholly in
+        # the range are dropped; at most two partial ones are descended.
+        if node.is_leaf:
+            keys = node.keys
+            lo = 0 if start is None else (bisect.bisect_left if include_start else bisect.bisect_right)(keys, start)
+            hi = len(keys) if end is None else (bisect.bisect_right if include_end else bisect.bisect_left)(keys, end)
+            edges.append(node)
+            if lo >= hi:
+                return 0
+            del keys[lo:hi]
+            del node.values[lo:hi]
+            return hi - lo
+        first = 0 if start is None else bisect.bisect_right(node.keys, start)
+        last = len(node.values) - 1 if end is None else bisect.bisect_right(node.keys, end)
+        if first == last:
+            return self._trim(self._writable(node.values[first]), start, end, include_start, include_end, edges)
+        removed = 0
+        if start is not None:
+            removed += self._trim(self._writable(node.values[first]), start, None, include_start, include_end, edges)
+        if end is not None:
+            removed += self._trim(self._writable(node.values[last]), None, end, include_start, include_end, edges)
+        # Children lo..hi lie wholly inside. The separator kept in front of
+        # the first child after them still divides what remains.
+        lo, hi = first + (start is not None), last - (end is not None)
+        if lo <= hi:
+            for child in node.values[lo:hi + 1]:
+                removed += self._subtree_size(child)
+            del node.values[lo:hi + 1]
+            if lo:
+                del node.keys[lo - 1:hi]
+            else:
+                del node.keys[:hi + 1]
+        return removed
+
+    def _subtree_size(self, node):
+        # Entries stored below node, counted leaf by leaf.
+        count = 0
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.is_leaf:
+                count += len(node.keys)
+            else:
+                stack.extend(node.values)
+        return count
+
+    def _settle(self, key):
+        # Repairs every underfull node on the path to key, bottom up. The
+        # path is found again for each level, since merges below reshape it.
+        height = 0
+        while True:
+            path = [self.root]
+            while not path[-1].is_leaf:
+                node = path[-1]
+                path.append(node.values[bisect.bisect_right(node.keys, key)])
+            if height >= len(path):
+                break
+            self._repair(self._writable(path[-1 - height]))
+            height += 1
+        # Cutting may leave a chain of only children under the root.
+        while not self.root.is_leaf and len(self.root.values) == 1:
+            self.root = self.root.values[0]
+            self.root.parent = None
+
     def update(self, key, new_value):
         
         leaf = self._find_leaf(key)
         idx = bisect.bisect_left(leaf.keys, key)
         if idx < len(leaf.keys) and leaf.keys[idx] == key:
-            leaf.values[idx] = new_value
+            self._writable(leaf).values[idx] = new_value
             return True
         return False # Key not found
 
@@ -122,11 +555,15 @@ class BPlusTree:
     #         node = node.next  # Linked list traversal
     #     return results
     def _split_node(self, node):
+        if self.metrics is not None:
+            self.metrics.splits += 1
         mid = self.order // 2
-        new_sibling = BPlusTreeNode(self.order, node.parent, node.is_leaf)
+        new_sibling = type(node)(node.parent)
         
         if node.is_leaf:
-            key_to_parent = node.keys[mid]
+            # Any key above the left half and up to the right one divides
+            # them; the shortest keeps string separators small.
+            key_to_parent = shortest_separator(node.keys[mid - 1], node.keys[mid])
             new_sibling.keys = node.keys[mid:]
             new_sibling.values = node.values[mid:]
             node.keys = node.keys[:mid]
@@ -160,6 +597,8 @@ class BPlusTree:
                 results.append((key, leaf.values[i]))
             
             leaf = leaf.next  # Use the properly maintained linked list
+            if self.metrics is not None:
+                self.metrics.leaf_hops += 1
         
         return results
 
@@ -175,8 +614,157 @@ class BPlusTree:
             for i, k in enumerate(current_leaf.keys): 
                 result.append((k, current_leaf.values[i]))
             current_leaf = current_leaf.next
+            if self.metrics is not None:
+                self.metrics.leaf_hops += 1
         return result
 
+    def scan(self, start=None, end=None, inclusive=(True, True), reverse=False, limit=None, offset=0):
+        """Lazily yields (key, value) pairs between start and end in key order.
+
+        A missing bound leaves that side open; ``inclusive`` says whether each
+        bound itself is returned. Forward scans walk the leaf ``next`` chain,
+        reverse scans keep the descent path on a stack to step back a leaf,
+        so the first row costs O(log n) and memory stays O(height).
+        """
+        include_start, include_end = inclusive
+        if reverse:
+            items = self._scan_reverse(start, end, include_start, include_end)
+        else:
+            items = self._scan_forward(start, end, include_start, include_end)
+        if offset or limit is not None:
+            items = itertools.islice(items, offset, None if limit is None else offset + limit)
+        return items
+
+    def _scan_forward(self, start, end, include_start, include_end):
+        if start is None:
+            leaf = self.root
+            while not leaf.is_leaf:
+                leaf = leaf.values[0]
+            idx = 0
+        else:
+            leaf = self._find_leaf(start)
+            idx = (bisect.bisect_left if include_start else bisect.bisect_right)(leaf.keys, start)
+        while leaf is not None:
+            keys, values = leaf.keys, leaf.values
+            for i in range(idx, len(keys)):
+                key = keys[i]
+                if end is not None and (key > end or (key == end and not include_end)):
+                    return
+                yield key, values[i]
+            leaf = leaf.next
+            idx = 0
+            if self.metrics is not None:
+                self.metrics.leaf_hops += 1
+
+    def _scan_reverse(self, start, end, include_start, include_end):
+        stack = []  # (internal node, index of the child being visited)
+        node = self.root
+        while not node.is_leaf:
+            idx = len(node.values) - 1 if end is None else bisect.bisect_right(node.keys, end)
+            stack.append((node, idx))
+            node = node.values[idx]
+        if end is None:
+            i = len(node.keys) - 1
+        else:
+            i = (bisect.bisect_right if include_end else bisect.bisect_left)(node.keys, end) - 1
+        while True:
+            keys, values = node.keys, node.values
+            while i >= 0:
+                key = keys[i]
+                if start is not None and (key < start or (key == start and not include_start)):
+                    return
+                yield key, values[i]
+                i -= 1
+            # Step to the previous leaf: climb to the nearest ancestor with a
+            # left sibling subtree, then descend its rightmost path.
+            while stack and stack[-1][1] == 0:
+                stack.pop()
+            if not stack:
+                return
+            parent, idx = stack.pop()
+            stack.append((parent, idx - 1))
+            node = parent.values[idx - 1]
+            while not node.is_leaf:
+                stack.append((node, len(node.values) - 1))
+                node = node.values[-1]
+            i = len(node.keys) - 1
+            if self.metrics is not None:
+                self.metrics.leaf_hops += 1
+
+    def bulk_load(self, sorted_items, fill_factor=1.0):
+        """Builds the tree bottom-up from (key, value) pairs sorted by key.
+
+        Leaves are packed to ``fill_factor`` of their capacity and each
+        internal level is built from the one below it, so loading n items
+        costs O(n) instead of n separate root-to-leaf inserts.
+        """
+        if not 0 < fill_factor <= 1:
+            raise ValueError("fill_factor must be in the range (0, 1]")
+        if self._size:
+            raise ValueError("bulk_load requires an empty tree")
+
+        keys, values = [], []
+        for key, value in sorted_items:
+            if keys and key < keys[-1]:
+                raise ValueError(f"bulk_load items are not sorted: {key!r} after {keys[-1]!r}")
+            keys.append(key)
+            values.append(value)
+        if not keys:
+            return
+
+        # Leaves hold at most order - 1 keys, internal nodes at most order children.
+        leaf_target = max(self._min_keys, 1, int((self.order - 1) * fill_factor))
+        level = []  # (node, separator between it and the subtree before it)
+        prev_leaf = None
+        start = 0
+        for size in self._chunk_sizes(len(keys), leaf_target, self._min_keys, self.order - 1):
+            leaf = self._leaf_class()
+            leaf.keys = keys[start:start + size]
+            leaf.values = values[start:start + size]
+            if prev_leaf is not None:
+                prev_leaf.next = leaf
+                level.append((leaf, shortest_separator(prev_leaf.keys[-1], leaf.keys[0])))
+            else:
+                level.append((leaf, leaf.keys[0]))
+            prev_leaf = leaf
+            start += size
+
+        min_children = (self.order + 1) // 2
+        child_target = max(min_children, int(self.order * fill_factor))
+        while len(level) > 1:
+            parents = []
+            start = 0
+            for size in self._chunk_sizes(len(level), child_target, min_children, self.order):
+                group = level[start:start + size]
+                node = self._internal_class()
+                node.keys = [separator for _, separator in group[1:]]
+                node.values = [child for child, _ in group]
+                for child in node.values:
+                    child.parent = node
+                parents.append((node, group[0][1]))
+                start += size
+            level = parents
+
+        self.root = level[0][0]
+        self.root.parent = None
+        self._size = len(keys)
+
+    @staticmethod
+    def _chunk_sizes(total, target, minimum, maximum):
+        # Split total entries into runs of target, folding a short tail into
+        # its neighbour so that no non-root node ends up underfull.
+        sizes = [target] * (total // target)
+        tail = total % target
+        if tail:
+            sizes.append(tail)
+        if len(sizes) > 1 and sizes[-1] < minimum:
+            combined = sizes.pop() + sizes.pop()
+            if combined <= maximum:
+                sizes.append(combined)
+            else:
+                sizes.extend((combined - combined // 2, combined // 2))
+        return sizes
+
     # def _split_node(self, node):
     #     mid = self.order // 2
     #     new_sibling = BPlusTreeNode(self.order, node.parent, node.is_leaf)
@@ -203,7 +791,7 @@ class BPlusTree:
     def _insert_in_parent(self, left_child, key, right_child):
         parent = left_child.parent
         if parent is None:
-            new_root = BPlusTreeNode(self.order, is_leaf=False)
+            new_root = self._internal_class()
             new_root.keys = [key]
             new_root.values = [left_child, right_child]
             left_child.parent = new_root
@@ -214,7 +802,8 @@ class BPlusTree:
         parent.keys.insert(insert_idx, key)
         parent.values.insert(insert_idx + 1, right_child)
         right_child.parent = parent
-        assert len(parent.values) == len(parent.keys) + 1, "Inv fail insert parent"
+        if self.debug:
+            assert len(parent.values) == len(parent.keys) + 1, "Inv fail insert parent"
         if len(parent.keys) == self.order: 
             self._split_node(parent)
 
@@ -232,28 +821,55 @@ class BPlusTree:
         if child_index > 0: # Try borrow left
             left_sibling = parent.values[child_index - 1]
             if left_sibling.has_excess_keys(self._min_keys): 
-                self._borrow_from_left(node, left_sibling, parent, child_index)
+                self._borrow_from_left(node, self._writable(left_sibling), parent, child_index)
                 return
         if child_index < len(parent.values) - 1: # Try borrow right
             right_sibling = parent.values[child_index + 1]
             if right_sibling.has_excess_keys(self._min_keys): 
-                self._borrow_from_right(node, right_sibling, parent, child_index)
+                self._borrow_from_right(node, self._writable(right_sibling), parent, child_index)
                 return
         if child_index > 0: # Merge left
-            self._merge_nodes(parent.values[child_index - 1], node, parent, child_index - 1)
+            self._merge_nodes(self._writable(parent.values[child_index - 1]), node, parent, child_index - 1)
         elif child_index < len(parent.values) - 1: # Merge right
              self._merge_nodes(node, parent.values[child_index + 1], parent, child_index)
-        else: 
-            raise RuntimeError(f"Unexpected state in handle_underflow N {node}")
+        else: # An only child, which only delete_range leaves behind
+            self._repair(node)
+
+    def _repair(self, node):
+        # Repeats borrow and merge steps until node holds the minimum again.
+        # After delete_range it can be far short of it, or be its parent's
+        # only child, in which case the parent is repaired first.
+        while node.is_underflow(self._min_keys):
+            parent = node.parent
+            if len(parent.values) == 1:
+                if parent.parent is None:
+                    self.root = node
+                    node.parent = None
+                    return
+                self._repair(parent)
+                continue
+            idx = parent.values.index(node)
+            if idx > 0 and parent.values[idx - 1].has_excess_keys(self._min_keys):
+                self._borrow_from_left(node, self._writable(parent.values[idx - 1]), parent, idx)
+            elif idx < len(parent.values) - 1 and parent.values[idx + 1].has_excess_keys(self._min_keys):
+                self._borrow_from_right(node, self._writable(parent.values[idx + 1]), parent, idx)
+            elif idx > 0:
+                left = self._writable(parent.values[idx - 1])
+                self._merge_nodes(left, node, parent, idx - 1)
+                node = left
+            else:
+                self._merge_nodes(node, parent.values[idx + 1], parent, idx)
 
     def _borrow_from_left(self, node, left_sibling, parent, node_idx):
+        if self.metrics is not None:
+            self.metrics.borrows += 1
         sep_idx = node_idx - 1
         if node.is_leaf:
             k = left_sibling.keys.pop()
             v = left_sibling.values.pop()
             node.keys.insert(0, k)
             node.values.insert(0, v)
-            parent.keys[sep_idx] = node.keys[0]
+            parent.keys[sep_idx] = shortest_separator(left_sibling.keys[-1], node.keys[0])
         else:
             sep_k = parent.keys[sep_idx]
             node.keys.insert(0, sep_k)
@@ -263,13 +879,15 @@ class BPlusTree:
             child.parent = node # type: ignore
 
     def _borrow_from_right(self, node, right_sibling, parent, node_idx):
+        if self.metrics is not None:
+            self.metrics.borrows += 1
         sep_idx = node_idx
         if node.is_leaf:
             k = right_sibling.keys.pop(0)
             v = right_sibling.values.pop(0)
             node.keys.append(k)
             node.values.append(v)
-            parent.keys[sep_idx] = right_sibling.keys[0] if right_sibling.keys else k
+            parent.keys[sep_idx] = shortest_separator(k, right_sibling.keys[0]) if right_sibling.keys else k
         else:
             sep_k = parent.keys[sep_idx]
             node.keys.append(sep_k)
@@ -279,6 +897,8 @@ class BPlusTree:
             child.parent = node # type: ignore
 
     def _merge_nodes(self, left_node, right_node, parent, left_idx):
+        if self.metrics is not None:
+            self.metrics.merges += 1
         sep_k = parent.keys.pop(left_idx)
         parent.values.pop(left_idx + 1)
         if not left_node.is_leaf:
@@ -292,8 +912,13 @@ class BPlusTree:
             left_node.keys.extend(right_node.keys)
             left_node.values.extend(right_node.values)
             left_node.next = right_node.next
-        assert len(left_node.values) == len(left_node.keys) + (0 if left_node.is_leaf else 1), "Inv fail merge"
-        if parent.is_underflow(self._min_keys): 
+        if self.debug:
+            assert len(left_node.values) == len(left_node.keys) + (0 if left_node.is_leaf else 1), "Inv fail merge"
+        if len(left_node.keys) >= self.order:
+            # Merging two minimal internal nodes of an even order overfills by one.
+            self._split_node(left_node)
+        # An emptied root never reports underflow, but still has to collapse.
+        if parent.is_underflow(self._min_keys) or (parent.parent is None and not parent.keys):
             self._handle_underflow(parent)
 
     # --- Visualization (Keep HTML version from previous step) ---
@@ -349,4 +974,71 @@ class BPlusTree:
             if current_node.next == next_node:
                 dot.edge(current_id, next_id, style='dashed', arrowhead='none')
 
-        return dot
\ No newline at end of file
+        return dot
+
+class BPlusTreeSnapshot(BPlusTree):
+    """Read-only, point-in-time view returned by BPlusTree.snapshot().
+
+    Reads only follow child links down from the captured root. Leaf
+    ``next`` and ``parent`` links belong to the live tree, so forward
+    scans keep their descent path on a stack, the same way reverse scans do.
+    """
+
+    def __init__(self, tree):
+        self.order = tree.order
+        self.debug = False
+        self.root = tree.root
+        self._min_keys = tree._min_keys
+        self._size = tree._size
+
+    def __setstate__(self, state):
+        items = state.pop('_items')
+        self.__dict__.update(state)
+        self.root = self._leaf_class()
+        self._size = 0
+        BPlusTree.bulk_load(self, items)
+
+    def snapshot(self):
+        return self
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("B+ tree snapshots are read-only")
+
+    insert = insert_if_absent = delete = delete_range = compact = update = bulk_load = _read_only
+
+    def range_query(self, start_key, end_key):
+        return list(self._scan_forward(start_key, end_key, True, True))
+
+    def get_all(self):
+        return list(self._scan_forward(None, None, True, True))
+
+    def _scan_forward(self, start, end, include_start, include_end):
+        stack = []  # (internal node, index of the child being visited)
+        node = self.root
+        while not node.is_leaf:
+            idx = 0 if start is None else bisect.bisect_right(node.keys, start)
+            stack.append((node, idx))
+            node = node.values[idx]
+        if start is None:
+            i = 0
+        else:
+            i = (bisect.bisect_left if include_start else bisect.bisect_right)(node.keys, start)
+        while True:
+            keys, values = node.keys, node.values
+            while i < len(keys):
+                key = keys[i]
+                if end is not None and (key > end or (key == end and not include_end)):
+                    return
+                yield key, values[i]
+                i += 1
+            while stack and stack[-1][1] == len(stack[-1][0].values) - 1:
+                stack.pop()
+            if not stack:
+                return
+            parent, idx = stack.pop()
+            stack.append((parent, idx + 1))
+            node = parent.values[idx + 1]
+            while not node.is_leaf:
+                stack.append((node, 0))
+                node = node.values[0]
+            i = 0
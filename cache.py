@@ -0,0 +1,167 @@
+import sys
+import threading
+from collections import OrderedDict
+
+POLICIES = ('lru', 'slru')
+
+
+def _row_bytes(row):
+    # Approximate footprint of a stored row: the tuple and the values in it.
+    return sys.getsizeof(row) + sum(map(sys.getsizeof, row))
+
+
+class LookupCache:
+    """Bounded cache of stored rows by key, in front of a table's tree.
+
+    With policy 'lru' the least recently used entry is evicted first.
+    'slru' (segmented LRU) admits new keys to a probationary segment and
+    promotes them to a protected one, holding protected_share of the
+    space, on their second hit; a scan of one-off keys then only evicts
+    other one-off keys and never the hot set. The bound is a number of
+    entries, approximate bytes (sizeof), or both.
+
+    Misses are not cached. A reader takes a token before searching the
+    tree and offers the row back with it; invalidate() moves the token on,
+    so a row read before a write can never be installed after it. Hits
+    take no lock; like TreeMetrics, the counters may undercount slightly
+    under contention.
+    """
+
+    def __init__(self, capacity=1024, max_bytes=None, policy='slru', protected_share=0.8, sizeof=_row_bytes):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown cache policy '{policy}', expected one of {POLICIES}")
+        if capacity is None and max_bytes is None:
+            raise ValueError("A cache needs a capacity, a max_bytes bound or both")
+        if (capacity is not None and capacity < 1) or (max_bytes is not None and max_bytes < 1):
+            raise ValueError("Cache bounds must be positive")
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.protected_share = protected_share
+        self._sizeof = sizeof if max_bytes is not None else None
+        # key -> row, least recently used first. 'lru' only uses probation.
+        self._probation = OrderedDict()
+        self._protected = OrderedDict()
+        self._sizes = {}  # key -> bytes, kept only with max_bytes
+        self._bytes = {'probation': 0, 'protected': 0}
+        self.token = 0  # moved on by every invalidation; see put()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def __len__(self):
+        return len(self._probation) + len(self._protected)
+
+    def get(self, key):
+        """Returns the cached row for key, or None, and counts the hit or miss."""
+        row = self._protected.get(key)
+        if row is not None:
+            try:
+                self._protected.move_to_end(key)
+            except KeyError:  # invalidated meanwhile
+                pass
+            self.hits += 1
+            return row
+        row = self._probation.get(key)
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self.policy == 'lru':
+            try:
+                self._probation.move_to_end(key)
+            except KeyError:
+                pass
+        else:
+            with self._lock:
+                if key in self._probation:
+                    self._move(key, self._probation, 'probation', self._protected, 'protected')
+                    self._demote()
+        return row
+
+    def peek(self, key):
+        """Returns the cached row for key, or None, without counting or reordering."""
+        row = self._protected.get(key)
+        return row if row is not None else self._probation.get(key)
+
+    def put(self, key, row, token):
+        """Caches row for key unless the cache was invalidated since token was taken."""
+        with self._lock:
+            if token != self.token or key in self._protected:
+                return
+            probation = self._probation
+            probation[key] = row
+            if self._sizeof is None:
+                if len(probation) + len(self._protected) > self.capacity:
+                    (probation or self._protected).popitem(last=False)
+                    self.evictions += 1
+                return
+            if key in self._sizes:
+                self._bytes['probation'] -= self._sizes[key]
+            self._sizes[key] = nbytes = self._sizeof(row)
+            self._bytes['probation'] += nbytes
+            while len(self) > 1 and self._over(len(self), self._bytes['probation'] + self._bytes['protected'], 1):
+                self._evict()
+
+    def invalidate(self, key):
+        """Drops key; call after every write to it."""
+        with self._lock:
+            self.token += 1
+            self.invalidations += 1
+            for segment, name in ((self._probation, 'probation'), (self._protected, 'protected')):
+                if segment.pop(key, None) is not None and self._sizeof is not None:
+                    self._bytes[name] -= self._sizes.pop(key)
+
+    def clear(self):
+        with self._lock:
+            self.token += 1
+            self._probation.clear()
+            self._protected.clear()
+            self._sizes.clear()
+            self._bytes = {'probation': 0, 'protected': 0}
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        stats = {
+            'policy': self.policy,
+            'entries': len(self),
+            'capacity': self.capacity,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+        if self.max_bytes is not None:
+            stats['bytes'] = self._bytes['probation'] + self._bytes['protected']
+            stats['max_bytes'] = self.max_bytes
+        return stats
+
+    # Callers hold the lock.
+
+    def _over(self, count, nbytes, share):
+        return ((self.capacity is not None and count > self.capacity * share)
+                or (self.max_bytes is not None and nbytes > self.max_bytes * share))
+
+    def _evict(self):
+        if self._probation:
+            key, _ = self._probation.popitem(last=False)
+            name = 'probation'
+        else:
+            key, _ = self._protected.popitem(last=False)
+            name = 'protected'
+        if self._sizeof is not None:
+            self._bytes[name] -= self._sizes.pop(key)
+        self.evictions += 1
+
+    def _move(self, key, source, source_name, target, target_name):
+        target[key] = source.pop(key)
+        if self._sizeof is not None:
+            self._bytes[source_name] -= self._sizes[key]
+            self._bytes[target_name] += self._sizes[key]
+
+    def _demote(self):
+        # The protected segment's least recently used entries get one more
+        # chance at the young end of probation.
+        while len(self._protected) > 1 and self._over(len(self._protected), self._bytes['protected'],
+                                                      self.protected_share):
+            self._move(next(iter(self._protected)), self._protected, 'protected', self._probation, 'probation')
@@ -0,0 +1,410 @@
+import bisect
+import itertools
+import threading
+from bplustree import BPlusTree, InternalNode, LeafNode
+
+
+class RWLatch:
+    """Readers-writer latch: any number of shared holders or one exclusive holder.
+
+    Built from two plain locks (the first reader in takes the write lock
+    on behalf of all readers, the last one out releases it), which keeps
+    a per-node latch small.
+    """
+    __slots__ = ('_mutex', '_write', '_readers')
+
+    def __init__(self):
+        self._mutex = threading.Lock()
+        self._write = threading.Lock()
+        self._readers = 0
+
+    def __reduce__(self):
+        # Latches are runtime state; a pickled node gets a fresh one.
+        return (RWLatch, ())
+
+    def acquire_shared(self):
+        with self._mutex:
+            self._readers += 1
+            if self._readers == 1:
+                self._write.acquire()
+
+    def release_shared(self):
+        with self._mutex:
+            self._readers -= 1
+            if self._readers == 0:
+                self._write.release()
+
+    def acquire_exclusive(self):
+        self._write.acquire()
+
+    def release_exclusive(self):
+        self._write.release()
+
+
+class LatchedLeafNode(LeafNode):
+    __slots__ = ('latch',)
+
+    def __init__(self, parent = None):
+        super().__init__(parent)
+        self.latch = RWLatch()
+
+
+class LatchedInternalNode(InternalNode):
+    __slots__ = ('latch',)
+
+    def __init__(self, parent = None):
+        super().__init__(parent)
+        self.latch = RWLatch()
+
+
+class ConcurrentBPlusTree(BPlusTree):
+    """BPlusTree that can be shared between threads.
+
+    Readers crab down with shared latches, holding at most a parent and a
+    child at a time. Writers first descend the same way and latch only
+    the leaf exclusively; if that leaf could split or underflow they
+    restart and crab down with exclusive latches, releasing every
+    ancestor as soon as a node is safe, so only the part of the path
+    that may change stays locked. Scans hold shared latches on their
+    current root-to-leaf path while they fill a batch, then release
+    everything and resume from the last key, so no latch is held while
+    the caller consumes rows.
+    """
+    _leaf_class = LatchedLeafNode
+    _internal_class = LatchedInternalNode
+    scan_batch = 256
+
+    def __init__(self, order = 4, debug = False):
+        super().__init__(order, debug)
+        self._root_latch = RWLatch()  # guards the root pointer itself
+        self._size_lock = threading.Lock()
+        self._local = threading.local()
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        del state['_size_lock'], state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self._size_lock = threading.Lock()
+        self._local = threading.local()
+        super().__setstate__(state)
+
+    def snapshot(self):
+        # Path copying would need exclusive latches all the way to the root
+        # on every write, which is what optimistic crabbing avoids.
+        raise TypeError("Snapshots are not supported on concurrent trees")
+
+    # --- Descents ---
+
+    def _descend_shared(self, key):
+        self._root_latch.acquire_shared()
+        node = self.root
+        node.latch.acquire_shared()
+        self._root_latch.release_shared()
+        while not node.is_leaf:
+            child = node.values[bisect.bisect_right(node.keys, key)]
+            child.latch.acquire_shared()
+            node.latch.release_shared()
+            node = child
+        return node
+
+    def _descend_optimistic(self, key):
+        # Shared latches on the way down, exclusive on the leaf only.
+        self._root_latch.acquire_shared()
+        node = self.root
+        if node.is_leaf:
+            node.latch.acquire_exclusive()
+            self._root_latch.release_shared()
+            return node
+        node.latch.acquire_shared()
+        self._root_latch.release_shared()
+        while True:
+            child = node.values[bisect.bisect_right(node.keys, key)]
+            if child.is_leaf:
+                child.latch.acquire_exclusive()
+                node.latch.release_shared()
+                return child
+            child.latch.acquire_shared()
+            node.latch.release_shared()
+            node = child
+
+    def _descend_exclusive(self, key, is_safe):
+        # Exclusive crabbing: ancestors are released once a node is safe.
+        held = [self._root_latch]
+        self._root_latch.acquire_exclusive()
+        node = self.root
+        node.latch.acquire_exclusive()
+        held.append(node.latch)
+        if is_safe(node):
+            held = self._release_all_but_last(held)
+        while not node.is_leaf:
+            node = node.values[bisect.bisect_right(node.keys, key)]
+            node.latch.acquire_exclusive()
+            held.append(node.latch)
+            if is_safe(node):
+                held = self._release_all_but_last(held)
+        self._local.held = held
+        return node
+
+    @staticmethod
+    def _release_all_but_last(held):
+        for latch in held[:-1]:
+            latch.release_exclusive()
+        return held[-1:]
+
+    def _release_held(self):
+        for latch in self._local.held:
+            latch.release_exclusive()
+        self._local.held = []
+
+    def _safe_for_insert(self, node):
+        return len(node.keys) < self.order - 1
+
+    def _safe_for_delete(self, node):
+        if node.parent is None:
+            return node.is_leaf or len(node.keys) > 1
+        return len(node.keys) > self._min_keys
+
+    def _handle_underflow(self, node):
+        # Borrowing and merging touch siblings, which must be latched too.
+        # The parent is already held exclusively, so no one else can reach
+        # them from above while we wait.
+        parent = node.parent
+        if parent is not None:
+            idx = parent.values.index(node)
+            for j in (idx - 1, idx + 1):
+                if 0 <= j < len(parent.values):
+                    sibling = parent.values[j]
+                    sibling.latch.acquire_exclusive()
+                    self._local.held.append(sibling.latch)
+        super()._handle_underflow(node)
+
+    # --- Reads ---
+
+    def search(self, key):
+        leaf = self._descend_shared(key)
+        try:
+            idx = bisect.bisect_left(leaf.keys, key)
+            if idx < len(leaf.keys) and leaf.keys[idx] == key:
+                return leaf.values[idx]
+            return None
+        finally:
+            leaf.latch.release_shared()
+
+    def search_many(self, keys):
+        results = [None] * len(keys)
+        self._root_latch.acquire_shared()
+        root = self.root
+        root.latch.acquire_shared()
+        self._root_latch.release_shared()
+        path = [(root, None)]
+        try:
+            for i in sorted(range(len(keys)), key=keys.__getitem__):
+                key = keys[i]
+                while len(path) > 1 and path[-1][1] is not None and key >= path[-1][1]:
+                    path.pop()[0].latch.release_shared()
+                node, high = path[-1]
+                while not node.is_leaf:
+                    idx = bisect.bisect_right(node.keys, key)
+                    if idx < len(node.keys):
+                        high = node.keys[idx]
+                    node = node.values[idx]
+                    node.latch.acquire_shared()
+                    path.append((node, high))
+                idx = bisect.bisect_left(node.keys, key)
+                if idx < len(node.keys) and node.keys[idx] == key:
+                    results[i] = node.values[idx]
+        finally:
+            for node, _ in path:
+                node.latch.release_shared()
+        return results
+
+    def scan(self, start=None, end=None, inclusive=(True, True), reverse=False, limit=None, offset=0):
+        items = self._scan_batches(start, end, inclusive[0], inclusive[1], reverse)
+        if offset or limit is not None:
+            items = itertools.islice(items, offset, None if limit is None else offset + limit)
+        return items
+
+    def _scan_batches(self, start, end, include_start, include_end, reverse):
+        while True:
+            batch = self._collect_batch(start, end, include_start, include_end, reverse)
+            yield from batch
+            if len(batch) < self.scan_batch:
+                return
+            # Resume strictly after the last key handed out.
+            if reverse:
+                end, include_end = batch[-1][0], False
+            else:
+                start, include_start = batch[-1][0], False
+
+    def _collect_batch(self, start, end, include_start, include_end, reverse):
+        batch = []
+        stack = []  # (latched internal node, index of the child being visited)
+        self._root_latch.acquire_shared()
+        node = self.root
+        node.latch.acquire_shared()
+        self._root_latch.release_shared()
+        try:
+            bound = end if reverse else start
+            while not node.is_leaf:
+                if bound is None:
+                    idx = len(node.values) - 1 if reverse else 0
+                else:
+                    idx = bisect.bisect_right(node.keys, bound)
+                stack.append((node, idx))
+                node = node.values[idx]
+                node.latch.acquire_shared()
+            keys = node.keys
+            if reverse:
+                i = len(keys) - 1 if end is None else \
+                    (bisect.bisect_right if include_end else bisect.bisect_left)(keys, end) - 1
+            else:
+                i = 0 if start is None else \
+                    (bisect.bisect_left if include_start else bisect.bisect_right)(keys, start)
+            while True:
+                keys, values = node.keys, node.values
+                step = -1 if reverse else 1
+                while 0 <= i < len(keys):
+                    key = keys[i]
+                    if reverse and start is not None and (key < start or (key == start and not include_start)):
+                        return batch
+                    if not reverse and end is not None and (key > end or (key == end and not include_end)):
+                        return batch
+                    batch.append((key, values[i]))
+                    if len(batch) == self.scan_batch:
+                        return batch
+                    i += step
+                # Move to the neighbouring leaf through the latched path.
+                node.latch.release_shared()
+                node = None
+                while stack and stack[-1][1] == (0 if reverse else len(stack[-1][0].values) - 1):
+                    stack.pop()[0].latch.release_shared()
+                if not stack:
+                    return batch
+                parent, idx = stack.pop()
+                stack.append((parent, idx + step))
+                node = parent.values[idx + step]
+                node.latch.acquire_shared()
+                while not node.is_leaf:
+                    idx = len(node.values) - 1 if reverse else 0
+                    stack.append((node, idx))
+                    node = node.values[idx]
+                    node.latch.acquire_shared()
+                i = len(node.keys) - 1 if reverse else 0
+        finally:
+            if node is not None:
+                node.latch.release_shared()
+            for internal, _ in stack:
+                internal.latch.release_shared()
+
+    def range_query(self, start_key, end_key):
+        return list(self.scan(start_key, end_key))
+
+    def get_all(self):
+        return list(self.scan())
+
+    # --- Writes ---
+
+    def insert(self, key, value):
+        self._write(key, value, if_absent=False)
+
+    def insert_if_absent(self, key, value):
+        return self._write(key, value, if_absent=True)
+
+    def _write(self, key, value, if_absent):
+        leaf = self._descend_optimistic(key)
+        idx = bisect.bisect_left(leaf.keys, key)
+        if if_absent and idx < len(leaf.keys) and leaf.keys[idx] == key:
+            leaf.latch.release_exclusive()
+            return False
+        if self._safe_for_insert(leaf):
+            try:
+                self._insert_at(leaf, idx, key, value)
+            finally:
+                leaf.latch.release_exclusive()
+            return True
+        leaf.latch.release_exclusive()
+
+        leaf = self._descend_exclusive(key, self._safe_for_insert)
+        try:
+            idx = bisect.bisect_left(leaf.keys, key)
+            if if_absent and idx < len(leaf.keys) and leaf.keys[idx] == key:
+                return False
+            self._insert_at(leaf, idx, key, value)
+            return True
+        finally:
+            self._release_held()
+
+    def update(self, key, new_value):
+        leaf = self._descend_optimistic(key)
+        try:
+            idx = bisect.bisect_left(leaf.keys, key)
+            if idx < len(leaf.keys) and leaf.keys[idx] == key:
+                leaf.values[idx] = new_value
+                return True
+            return False
+        finally:
+            leaf.latch.release_exclusive()
+
+    def delete(self, key):
+        leaf = self._descend_optimistic(key)
+        idx = bisect.bisect_left(leaf.keys, key)
+        if idx >= len(leaf.keys) or leaf.keys[idx] != key:
+            leaf.latch.release_exclusive()
+            return False
+        if self._safe_for_delete(leaf):
+            try:
+                self._delete_at(leaf, idx)
+            finally:
+                leaf.latch.release_exclusive()
+            return True
+        leaf.latch.release_exclusive()
+
+        leaf = self._descend_exclusive(key, self._safe_for_delete)
+        try:
+            idx = bisect.bisect_left(leaf.keys, key)
+            if idx >= len(leaf.keys) or leaf.keys[idx] != key:
+                return False
+            self._delete_at(leaf, idx)
+            return True
+        finally:
+            self._release_held()
+
+    def delete_range(self, start=None, end=None, inclusive=(True, True), lazy=False):
+        # Unlinking whole subtrees would need every latch below the root at
+        # once, so the keys go one by one, each delete latching as usual.
+        keys = [key for key, _ in self.scan(start, end, inclusive)]
+        return sum(self.delete(key) for key in keys)
+
+    def _insert_at(self, leaf, idx, key, value):
+        leaf.keys.insert(idx, key)
+        leaf.values.insert(idx, value)
+        with self._size_lock:
+            self._size += 1
+        if len(leaf.keys) == self.order:
+            self._split_node(leaf)
+
+    def _delete_at(self, leaf, idx):
+        leaf.keys.pop(idx)
+        leaf.values.pop(idx)
+        with self._size_lock:
+            self._size -= 1
+        if leaf.is_underflow(self._min_keys):
+            self._handle_underflow(leaf)
+
+    def bulk_load(self, sorted_items, fill_factor=1.0):
+        self._root_latch.acquire_exclusive()
+        try:
+            super().bulk_load(sorted_items, fill_factor)
+        finally:
+            self._root_latch.release_exclusive()
+
+    def validate(self):
+        # Expects a quiescent tree; callers stop their workers first.
+        self._root_latch.acquire_exclusive()
+        try:
+            return super().validate()
+        finally:
+            self._root_latch.release_exclusive()
+
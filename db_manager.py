@@ -1,36 +1,153 @@
-import os, pickle
+import collections, contextlib, functools, os, pickle, shutil, threading, time
+from partitioned import PartitionedTable
 from table import Table
+from wal import WriteAheadLog
+
+CATALOG_FILE = 'catalog.pkl'
+TABLES_DIR = 'tables'
+CHECKPOINT_FILE = 'checkpoint.pkl'  # whole-catalogue checkpoints written by older versions
+WAL_FILE = 'wal.log'
+
+def _synchronized(method):
+    # Catalogue changes (and the log records describing them) are applied
+    # one at a time so concurrent callers see a consistent set of tables.
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+class _TableMap(collections.abc.MutableMapping):
+    """One database's tables by name; a table kept only on disk loads on first access.
+
+    Iterating names, len() and ``in`` never load anything; reading a value
+    does, so prefer ``DatabaseManager._loaded_tables`` for bookkeeping.
+    """
+
+    def __init__(self, manager, db_name, tables=()):
+        self._manager = manager
+        self._db_name = db_name
+        self._tables = {}  # name -> table, or None while it is only on disk
+        for name, table in dict(tables).items():
+            self[name] = table
+
+    def __getitem__(self, name):
+        table = self._tables[name]
+        if table is None:
+            return self._manager._load_table(self._db_name, name)
+        self._manager._touch(self._db_name, name)
+        return table
+
+    def __setitem__(self, name, table):
+        self._tables[name] = table
+        if table is not None:
+            self._manager._adopt(self._db_name, name, table, dirty=True)
+
+    def __delitem__(self, name):
+        del self._tables[name]
+        self._manager._forget(self._db_name, name)
+
+    def __contains__(self, name):
+        return name in self._tables
+
+    def __iter__(self):
+        return iter(self._tables)
+
+    def __len__(self):
+        return len(self._tables)
+
+    def __repr__(self):
+        return repr({name: '<on disk>' if table is None else table for name, table in self._tables.items()})
+
+    def __reduce__(self):
+        # Pickled as a plain dict, which loads every table first.
+        return dict, (dict(self.items()),)
+
 
 class DatabaseManager:
-    def __init__(self):
+    """Catalogue of databases and their tables.
+
+    Saved to a directory, each table lives in its own file next to a small
+    catalog, so opening the directory reads only the catalog and a table
+    is loaded when first used. Writes mark a table dirty and a save
+    rewrites only dirty tables. With a memory_budget (in bytes of the
+    tables' saved files, a proxy for their size in memory) the least
+    recently used clean tables are unloaded once loaded tables exceed it;
+    fetch tables through get_table rather than keeping them across calls
+    that may load others.
+    """
+
+    def __init__(self, memory_budget=None):
         self.databases = {}  # Dictionary to store databases as {db_name: {table_name: Table instance}}
+        self.memory_budget = memory_budget
+        self._store = None  # directory the catalog and table files were last saved to
+        self._catalog = {}  # (db_name, table_name) -> {'file', 'bytes'} for tables saved in the store
+        self._next_file = 0
+        self._dirty = set()  # tables changed since their file was written
+        self._resident = collections.OrderedDict()  # loaded tables, least recently used first -> bytes
+        self._wal = None  # WriteAheadLog while durable mode is enabled
+        self._durable_dir = None
+        self._synchronous = False
+        self._checkpoint_bytes = None
+        self._lock = threading.RLock()  # guards the catalogue for concurrent callers
+        # Lock order: the catalogue lock, then tables' write locks, then this
+        # one, which orders appends to the write-ahead log.
+        self._log_lock = threading.Lock()
+        self._checkpointer = None  # thread running an automatic checkpoint
+        self._metrics_enabled = False
+        self._metrics_hook = None
+        self._metrics_stop = None  # Event that stops the periodic exporter thread
 
+    @_synchronized
     def create_database(self, db_name):
         if db_name in self.databases:
             print(f"Database '{db_name}' already exists.")
             return
-        self.databases[db_name] = {}
+        self.databases[db_name] = _TableMap(self, db_name)
+        self._log_op('create_database', db_name, None)
 
+    @_synchronized
     def delete_database(self, db_name):
         if db_name not in self.databases:
             print(f"Database '{db_name}' does not exist.")
             return
+        tables = self.databases[db_name]
+        for table_name in list(tables):
+            tables.pop(table_name).drop()
         del self.databases[db_name]
+        self._log_op('delete_database', db_name, None)
 
     def list_databases(self):
         return list(self.databases.keys())
 
-    def create_table(self, db_name, table_name, schema, order=8, search_key=None):
+    @_synchronized
+    def create_table(self, db_name, table_name, schema, order=8, search_key=None, engine='memory', concurrent=False,
+                     partitions=None, **engine_options):
+        # partitions=N creates a PartitionedTable; partition_by, boundaries and
+        # workers then go in engine_options.
         if db_name not in self.databases:
             print(f"Database '{db_name}' does not exist.")
             return
         if table_name in self.databases[db_name]:
             print(f"Table '{table_name}' already exists in database '{db_name}'.")
             return
-        self.databases[db_name][table_name] = Table(table_name, schema, order, search_key)
+        if engine == 'paged':
+            engine_options.setdefault('path', f"{db_name}.{table_name}.pages")
+        if partitions is not None:
+            table = PartitionedTable(table_name, schema, order, search_key, partitions, engine=engine,
+                                     concurrent=concurrent, **engine_options)
+        else:
+            table = Table(table_name, schema, order, search_key, engine, concurrent, **engine_options)
+        self.databases[db_name][table_name] = table
+        if concurrent:
+            engine_options = dict(engine_options, concurrent=True)
+        if partitions is not None:
+            engine_options = dict(engine_options, partitions=partitions)
+        self._log_op('create_table', db_name, table_name, schema, order, search_key, engine, engine_options)
         print(f'Table {table_name} is created successfully in the database {db_name}')
         return
 
+    @_synchronized
     def delete_table(self, db_name, table_name):
         if db_name not in self.databases:
             print(f"Database '{db_name}' does not exist.")
@@ -38,7 +155,8 @@ class DatabaseManager:
         if table_name not in self.databases[db_name]:
             print(f"Table '{table_name}' does not exist in database '{db_name}'.")
             return
-        del self.databases[db_name][table_name]
+        self.databases[db_name].pop(table_name).drop()
+        self._log_op('delete_table', db_name, table_name)
 
     def list_tables(self, db_name):
         if db_name not in self.databases:
@@ -55,13 +173,37 @@ class DatabaseManager:
             return
         return self.databases[db_name][table_name]
     
-    def save_database(self, filepath):
+    def save_database(self, filepath=None):
+        if self._wal is not None and (filepath is None or
+                                      os.path.normpath(filepath) == os.path.normpath(self._durable_dir)):
+            # Durable mode: every write is already in the log, so saving only
+            # has to make the pending group commit durable.
+            try:
+                self._wal.sync()
+                return None, True
+            except OSError as e:
+                error_msg = f"Failed to sync write-ahead log in '{self._durable_dir}': {e}"
+                print(error_msg)
+                return error_msg, False
+        if filepath is None:
+            filepath = self._store  # the directory the databases were opened from or last saved to
+        if filepath is None:
+            error_msg = "No path given and the databases have not been saved before."
+            print(error_msg)
+            return error_msg, False
+        if not filepath.endswith('.pkl'):
+            # A directory with a catalog and one file per table.
+            try:
+                with self._lock:
+                    self._write_store(filepath)
+                return None, True
+            except Exception as e:
+                error_msg = f"Failed to save database at '{filepath}': {e}"
+                print(error_msg)
+                return error_msg, False
         try:
-            # Normalize the path and ensure it has a file extension
+            # A single pickle of every database, as written by older versions.
             filepath = os.path.normpath(filepath)
-            if not filepath.endswith('.pkl'):
-                filepath += '.pkl'  # Add pickle extension if missing
-                
             dir_name = os.path.dirname(filepath)
             if dir_name: 
                 os.makedirs(dir_name, exist_ok=True)
@@ -71,7 +213,7 @@ class DatabaseManager:
                 raise PermissionError(f"No write permissions for directory: {dir_name}")
                 
             with open(filepath, 'wb') as f:
-                pickle.dump(self.databases, f, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(self.databases, f, pickle.HIGHEST_PROTOCOL)  # _TableMap pickles as a dict
             return None, True
             
         except Exception as e:
@@ -79,7 +221,19 @@ class DatabaseManager:
             print(error_msg)
             return error_msg, False
 
-    def load_database(self, filepath):
+    def load_database(self, filepath, **durability_options):
+        if os.path.isdir(filepath):
+            if os.path.exists(os.path.join(filepath, CATALOG_FILE)) and \
+                    not os.path.exists(os.path.join(filepath, WAL_FILE)):
+                # A saved directory: only the catalog is read here.
+                try:
+                    with self._lock:
+                        self._open_store(filepath)
+                    return None, True
+                except Exception as e:
+                    return f"Failed to load database from '{filepath}': {e}", False
+            # A durable-mode directory: see enable_durability for the options.
+            return self._recover(filepath, **durability_options)
         try:
             if not os.path.exists(filepath):
                 return f"Load failed: File not found at '{filepath}'.", False
@@ -88,11 +242,441 @@ class DatabaseManager:
             if not isinstance(loaded_data, dict):
                  raise TypeError("Loaded data is not in the expected dictionary format.")
 
-            self.databases = loaded_data
+            self._reset_store()
+            self.databases = {db_name: _TableMap(self, db_name, tables) for db_name, tables in loaded_data.items()}
             return None, True
         except FileNotFoundError:
             error_msg = f"Load failed: File not found at '{filepath}'."
             return error_msg, False
         except (pickle.UnpicklingError, EOFError, TypeError, ImportError, Exception) as e:
             error_msg = f"Failed to load database from '{filepath}': {e}"
-            return error_msg, False
\ No newline at end of file
+            return error_msg, False
+
+    # --- Durable mode: write-ahead log + checkpoints ---
+
+    def enable_durability(self, directory, group_size=64, group_interval=0.005,
+                          synchronous=False, checkpoint_bytes=None):
+        """Starts logging every write to a write-ahead log in directory.
+
+        The current databases become the first checkpoint. With
+        synchronous=True each write waits for its group commit; otherwise
+        at most group_interval seconds of writes can be lost on a crash.
+        checkpoint_bytes triggers an automatic checkpoint once the log
+        grows past that size.
+        """
+        if any(os.path.exists(os.path.join(directory, name)) for name in (CATALOG_FILE, CHECKPOINT_FILE, WAL_FILE)):
+            error_msg = f"'{directory}' already holds a durable database; use load_database to open it."
+            print(error_msg)
+            return error_msg, False
+        try:
+            os.makedirs(directory, exist_ok=True)
+            self._open_log(directory, 0, group_size, group_interval, synchronous, checkpoint_bytes)
+            return self.checkpoint()
+        except OSError as e:
+            error_msg = f"Failed to enable durability in '{directory}': {e}"
+            print(error_msg)
+            return error_msg, False
+
+    @_synchronized
+    def checkpoint(self):
+        """Writes the tables changed since the last checkpoint and empties the log."""
+        if self._wal is None:
+            return "Durable mode is not enabled.", False
+        try:
+            with contextlib.ExitStack() as stack:
+                # Writers change a table and log the change under its write
+                # lock, so with every write lock held the tables match the
+                # log; the log lock then keeps out catalogue changes.
+                for _, _, table in self._loaded_tables():
+                    stack.enter_context(table._write_lock)
+                stack.enter_context(self._log_lock)
+                lsn = self._wal.sync()
+                self._write_store(self._durable_dir, lsn)
+                legacy = os.path.join(self._durable_dir, CHECKPOINT_FILE)
+                if os.path.exists(legacy):
+                    os.remove(legacy)  # superseded by the catalog
+                self._wal.reset()
+            return None, True
+        except Exception as e:
+            error_msg = f"Checkpoint failed in '{self._durable_dir}': {e}"
+            print(error_msg)
+            return error_msg, False
+
+    @_synchronized
+    def enable_metrics(self, hook=None, interval=None):
+        """Turns on metrics for every table, including ones created later.
+
+        hook is called with the stats() snapshot by export_metrics(), and
+        every interval seconds from a background thread when interval is set.
+        """
+        self._metrics_enabled = True
+        self._metrics_hook = hook
+        for _, _, table in self._loaded_tables():
+            table.enable_metrics()
+        self._stop_exporter()
+        if hook is not None and interval:
+            self._metrics_stop = threading.Event()
+            threading.Thread(target=self._export_loop, args=(self._metrics_stop, interval),
+                             name='metrics-exporter', daemon=True).start()
+
+    @_synchronized
+    def disable_metrics(self):
+        self._stop_exporter()
+        self._metrics_enabled = False
+        self._metrics_hook = None
+        for _, _, table in self._loaded_tables():
+            table.disable_metrics()
+
+    @_synchronized
+    def stats(self):
+        """Returns a snapshot of structural stats, counters and latencies for every loaded table.
+
+        Tables that are only on disk are listed as {'loaded': False, 'bytes': ...}.
+        """
+        databases = {db_name: {table_name: table.stats() if table is not None else
+                               {'loaded': False, 'bytes': self._catalog[(db_name, table_name)]['bytes']}
+                               for table_name, table in tables._tables.items()}
+                     for db_name, tables in self.databases.items()}
+        stats = {
+            'timestamp': time.time(),
+            'metrics_enabled': self._metrics_enabled,
+            'databases': databases,
+            'storage': {'directory': self._store, 'loaded_tables': len(self._resident),
+                        'loaded_bytes': sum(self._resident.values()), 'memory_budget': self.memory_budget,
+                        'dirty_tables': len(self._dirty)},
+        }
+        if self._wal is not None:
+            stats['wal'] = {'bytes': self._wal.size, 'next_lsn': self._wal.next_lsn,
+                            'durable_lsn': self._wal.durable_lsn}
+        return stats
+
+    def export_metrics(self):
+        """Passes a stats() snapshot to the metrics hook and returns it."""
+        stats = self.stats()
+        if self._metrics_hook is not None:
+            self._metrics_hook(stats)
+        return stats
+
+    def _export_loop(self, stop, interval):
+        while not stop.wait(interval):
+            try:
+                self.export_metrics()
+            except Exception as e:
+                print(f"Metrics export failed: {e}")
+
+    def _stop_exporter(self):
+        if self._metrics_stop is not None:
+            self._metrics_stop.set()
+            self._metrics_stop = None
+
+    def close(self):
+        self._stop_exporter()
+        if self._checkpointer is not None:
+            self._checkpointer.join()
+        if self._wal is not None:
+            self._wal.close()
+            self._wal = None
+        for _, _, table in self._loaded_tables():
+            table.close()
+
+    def _recover(self, directory, group_size=64, group_interval=0.005, synchronous=False, checkpoint_bytes=None):
+        # Restores the latest checkpoint, then replays only the log tail.
+        try:
+            if self._wal is not None:
+                self._wal.close()
+                self._wal = None
+            lsn = 0
+            checkpoint_path = os.path.join(directory, CHECKPOINT_FILE)
+            if os.path.exists(os.path.join(directory, CATALOG_FILE)):
+                lsn = self._open_store(directory)
+                self._restore_pages(directory)
+            else:
+                databases = {}
+                if os.path.exists(checkpoint_path):
+                    with open(checkpoint_path, 'rb') as f:
+                        snapshot = pickle.load(f)
+                    lsn, databases = snapshot['lsn'], snapshot['databases']
+                self._reset_store()
+                self.databases = {db_name: _TableMap(self, db_name, tables) for db_name, tables in databases.items()}
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                for lsn, entry in WriteAheadLog.replay(os.path.join(directory, WAL_FILE), lsn):
+                    self._apply(*entry)
+            self._open_log(directory, lsn, group_size, group_interval, synchronous, checkpoint_bytes)
+            return None, True
+        except Exception as e:
+            error_msg = f"Failed to recover database from '{directory}': {e}"
+            return error_msg, False
+
+    def _restore_pages(self, directory):
+        # Paged tables change their page file in place between checkpoints,
+        # so a crash can leave it torn; the log replays onto the copy taken
+        # at the checkpoint instead. Replacing the file, rather than writing
+        # into it, leaves any old mapping of it untouched.
+        for entry in self._catalog.values():
+            if 'pages' in entry:
+                copy, live = entry['pages']
+                shutil.copyfile(os.path.join(directory, copy), live + '.tmp')
+                os.replace(live + '.tmp', live)
+
+    def _apply(self, op, db_name, table_name, *args):
+        if op == 'create_database':
+            self.create_database(db_name)
+        elif op == 'delete_database':
+            self.delete_database(db_name)
+        elif op == 'create_table':
+            schema, order, search_key, engine, engine_options = args
+            if engine == 'paged' and os.path.exists(engine_options['path']):
+                # Left behind by the run being recovered; the log rebuilds it.
+                os.remove(engine_options['path'])
+            self.create_table(db_name, table_name, schema, order, search_key, engine, **engine_options)
+        elif op == 'delete_table':
+            self.delete_table(db_name, table_name)
+        else:
+            getattr(self.databases[db_name][table_name], op)(*args)
+
+    def _open_log(self, directory, lsn, group_size, group_interval, synchronous, checkpoint_bytes):
+        self._durable_dir = directory
+        self._synchronous = synchronous
+        self._checkpoint_bytes = checkpoint_bytes
+        self._wal = WriteAheadLog(os.path.join(directory, WAL_FILE), group_size, group_interval, lsn)
+
+    def _log_table_op(self, db_name, table_name, table, op, *args):
+        # Every table write reports here: it marks the table dirty and, in
+        # durable mode, goes to the log.
+        tables = self.databases.get(db_name)
+        if tables is None or tables._tables.get(table_name) is not table:
+            # Written through a reference kept across its eviction. Taking
+            # the catalogue lock here is safe: only a table no longer in the
+            # catalogue gets here, and nothing else locks those.
+            with self._lock:
+                tables = self.databases.get(db_name)
+                if tables is not None and tables._tables.get(table_name, table) is None:
+                    # Still evicted: take it back.
+                    tables._tables[table_name] = table
+                    self._adopt(db_name, table_name, table)
+                elif tables is None or tables._tables.get(table_name) is not table:
+                    raise RuntimeError(f"Table '{table_name}' of database '{db_name}' was reloaded or dropped "
+                                       f"since this reference to it was fetched, so the write is not part of "
+                                       f"the database; fetch the table again with get_table")
+        self._dirty.add((db_name, table_name))
+        self._log_op(op, db_name, table_name, *args)
+
+    # --- Table files: lazy loading, eviction and incremental saves ---
+
+    def _loaded_tables(self):
+        return [(db_name, table_name, table)
+                for db_name, tables in self.databases.items()
+                for table_name, table in tables._tables.items() if table is not None]
+
+    def _adopt(self, db_name, table_name, table, dirty=False):
+        key = (db_name, table_name)
+        table._log = functools.partial(self._log_table_op, db_name, table_name, table)
+        if self._metrics_enabled:
+            table.enable_metrics()
+        self._resident[key] = self._catalog[key]['bytes'] if key in self._catalog else 0
+        self._resident.move_to_end(key)
+        if dirty:
+            self._dirty.add(key)
+
+    def _touch(self, db_name, table_name):
+        key = (db_name, table_name)
+        if key in self._resident:
+            self._resident.move_to_end(key)
+
+    def _forget(self, db_name, table_name):
+        key = (db_name, table_name)
+        self._resident.pop(key, None)
+        self._catalog.pop(key, None)
+        self._dirty.discard(key)
+
+    def _load_table(self, db_name, table_name):
+        with self._lock:
+            tables = self.databases[db_name]
+            table = tables._tables[table_name]
+            if table is None:  # not loaded by another thread meanwhile
+                path = os.path.join(self._store, self._catalog[(db_name, table_name)]['file'])
+                if path.endswith('.bpt'):
+                    table = Table.load(path)
+                else:
+                    with open(path, 'rb') as f:
+                        table = pickle.load(f)
+                tables._tables[table_name] = table
+                self._adopt(db_name, table_name, table)
+                self._evict(keep=(db_name, table_name))
+            return table
+
+    def _evict(self, keep=None):
+        # Unloads least recently used clean tables until the loaded ones fit
+        # the budget; dirty tables stay until a save writes them.
+        if self.memory_budget is None or self._store is None:
+            return
+        total = sum(self._resident.values())
+        for key in list(self._resident):
+            if total <= self.memory_budget:
+                break
+            if key == keep or key in self._dirty or key not in self._catalog:
+                continue
+            db_name, table_name = key
+            tables = self.databases[db_name]
+            tables._tables[table_name].close()
+            tables._tables[table_name] = None
+            total -= self._resident.pop(key)
+
+    def _reset_store(self):
+        self._store = None
+        self._catalog = {}
+        self._next_file = 0
+        self._dirty.clear()
+        self._resident.clear()
+
+    @staticmethod
+    def _read_catalog(directory):
+        path = os.path.join(directory, CATALOG_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def _open_store(self, directory):
+        # Reads only the catalog; every table stays on disk until first used.
+        catalog = self._read_catalog(directory)
+        self._reset_store()
+        self.databases = {}
+        for db_name, tables in catalog['databases'].items():
+            table_map = self.databases[db_name] = _TableMap(self, db_name)
+            for table_name, entry in tables.items():
+                table_map._tables[table_name] = None
+                self._catalog[(db_name, table_name)] = entry
+        self._store = directory
+        self._next_file = catalog['next_file']
+        self._remove_unreferenced(directory, catalog)
+        return catalog['lsn'] or 0
+
+    def _write_store(self, directory, lsn=None):
+        # Writes each table that changed (every loaded table, when directory
+        # is not the current store) to a new file, then swaps in a catalog
+        # naming them. The old catalog and its files stay valid until the
+        # swap, so a crash mid-save leaves the previous save intact.
+        same = self._store is not None and os.path.abspath(directory) == os.path.abspath(self._store)
+        adopt = self._wal is None or os.path.abspath(directory) == os.path.abspath(self._durable_dir)
+        os.makedirs(os.path.join(directory, TABLES_DIR), exist_ok=True)
+        previous = self._read_catalog(directory)
+        next_file = previous['next_file'] if previous is not None else 0
+        catalog = {'format': 1, 'lsn': lsn, 'databases': {}}
+        written = set()
+        try:
+            for db_name, tables in self.databases.items():
+                entries = catalog['databases'][db_name] = {}
+                for table_name, table in tables._tables.items():
+                    key = (db_name, table_name)
+                    if same and key in self._catalog and key not in self._dirty:
+                        entries[table_name] = self._catalog[key]
+                        continue
+                    # Memory tables use the binary format of treefile.py;
+                    # paged and partitioned tables are pickled.
+                    if table is None:
+                        extension = os.path.splitext(self._catalog[key]['file'])[1]
+                    else:
+                        extension = '.bpt' if isinstance(table, Table) and table.engine == 'memory' else '.pkl'
+                    file = os.path.join(TABLES_DIR, f'{next_file}{extension}')
+                    next_file += 1
+                    path = os.path.join(directory, file)
+                    pages = None
+                    if table is None:
+                        shutil.copyfile(os.path.join(self._store, self._catalog[key]['file']), path)
+                        if 'pages' in self._catalog[key]:
+                            copy, live = self._catalog[key]['pages']
+                            pages = os.path.join(TABLES_DIR, f'{next_file}.pages'), live
+                            next_file += 1
+                            shutil.copyfile(os.path.join(self._store, copy), os.path.join(directory, pages[0]))
+                    else:
+                        if adopt:
+                            # Cleared before writing, so a write racing the
+                            # save marks the table dirty again.
+                            self._dirty.discard(key)
+                            written.add(key)
+                        if extension == '.bpt':
+                            table.save(path)
+                        else:
+                            with open(path, 'wb') as f:
+                                pickle.dump(table, f, pickle.HIGHEST_PROTOCOL)
+                        if isinstance(table, Table) and table.engine == 'paged':
+                            # The pickle names the page file, which keeps changing in
+                            # place; keep a copy as of the pickle (which flushed it)
+                            # for recovery to start from.
+                            pages = os.path.join(TABLES_DIR, f'{next_file}.pages'), table.data.path
+                            next_file += 1
+                            shutil.copyfile(table.data.path, os.path.join(directory, pages[0]))
+                    with open(path, 'rb+') as f:
+                        os.fsync(f.fileno())
+                    entries[table_name] = {'file': file, 'bytes': os.path.getsize(path)}
+                    if pages is not None:
+                        with open(os.path.join(directory, pages[0]), 'rb+') as f:
+                            os.fsync(f.fileno())
+                        entries[table_name]['pages'] = pages
+            catalog['next_file'] = next_file
+            self._fsync_dir(os.path.join(directory, TABLES_DIR))
+            path = os.path.join(directory, CATALOG_FILE)
+            with open(path + '.tmp', 'wb') as f:
+                pickle.dump(catalog, f, pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + '.tmp', path)  # atomic: a crash leaves the old or the new catalog
+            self._fsync_dir(directory)
+        except BaseException:
+            self._dirty |= written
+            raise
+        self._remove_unreferenced(directory, catalog)
+        if adopt:
+            self._store = directory
+            self._next_file = next_file
+            self._catalog = {(db_name, table_name): entry
+                             for db_name, tables in catalog['databases'].items()
+                             for table_name, entry in tables.items()}
+            for key in self._resident:
+                self._resident[key] = self._catalog[key]['bytes']
+            self._evict()
+
+    @staticmethod
+    def _remove_unreferenced(directory, catalog):
+        # Table files superseded by a save, or left behind by a crash during one.
+        referenced = set()
+        for tables in catalog['databases'].values():
+            for entry in tables.values():
+                referenced.add(os.path.basename(entry['file']))
+                if 'pages' in entry:
+                    referenced.add(os.path.basename(entry['pages'][0]))
+        tables_dir = os.path.join(directory, TABLES_DIR)
+        if os.path.isdir(tables_dir):
+            for name in os.listdir(tables_dir):
+                if name not in referenced:
+                    os.remove(os.path.join(tables_dir, name))
+
+    def _log_op(self, op, db_name, table_name, *args):
+        if self._wal is None:
+            return
+        # Table writes get here holding their write lock, so only the log
+        # lock is taken; a checkpoint holds it from its sync to the log reset.
+        with self._log_lock:
+            lsn = self._wal.append((op, db_name, table_name) + args)
+            if self._checkpoint_bytes is not None and self._wal.size >= self._checkpoint_bytes:
+                self._checkpoint_soon()
+        if self._synchronous:
+            self._wal.wait_durable(lsn)
+
+    def _checkpoint_soon(self):
+        # The writer that filled the log may hold a table lock, which the
+        # checkpoint takes after the catalogue lock: run it on another thread.
+        if self._checkpointer is None or not self._checkpointer.is_alive():
+            self._checkpointer = threading.Thread(target=self.checkpoint, name='checkpointer', daemon=True)
+            self._checkpointer.start()
+
+    @staticmethod
+    def _fsync_dir(directory):
+        if not hasattr(os, 'O_DIRECTORY'):
+            return
+        fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
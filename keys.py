@@ -0,0 +1,75 @@
+"""Helpers for search keys: composite keys, prefix bounds and short separators.
+
+A composite search key is the tuple of its fields' values, ordered the
+way Python orders tuples: by the first field, ties by the next one. The
+keys sharing leading fields, or the strings sharing a prefix, are then
+one contiguous run of the tree, which prefix_bounds() turns into scan
+bounds.
+"""
+
+
+class _Max:
+    """Compares above every other value; caps ranges over composite keys."""
+    __slots__ = ()
+
+    def __lt__(self, other):
+        return False
+
+    def __le__(self, other):
+        return self is other
+
+    def __gt__(self, other):
+        return self is not other
+
+    def __ge__(self, other):
+        return True
+
+    def __repr__(self):
+        return 'MAX'
+
+    def __reduce__(self):
+        return 'MAX'
+
+
+MAX = _Max()
+
+
+def prefix_bounds(prefix):
+    """Returns (start, end, inclusive) scan bounds for the keys starting with prefix.
+
+    A tuple prefix matches the composite keys whose leading fields equal
+    it; a str prefix matches the strings that start with it.
+    """
+    if isinstance(prefix, tuple):
+        return prefix, prefix + (MAX,), (True, False)
+    if isinstance(prefix, str):
+        # The first string after every extension of prefix: its last
+        # character that can still grow, moved on by one.
+        for i in range(len(prefix) - 1, -1, -1):
+            if prefix[i] != '\U0010ffff':
+                return prefix, prefix[:i] + chr(ord(prefix[i]) + 1), (True, False)
+        return prefix, None, (True, True)
+    raise TypeError(f"Prefix scans need a str or tuple prefix, got {type(prefix).__name__}")
+
+
+def shortest_separator(low, high):
+    """Returns the shortest key s with low < s <= high, for low < high.
+
+    Strings are cut to one character past their common prefix, and tuples
+    to one field past their common fields (that field cut in turn), so a
+    split of long string keys sends a short key up instead of a whole
+    one. Any other kind of key is returned as high.
+    """
+    if type(high) is str and type(low) is str:
+        n = 0
+        for a, b in zip(low, high):
+            if a != b:
+                break
+            n += 1
+        return high[:n + 1]
+    if type(high) is tuple and type(low) is tuple:
+        for i, (a, b) in enumerate(zip(low, high)):
+            if a != b:
+                return high[:i] + (shortest_separator(a, b),)
+        return high[:len(low) + 1]
+    return high
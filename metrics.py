@@ -0,0 +1,79 @@
+import functools
+import time
+
+
+class TreeMetrics:
+    """Operation counters kept by a tree while metrics are enabled.
+
+    Counters are plain attribute increments; on concurrent trees they are
+    not synchronized and may undercount slightly under contention.
+    """
+    __slots__ = ('node_visits', 'splits', 'merges', 'borrows', 'leaf_hops')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class LatencyHistogram:
+    """Latency distribution in power-of-two nanosecond buckets.
+
+    Recording is O(1) and memory is fixed, so it can stay on in production.
+    Percentiles are reported as the upper bound of the bucket they fall in.
+    """
+    __slots__ = ('buckets', 'count', 'total_ns', 'max_ns')
+
+    def __init__(self):
+        self.buckets = [0] * 64  # bucket b counts latencies in [2**(b-1), 2**b) ns
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def record(self, ns):
+        self.buckets[min(ns.bit_length(), 63)] += 1
+        self.count += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    def percentile(self, pct):
+        if not self.count:
+            return 0
+        target = pct / 100 * self.count
+        seen = 0
+        for bucket, hits in enumerate(self.buckets):
+            seen += hits
+            if hits and seen >= target:
+                return min(1 << bucket, self.max_ns)
+        return self.max_ns
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'mean_ns': self.total_ns / self.count if self.count else 0,
+            'p50_ns': self.percentile(50),
+            'p90_ns': self.percentile(90),
+            'p99_ns': self.percentile(99),
+            'max_ns': self.max_ns,
+            'buckets': {1 << bucket: hits for bucket, hits in enumerate(self.buckets) if hits},
+        }
+
+
+def timed(method, histogram):
+    """Wraps a bound method so each call's latency is recorded in histogram."""
+    clock = time.perf_counter_ns
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        start = clock()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            histogram.record(clock() - start)
+    return wrapper
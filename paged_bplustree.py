@@ -0,0 +1,644 @@
+import bisect
+import itertools
+import pickle
+from bplustree import BPlusTree
+from keys import shortest_separator
+from metrics import TreeMetrics
+from pager import NO_PAGE, PAGE_HEADER, BufferPool, PagedNode, Pager
+
+
+class PagedBPlusTree:
+    """B+ tree whose nodes live in fixed-size pages of a memory-mapped file.
+
+    Children and leaf links are page IDs, and only the pages held by the
+    buffer pool are resident, so the tree can be far larger than memory.
+    Nodes carry no parent pointers; writers keep the root-to-leaf path
+    pinned instead and rebalance along it.
+    """
+    metrics = None  # TreeMetrics while enable_metrics() is in effect
+
+    def __init__(self, path, order=64, page_size=4096, pool_size=256):
+        if order < 3:
+            raise ValueError("B+ Tree order must be at least 3")
+        self.path = path
+        self.page_size = page_size
+        self.pool_size = pool_size
+        self.pager = Pager(path, page_size, order)
+        self.pool = BufferPool(self.pager, pool_size)
+        self.order = self.pager.order
+        self._min_leaf_keys = self.order // 2
+        self._min_internal_keys = (self.order - 1) // 2
+        if self.pager.root == NO_PAGE:
+            self.pager.root = self.pool.new(PagedNode(is_leaf=True))
+            self.pool.unpin(self.pager.root)
+
+    def __len__(self):
+        return self.pager.size
+
+    def __getstate__(self):
+        self.flush()
+        return {'path': self.path, 'order': self.order,
+                'page_size': self.page_size, 'pool_size': self.pool_size}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['order'], state['page_size'], state['pool_size'])
+
+    def flush(self):
+        self.pool.flush()
+
+    def enable_metrics(self, metrics=None):
+        """Starts counting tree operations; see BPlusTree.enable_metrics."""
+        self.metrics = metrics if metrics is not None else TreeMetrics()
+        return self.metrics
+
+    def disable_metrics(self):
+        self.__dict__.pop('metrics', None)
+
+    def stats(self):
+        """Returns structural statistics, buffer pool counters and, if enabled, tree counters.
+
+        Reads every page through the buffer pool.
+        """
+        levels = []
+        level = [self.pager.root]
+        capacity = self.order - 1
+        while level:
+            keys = 0
+            children = []
+            for pid in level:
+                node = self.pool.fetch(pid)
+                keys += len(node.keys)
+                if not node.is_leaf:
+                    children.extend(node.values)
+                self.pool.unpin(pid)
+            levels.append({'nodes': len(level), 'keys': keys, 'fill': keys / (len(level) * capacity)})
+            level = children
+        stats = {
+            'size': self.pager.size,
+            'order': self.order,
+            'height': len(levels),
+            'nodes': sum(entry['nodes'] for entry in levels),
+            'leaves': levels[-1]['nodes'],
+            'levels': levels,
+            'bytes_estimate': self.pager.page_count * self.pager.page_size,
+            'page_size': self.pager.page_size,
+            'pool': self.pool.stats(),
+        }
+        if self.metrics is not None:
+            stats['counters'] = self.metrics.as_dict()
+        return stats
+
+    def close(self):
+        self.pool.close()
+
+    def _descend(self, key):
+        # Pins and returns the root-to-leaf path as (node, child_index) pairs.
+        path = []
+        pid = self.pager.root
+        while True:
+            node = self.pool.fetch(pid)
+            if node.is_leaf:
+                path.append((node, None))
+                if self.metrics is not None:
+                    self.metrics.node_visits += len(path)
+                return path
+            idx = bisect.bisect_right(node.keys, key)
+            path.append((node, idx))
+            pid = node.values[idx]
+
+    def _find_leaf(self, key):
+        # Read-only descent: only the returned leaf stays pinned.
+        pid = self.pager.root
+        visits = 1
+        while True:
+            node = self.pool.fetch(pid)
+            if node.is_leaf:
+                if self.metrics is not None:
+                    self.metrics.node_visits += visits
+                return node
+            visits += 1
+            next_pid = node.values[bisect.bisect_right(node.keys, key)]
+            self.pool.unpin(pid)
+            pid = next_pid
+
+    def _release(self, path, freed=()):
+        for node, _ in path:
+            if node.pid not in freed:
+                self.pool.unpin(node.pid)
+
+    def search(self, key):
+        leaf = self._find_leaf(key)
+        idx = bisect.bisect_left(leaf.keys, key)
+        value = leaf.values[idx] if idx < len(leaf.keys) and leaf.keys[idx] == key else None
+        self.pool.unpin(leaf.pid)
+        return value
+
+    def search_many(self, keys):
+        """Looks up a batch of keys in the caller's order; see BPlusTree.search_many."""
+        results = [None] * len(keys)
+        path = [(self.pool.fetch(self.pager.root), None)]
+        try:
+            for i in sorted(range(len(keys)), key=keys.__getitem__):
+                key = keys[i]
+                while len(path) > 1 and path[-1][1] is not None and key >= path[-1][1]:
+                    self.pool.unpin(path.pop()[0].pid)
+                node, high = path[-1]
+                while not node.is_leaf:
+                    idx = bisect.bisect_right(node.keys, key)
+                    if idx < len(node.keys):
+                        high = node.keys[idx]
+                    node = self.pool.fetch(node.values[idx])
+                    path.append((node, high))
+                idx = bisect.bisect_left(node.keys, key)
+                if idx < len(node.keys) and node.keys[idx] == key:
+                    results[i] = node.values[idx]
+        finally:
+            for node, _ in path:
+                self.pool.unpin(node.pid)
+        return results
+
+    def update(self, key, new_value):
+        extra = self._entry_size(key, new_value)
+        leaf = self._find_leaf(key)
+        found = False
+        try:
+            idx = bisect.bisect_left(leaf.keys, key)
+            if idx < len(leaf.keys) and leaf.keys[idx] == key:
+                nbytes = self._leaf_size(leaf, extra, lambda: (
+                    leaf.keys, leaf.values[:idx] + [new_value] + leaf.values[idx + 1:], leaf.next))
+                if nbytes is None:
+                    raise ValueError(f"Updating {key!r} would grow its leaf past the {self.page_size}-byte page; "
+                                     f"use a larger page_size or a smaller order")
+                leaf.values[idx] = new_value
+                leaf.nbytes = nbytes
+                found = True
+        finally:
+            self.pool.unpin(leaf.pid, dirty=found)
+        return found
+
+    def insert(self, key, value):
+        self._insert(key, value, if_absent=False)
+
+    def insert_if_absent(self, key, value):
+        """Inserts key unless it is already present; returns whether it was inserted."""
+        return self._insert(key, value, if_absent=True)
+
+    def _insert(self, key, value, if_absent):
+        extra = self._entry_size(key, value)
+        path = self._descend(key)
+        try:
+            leaf = path[-1][0]
+            idx = bisect.bisect_left(leaf.keys, key)
+            if if_absent and idx < len(leaf.keys) and leaf.keys[idx] == key:
+                return False
+            nbytes = self._insert_size(leaf, idx, key, value, extra)
+            leaf.keys.insert(idx, key)
+            leaf.values.insert(idx, value)
+            leaf.nbytes = nbytes
+            self.pool.mark_dirty(leaf.pid)
+            self.pager.size += 1
+            self._split_path(path)
+            return True
+        finally:
+            self._release(path)
+
+    def _split_path(self, path):
+        mid = self.order // 2
+        level = len(path) - 1
+        node = path[level][0]
+        while len(node.keys) == self.order:
+            if self.metrics is not None:
+                self.metrics.splits += 1
+            sibling = PagedNode(node.is_leaf)
+            if node.is_leaf:
+                separator = shortest_separator(node.keys[mid - 1], node.keys[mid])
+                sibling.keys, node.keys = node.keys[mid:], node.keys[:mid]
+                sibling.values, node.values = node.values[mid:], node.values[:mid]
+                sibling.next = node.next
+                sibling.nbytes = node.nbytes  # neither half encodes larger than the whole
+            else:
+                separator = node.keys[mid]
+                sibling.keys, node.keys = node.keys[mid + 1:], node.keys[:mid]
+                sibling.values, node.values = node.values[mid + 1:], node.values[:mid + 1]
+            sibling_pid = self.pool.new(sibling)
+            self.pool.unpin(sibling_pid)
+            if node.is_leaf:
+                node.next = sibling_pid
+            self.pool.mark_dirty(node.pid)
+
+            if level == 0:
+                root = PagedNode(is_leaf=False, keys=[separator], values=[node.pid, sibling_pid])
+                self.pager.root = self.pool.new(root)
+                self.pool.unpin(self.pager.root)
+                return
+            parent, idx = path[level - 1]
+            parent.keys.insert(idx, separator)
+            parent.values.insert(idx + 1, sibling_pid)
+            self.pool.mark_dirty(parent.pid)
+            level -= 1
+            node = parent
+
+    # --- Page space ---
+    # Pages are encoded only when the buffer pool evicts or flushes them, long
+    # after the change that filled them, so changes that grow a leaf check
+    # first that it will still fit and fail, or are skipped, before touching
+    # it. Keys are limited so that a full internal node always fits.
+
+    def _entry_size(self, key, value):
+        # Rejects an entry that can never be stored and returns a bound on
+        # what it adds to a leaf: a pickle of the entry on its own is never
+        # smaller than its share of a page's pickle, nor than its key's.
+        room = self.page_size - PAGE_HEADER.size
+        size = len(pickle.dumps((key, value), pickle.HIGHEST_PROTOCOL))
+        if size > room:
+            raise ValueError(f"An entry of {size} bytes does not fit in a {self.page_size}-byte page; "
+                             f"use a larger page_size")
+        if self.order * size > room:
+            key_size = len(pickle.dumps(key, pickle.HIGHEST_PROTOCOL))
+            if self.order * key_size > room:
+                raise ValueError(f"A key of {key_size} bytes is too large for a {self.page_size}-byte page of order "
+                                 f"{self.order}; use a larger page_size or a smaller order")
+        return size
+
+    def _leaf_size(self, leaf, extra, entries):
+        # The encoded size of leaf once it holds entries() -- (keys, values,
+        # next) adding at most extra bytes to its own -- or None if that does
+        # not fit in a page. The running bound in nbytes usually settles it
+        # without encoding anything.
+        if leaf.nbytes is not None and leaf.nbytes + extra <= self.page_size:
+            return leaf.nbytes + extra
+        keys, values, next_pid = entries()
+        nbytes = len(PagedNode(True, keys, values, next_pid).to_bytes())
+        return nbytes if nbytes <= self.page_size else None
+
+    def _insert_size(self, leaf, idx, key, value, extra):
+        # Checks that inserting at idx leaves leaf, or the two halves it is
+        # about to split into, within a page; returns leaf's new size bound.
+        # Neither half encodes larger than the whole leaf would.
+        def entries():
+            return leaf.keys[:idx] + [key] + leaf.keys[idx:], leaf.values[:idx] + [value] + leaf.values[idx:]
+
+        if len(leaf.keys) + 1 < self.order or (leaf.nbytes is not None and leaf.nbytes + extra <= self.page_size):
+            nbytes = self._leaf_size(leaf, extra, lambda: entries() + (leaf.next,))
+            if nbytes is not None:
+                return nbytes
+        else:
+            keys, values = entries()
+            mid = self.order // 2
+            # The left half will link to a page not allocated yet.
+            halves = (PagedNode(True, keys[:mid], values[:mid], 0xFFFFFFFF),
+                      PagedNode(True, keys[mid:], values[mid:], leaf.next))
+            if all(len(half.to_bytes()) <= self.page_size for half in halves):
+                return None
+        raise ValueError(f"Inserting {key!r} would grow its leaf past the {self.page_size}-byte page; "
+                         f"use a larger page_size or a smaller order")
+
+    def _can_borrow(self, node, sibling, i):
+        # Whether node still fits after taking sibling's entry at i (0 or -1).
+        if not node.is_leaf:
+            return True
+        key, value = sibling.keys[i], sibling.values[i]
+        extra = len(pickle.dumps((key, value), pickle.HIGHEST_PROTOCOL))
+        if i == 0:
+            entries = lambda: (node.keys + [key], node.values + [value], node.next)
+        else:
+            entries = lambda: ([key] + node.keys, [value] + node.values, node.next)
+        return self._leaf_size(node, extra, entries) is not None
+
+    def _can_merge(self, left, right):
+        if not left.is_leaf:
+            return True
+        extra = right.nbytes if right.nbytes is not None else self.page_size
+        entries = lambda: (left.keys + right.keys, left.values + right.values, right.next)
+        return self._leaf_size(left, extra, entries) is not None
+
+    def delete(self, key):
+        path = self._descend(key)
+        freed = set()
+        try:
+            leaf = path[-1][0]
+            idx = bisect.bisect_left(leaf.keys, key)
+            if idx >= len(leaf.keys) or leaf.keys[idx] != key:
+                return False
+            leaf.keys.pop(idx)
+            leaf.values.pop(idx)
+            self.pool.mark_dirty(leaf.pid)
+            self.pager.size -= 1
+            self._rebalance_path(path, freed)
+            return True
+        finally:
+            self._release(path, freed)
+
+    def delete_range(self, start=None, end=None, inclusive=(True, True), lazy=False):
+        """Deletes the keys between start and end and returns how many went.
+
+        Dropped subtrees would still have to be read page by page to free
+        their pages, so the keys go one by one; lazy has no effect here.
+        """
+        keys = [key for key, _ in self.scan(start, end, inclusive)]
+        return sum(self.delete(key) for key in keys)
+
+    def compact(self):
+        # delete_range always rebalances as it goes.
+        pass
+
+    def _rebalance_path(self, path, freed):
+        level = len(path) - 1
+        while level > 0:
+            node = path[level][0]
+            min_keys = self._min_leaf_keys if node.is_leaf else self._min_internal_keys
+            if len(node.keys) >= min_keys:
+                return
+            parent, idx = path[level - 1]
+            pinned = []
+            try:
+                left = right = None
+                if idx > 0:
+                    left = self.pool.fetch(parent.values[idx - 1])
+                    pinned.append(left)
+                    if len(left.keys) > min_keys and self._can_borrow(node, left, -1):
+                        self._borrow_from_left(node, left, parent, idx)
+                        node.nbytes = None
+                        return
+                if idx < len(parent.values) - 1:
+                    right = self.pool.fetch(parent.values[idx + 1])
+                    pinned.append(right)
+                    if len(right.keys) > min_keys and self._can_borrow(node, right, 0):
+                        self._borrow_from_right(node, right, parent, idx)
+                        node.nbytes = None
+                        return
+                if left is not None and self._can_merge(left, node):
+                    self._merge(left, node, parent, idx - 1)
+                    left.nbytes = None
+                    freed.add(node.pid)
+                elif right is not None and self._can_merge(node, right):
+                    self._merge(node, right, parent, idx)
+                    node.nbytes = None
+                    freed.add(right.pid)
+                else:
+                    # Large values leave no room to take in a neighbour's:
+                    # the node stays underfull, which costs only space.
+                    return
+            finally:
+                for sibling in pinned:
+                    if sibling.pid not in freed:
+                        self.pool.unpin(sibling.pid)
+            level -= 1
+
+        root = path[0][0]
+        if not root.is_leaf and not root.keys:
+            self.pager.root = root.values[0]
+            self.pool.free(root.pid)
+            freed.add(root.pid)
+
+    def _borrow_from_left(self, node, left, parent, idx):
+        if self.metrics is not None:
+            self.metrics.borrows += 1
+        if node.is_leaf:
+            node.keys.insert(0, left.keys.pop())
+            node.values.insert(0, left.values.pop())
+            parent.keys[idx - 1] = shortest_separator(left.keys[-1], node.keys[0])
+        else:
+            node.keys.insert(0, parent.keys[idx - 1])
+            parent.keys[idx - 1] = left.keys.pop()
+            node.values.insert(0, left.values.pop())
+        for changed in (node, left, parent):
+            self.pool.mark_dirty(changed.pid)
+
+    def _borrow_from_right(self, node, right, parent, idx):
+        if self.metrics is not None:
+            self.metrics.borrows += 1
+        if node.is_leaf:
+            node.keys.append(right.keys.pop(0))
+            node.values.append(right.values.pop(0))
+            parent.keys[idx] = shortest_separator(node.keys[-1], right.keys[0])
+        else:
+            node.keys.append(parent.keys[idx])
+            parent.keys[idx] = right.keys.pop(0)
+            node.values.append(right.values.pop(0))
+        for changed in (node, right, parent):
+            self.pool.mark_dirty(changed.pid)
+
+    def _merge(self, left, right, parent, sep_idx):
+        if self.metrics is not None:
+            self.metrics.merges += 1
+        separator = parent.keys.pop(sep_idx)
+        parent.values.pop(sep_idx + 1)
+        if left.is_leaf:
+            left.next = right.next
+        else:
+            left.keys.append(separator)
+        left.keys.extend(right.keys)
+        left.values.extend(right.values)
+        self.pool.mark_dirty(left.pid)
+        self.pool.mark_dirty(parent.pid)
+        self.pool.free(right.pid)
+
+    def _leftmost_leaf(self):
+        pid = self.pager.root
+        while True:
+            node = self.pool.fetch(pid)
+            if node.is_leaf:
+                return node
+            next_pid = node.values[0]
+            self.pool.unpin(pid)
+            pid = next_pid
+
+    def _collect(self, leaf, start_key, end_key):
+        results = []
+        idx = 0 if start_key is None else bisect.bisect_left(leaf.keys, start_key)
+        while True:
+            for i in range(idx, len(leaf.keys)):
+                if end_key is not None and leaf.keys[i] > end_key:
+                    self.pool.unpin(leaf.pid)
+                    return results
+                results.append((leaf.keys[i], leaf.values[i]))
+            next_pid = leaf.next
+            self.pool.unpin(leaf.pid)
+            if next_pid == NO_PAGE:
+                return results
+            leaf = self.pool.fetch(next_pid)
+            idx = 0
+            if self.metrics is not None:
+                self.metrics.leaf_hops += 1
+
+    def range_query(self, start_key, end_key):
+        return self._collect(self._find_leaf(start_key), start_key, end_key)
+
+    def get_all(self):
+        return self._collect(self._leftmost_leaf(), None, None)
+
+    def scan(self, start=None, end=None, inclusive=(True, True), reverse=False, limit=None, offset=0):
+        """Lazily yields (key, value) pairs between start and end; see BPlusTree.scan.
+
+        Each leaf is copied out and unpinned before its rows are yielded, so
+        an abandoned cursor never holds buffer pool frames.
+        """
+        include_start, include_end = inclusive
+        if reverse:
+            items = self._scan_reverse(start, end, include_start, include_end)
+        else:
+            items = self._scan_forward(start, end, include_start, include_end)
+        if offset or limit is not None:
+            items = itertools.islice(items, offset, None if limit is None else offset + limit)
+        return items
+
+    def _read_leaf(self, leaf):
+        keys, values, next_pid = list(leaf.keys), list(leaf.values), leaf.next
+        self.pool.unpin(leaf.pid)
+        return keys, values, next_pid
+
+    def _scan_forward(self, start, end, include_start, include_end):
+        if start is None:
+            keys, values, next_pid = self._read_leaf(self._leftmost_leaf())
+            idx = 0
+        else:
+            keys, values, next_pid = self._read_leaf(self._find_leaf(start))
+            idx = (bisect.bisect_left if include_start else bisect.bisect_right)(keys, start)
+        while True:
+            for i in range(idx, len(keys)):
+                key = keys[i]
+                if end is not None and (key > end or (key == end and not include_end)):
+                    return
+                yield key, values[i]
+            if next_pid == NO_PAGE:
+                return
+            keys, values, next_pid = self._read_leaf(self.pool.fetch(next_pid))
+            idx = 0
+            if self.metrics is not None:
+                self.metrics.leaf_hops += 1
+
+    def _scan_reverse(self, start, end, include_start, include_end):
+        stack = []  # (internal page id, index of the child being visited)
+        pid = self.pager.root
+        while True:
+            node = self.pool.fetch(pid)
+            if node.is_leaf:
+                break
+            idx = len(node.values) - 1 if end is None else bisect.bisect_right(node.keys, end)
+            child = node.values[idx]
+            self.pool.unpin(pid)
+            stack.append((pid, idx))
+            pid = child
+        keys, values, _ = self._read_leaf(node)
+        if end is None:
+            i = len(keys) - 1
+        else:
+            i = (bisect.bisect_right if include_end else bisect.bisect_left)(keys, end) - 1
+        while True:
+            while i >= 0:
+                key = keys[i]
+                if start is not None and (key < start or (key == start and not include_start)):
+                    return
+                yield key, values[i]
+                i -= 1
+            while stack and stack[-1][1] == 0:
+                stack.pop()
+            if not stack:
+                return
+            pid, idx = stack.pop()
+            stack.append((pid, idx - 1))
+            node = self.pool.fetch(pid)
+            child = node.values[idx - 1]
+            self.pool.unpin(pid)
+            while True:
+                node = self.pool.fetch(child)
+                if node.is_leaf:
+                    break
+                stack.append((child, len(node.values) - 1))
+                next_child = node.values[-1]
+                self.pool.unpin(child)
+                child = next_child
+            keys, values, _ = self._read_leaf(node)
+            i = len(keys) - 1
+            if self.metrics is not None:
+                self.metrics.leaf_hops += 1
+
+    def bulk_load(self, sorted_items, fill_factor=1.0):
+        """Builds the tree bottom-up from sorted (key, value) pairs.
+
+        Leaves are written through the buffer pool as they fill, so the
+        input can be streamed without holding it in memory.
+        """
+        if not 0 < fill_factor <= 1:
+            raise ValueError("fill_factor must be in the range (0, 1]")
+        root = self.pool.fetch(self.pager.root)
+        empty = root.is_leaf and not root.keys
+        self.pool.unpin(root.pid)
+        if not empty:
+            raise ValueError("bulk_load requires an empty tree")
+
+        leaf_target = max(self._min_leaf_keys, 1, int((self.order - 1) * fill_factor))
+        level = []  # (page id, separator between it and the subtree before it)
+        built = []
+        state = {'prev': None}
+
+        def add(node, kind):
+            # The next page id is not known yet; the widest one is assumed.
+            next_pid = node.next
+            if node.is_leaf:
+                node.next = 0xFFFFFFFF
+            if len(node.to_bytes()) > self.page_size:
+                raise ValueError(f"{kind} of {len(node.keys)} keys from {node.keys[0]!r} does not fit in a "
+                                 f"{self.page_size}-byte page; use a larger page_size or a smaller order")
+            node.next = next_pid
+            pid = self.pool.new(node)
+            built.append(pid)
+            return pid
+
+        def emit(keys, values):
+            leaf = PagedNode(is_leaf=True, keys=keys, values=values)
+            pid = add(leaf, "A leaf")
+            prev = state['prev']
+            if prev is not None:
+                prev.next = pid
+                level.append((pid, shortest_separator(prev.keys[-1], keys[0])))
+                self.pool.unpin(prev.pid, dirty=True)
+            else:
+                level.append((pid, keys[0]))
+            state['prev'] = leaf
+
+        keys, values = [], []
+        count = 0
+        try:
+            for key, value in sorted_items:
+                if keys and key < keys[-1]:
+                    raise ValueError(f"bulk_load items are not sorted: {key!r} after {keys[-1]!r}")
+                keys.append(key)
+                values.append(value)
+                count += 1
+                if len(keys) >= 2 * leaf_target:
+                    emit(keys[:leaf_target], values[:leaf_target])
+                    keys, values = keys[leaf_target:], values[leaf_target:]
+            if not count:
+                return
+            start = 0
+            for size in BPlusTree._chunk_sizes(len(keys), leaf_target, self._min_leaf_keys, self.order - 1):
+                emit(keys[start:start + size], values[start:start + size])
+                start += size
+            self.pool.unpin(state['prev'].pid)
+
+            min_children = self._min_internal_keys + 1
+            child_target = max(min_children, int(self.order * fill_factor))
+            while len(level) > 1:
+                parents = []
+                start = 0
+                for size in BPlusTree._chunk_sizes(len(level), child_target, min_children, self.order):
+                    group = level[start:start + size]
+                    node = PagedNode(is_leaf=False, keys=[separator for _, separator in group[1:]],
+                                     values=[pid for pid, _ in group])
+                    pid = add(node, "An internal node")
+                    self.pool.unpin(pid)
+                    parents.append((pid, group[0][1]))
+                    start += size
+                level = parents
+        except BaseException:
+            # Nothing is linked into the tree until the root is swapped below,
+            # so dropping the pages built so far leaves it as it was.
+            for pid in built:
+                self.pool.free(pid)
+            raise
+
+        self.pool.free(self.pager.root)
+        self.pager.root = level[0][0]
+        self.pager.size = count
@@ -0,0 +1,214 @@
+import mmap
+import os
+import pickle
+import struct
+from collections import OrderedDict
+
+# Page 0 holds the file header; node pages start at 1, so 0 doubles as "no page".
+HEADER = struct.Struct('<4sHIIIIIQ')  # magic, version, page_size, order, root, page_count, free_head, size
+PAGE_HEADER = struct.Struct('<BI')     # page type, payload length
+MAGIC = b'BPTP'
+VERSION = 1
+
+LEAF_PAGE, INTERNAL_PAGE, FREE_PAGE = 1, 2, 3
+NO_PAGE = 0
+
+
+class PagedNode:
+    """In-memory image of a single B+ tree page.
+
+    Internal nodes store child page IDs in ``values``; leaves store the
+    records and the page ID of the next leaf in ``next``. A leaf's ``nbytes``
+    is an upper bound on its encoded size, or None when it is not known.
+    """
+    __slots__ = ('pid', 'is_leaf', 'keys', 'values', 'next', 'nbytes')
+
+    def __init__(self, is_leaf, keys=None, values=None, next=NO_PAGE):
+        self.pid = NO_PAGE
+        self.is_leaf = is_leaf
+        self.keys = keys if keys is not None else []
+        self.values = values if values is not None else []
+        self.next = next
+        self.nbytes = None
+
+    def to_bytes(self):
+        payload = pickle.dumps((self.keys, self.values, self.next), pickle.HIGHEST_PROTOCOL)
+        page_type = LEAF_PAGE if self.is_leaf else INTERNAL_PAGE
+        self.nbytes = PAGE_HEADER.size + len(payload)
+        return PAGE_HEADER.pack(page_type, len(payload)) + payload
+
+    @classmethod
+    def from_bytes(cls, data):
+        page_type, length = PAGE_HEADER.unpack_from(data)
+        if page_type not in (LEAF_PAGE, INTERNAL_PAGE):
+            raise ValueError(f"Page type {page_type} is not a tree node")
+        start = PAGE_HEADER.size
+        keys, values, next_pid = pickle.loads(data[start:start + length])
+        node = cls(page_type == LEAF_PAGE, keys, values, next_pid)
+        node.nbytes = start + length
+        return node
+
+
+class Pager:
+    """Fixed-size pages of a single memory-mapped file."""
+
+    def __init__(self, path, page_size=4096, order=64):
+        if page_size < 256:
+            raise ValueError("page_size must be at least 256 bytes")
+        self.path = path
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        self._file = open(path, 'r+b' if exists else 'w+b')
+        if exists:
+            header = self._file.read(HEADER.size)
+            magic, version, page_size, order, root, page_count, free_head, size = HEADER.unpack(header)
+            if magic != MAGIC or version != VERSION:
+                self._file.close()
+                raise ValueError(f"'{path}' is not a B+ tree page file")
+        else:
+            root, page_count, free_head, size = NO_PAGE, 1, NO_PAGE, 0
+            self._file.truncate(page_size * 64)
+        self.page_size = page_size
+        self.order = order
+        self.root = root
+        self.page_count = page_count
+        self.free_head = free_head
+        self.size = size
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+        if not exists:
+            self.write_header()
+
+    def write_header(self):
+        self._mm[:HEADER.size] = HEADER.pack(MAGIC, VERSION, self.page_size, self.order, self.root,
+                                             self.page_count, self.free_head, self.size)
+
+    def _grow(self, min_pages):
+        capacity = len(self._mm) // self.page_size
+        while capacity < min_pages:
+            capacity *= 2
+        self._mm.flush()
+        self._mm.close()
+        self._file.truncate(capacity * self.page_size)
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+
+    def allocate(self):
+        if self.free_head != NO_PAGE:
+            pid = self.free_head
+            offset = pid * self.page_size + PAGE_HEADER.size
+            self.free_head = struct.unpack_from('<I', self._mm, offset)[0]
+            return pid
+        pid = self.page_count
+        self.page_count += 1
+        if self.page_count * self.page_size > len(self._mm):
+            self._grow(self.page_count)
+        return pid
+
+    def release(self, pid):
+        offset = pid * self.page_size
+        self._mm[offset:offset + PAGE_HEADER.size + 4] = (
+            PAGE_HEADER.pack(FREE_PAGE, 4) + struct.pack('<I', self.free_head))
+        self.free_head = pid
+
+    def read_node(self, pid):
+        offset = pid * self.page_size
+        node = PagedNode.from_bytes(self._mm[offset:offset + self.page_size])
+        node.pid = pid
+        return node
+
+    def write_node(self, node):
+        data = node.to_bytes()
+        if len(data) > self.page_size:
+            raise ValueError(f"Node of {len(data)} bytes does not fit in a {self.page_size}-byte page; "
+                             f"use a larger page_size or a smaller order")
+        offset = node.pid * self.page_size
+        self._mm[offset:offset + len(data)] = data
+
+    def flush(self):
+        self.write_header()
+        self._mm.flush()
+
+    def close(self):
+        if self._mm.closed:
+            return
+        self.flush()
+        self._mm.close()
+        self._file.close()
+
+
+class BufferPool:
+    """Bounded cache of decoded pages with pinning, dirty tracking and LRU eviction."""
+
+    def __init__(self, pager, capacity=256):
+        if capacity < 16:
+            raise ValueError("Buffer pool needs at least 16 frames")
+        self.pager = pager
+        self.capacity = capacity
+        self._frames = OrderedDict()  # pid -> [node, pin_count, dirty]
+        self.hits = self.misses = self.evictions = self.writes = 0
+
+    def __len__(self):
+        return len(self._frames)
+
+    def fetch(self, pid):
+        frame = self._frames.get(pid)
+        if frame is None:
+            self.misses += 1
+            self._make_room()
+            frame = [self.pager.read_node(pid), 0, False]
+            self._frames[pid] = frame
+        else:
+            self.hits += 1
+            self._frames.move_to_end(pid)
+        frame[1] += 1
+        return frame[0]
+
+    def new(self, node):
+        self._make_room()
+        node.pid = self.pager.allocate()
+        self._frames[node.pid] = [node, 1, True]
+        return node.pid
+
+    def unpin(self, pid, dirty=False):
+        frame = self._frames.get(pid)
+        if frame is None:
+            return
+        frame[1] -= 1
+        if dirty:
+            frame[2] = True
+
+    def mark_dirty(self, pid):
+        self._frames[pid][2] = True
+
+    def free(self, pid):
+        self._frames.pop(pid, None)
+        self.pager.release(pid)
+
+    def _make_room(self):
+        if len(self._frames) < self.capacity:
+            return
+        for pid, (node, pins, dirty) in self._frames.items():
+            if pins == 0:
+                if dirty:
+                    self.pager.write_node(node)
+                    self.writes += 1
+                del self._frames[pid]
+                self.evictions += 1
+                return
+        raise RuntimeError(f"Buffer pool exhausted: all {self.capacity} frames are pinned")
+
+    def flush(self):
+        for node, _, dirty in self._frames.values():
+            if dirty:
+                self.pager.write_node(node)
+                self.writes += 1
+        for frame in self._frames.values():
+            frame[2] = False
+        self.pager.flush()
+
+    def stats(self):
+        return {'frames': len(self._frames), 'capacity': self.capacity, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions, 'writes': self.writes}
+
+    def close(self):
+        self.flush()
+        self._frames.clear()
+        self.pager.close()
@@ -0,0 +1,466 @@
+import bisect
+import contextlib
+import heapq
+import itertools
+import multiprocessing
+import operator
+import os
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+import query
+from keys import prefix_bounds
+from records import normalize_key
+from table import Table, _gc_paused
+
+PARTITION_SCHEMES = ('hash', 'range')
+_CAN_FORK = 'fork' in multiprocessing.get_all_start_methods()
+
+# What pool workers operate on: one entry per partition, inherited when the
+# worker forks, so partitions are never pickled on the way in.
+_payload = None
+
+
+def _adopt(payload):
+    global _payload
+    _payload = payload
+
+
+def _call(task, index, args):
+    return task(_payload[index], *args)
+
+
+def partition_hash(key):
+    """Hash of a search key that is the same in every process.
+
+    hash() of str and bytes is salted per interpreter, which would route a
+    key to a different partition after a restart or in a spawned worker.
+    """
+    if isinstance(key, str):
+        return zlib.crc32(key.encode('utf-8', 'surrogatepass'))
+    if isinstance(key, bytes):
+        return zlib.crc32(key)
+    if isinstance(key, tuple):
+        h = 0x345678
+        for part in key:
+            h = (h * 1000003 ^ partition_hash(part)) & 0xFFFFFFFFFFFFFFFF
+        return h
+    return hash(key)
+
+
+# --- Tasks; each runs against one partition, in a worker or in-process ---
+
+def _select_task(table, where, order_by, stop):
+    return list(query.ordered_rows(table, query.plan(table, where, None, order_by, stop)))
+
+
+def _aggregate_task(table, func, column, where):
+    return query.aggregate(table, func, column, where)
+
+
+def _encode_task(item):
+    table, records = item
+    with _gc_paused():
+        return table._encode_batch(records)
+
+
+class PartitionedTable:
+    """Table split into independent partitions on its search key.
+
+    Rows go to a partition by a stable hash of the key, or by key range
+    with partition_by='range' and the partitions - 1 sorted boundaries
+    between them. Point operations touch only their partition. Filtering
+    or sorting queries, aggregates and the validation and sorting of bulk
+    loads fan out over a pool of forked worker processes once they involve
+    at least parallel_threshold rows; results are merged back in key order.
+    Plain scans read the partitions in-process, since copying rows back
+    from a worker costs more than reading them.
+
+    Workers see the partitions as they were when the pool forked, so the
+    pool is replaced after writes; read-mostly tables reuse it. Secondary
+    indexes are kept per partition and cannot be unique, since a value's
+    holders may sit in different partitions.
+    """
+    _log = None  # set by DatabaseManager when a write-ahead log is attached
+    parallel_threshold = 100_000  # rows a fan-out must touch before it uses the pool
+
+    def __init__(self, name, schema = {}, order=8, search_key=None, partitions=4, partition_by='hash',
+                 boundaries=None, workers=None, engine='memory', **table_options):
+        if engine != 'memory':
+            raise ValueError("Partitioned tables only support the memory engine")
+        if partitions < 1:
+            raise ValueError("A partitioned table needs at least one partition")
+        if partition_by not in PARTITION_SCHEMES:
+            raise ValueError(f"Unknown partitioning '{partition_by}', expected one of {PARTITION_SCHEMES}")
+        if partition_by == 'range':
+            boundaries = list(boundaries or ())
+            if len(boundaries) != partitions - 1:
+                raise ValueError(f"Range partitioning into {partitions} needs {partitions - 1} boundaries")
+            if any(low >= high for low, high in zip(boundaries, boundaries[1:])):
+                raise ValueError("Partition boundaries must be strictly increasing")
+        elif boundaries is not None:
+            raise ValueError("Boundaries only apply to range partitioning")
+        self.name = name
+        self.schema = schema
+        self.order = order
+        self.search_key = search_key = normalize_key(search_key)
+        self.engine = engine
+        self.partition_by = partition_by
+        self.boundaries = boundaries
+        self.workers = workers if workers is not None else min(partitions, os.cpu_count() or 1)
+        self.partitions = [Table(f'{name}.{i}', schema, order, search_key, **table_options)
+                           for i in range(partitions)]
+        self.codec = self.partitions[0].codec
+        self._version = 0  # bumped by every write; the pool is stale once it moves on
+        self._pool = None
+        self._pool_version = None
+        # Held from a write's first change to its log record, as in Table.
+        self._write_lock = threading.RLock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_log', None)
+        state.pop('_write_lock', None)
+        state['_pool'] = state['_pool_version'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._write_lock = threading.RLock()
+
+    def __len__(self):
+        return sum(len(partition.data) for partition in self.partitions)
+
+    def _route(self, key):
+        if self.partition_by == 'range':
+            return bisect.bisect_right(self.boundaries, key)
+        return partition_hash(key) % len(self.partitions)
+
+    def _covering(self, start, end):
+        # Partitions that can hold keys between start and end.
+        if self.partition_by == 'hash':
+            return list(range(len(self.partitions)))
+        low = 0 if start is None else bisect.bisect_right(self.boundaries, start)
+        high = len(self.partitions) - 1 if end is None else bisect.bisect_right(self.boundaries, end)
+        return list(range(low, high + 1))
+
+    def _prune(self, plan):
+        if plan.access == 'empty':
+            return []
+        if plan.access == 'key_points':
+            return sorted({self._route(key) for key in plan.points})
+        if plan.access == 'key_range':
+            return self._covering(plan.low, plan.high)
+        return list(range(len(self.partitions)))
+
+    def _merge(self, results, key, reverse):
+        # Range partitions are already in key order relative to each other.
+        if self.partition_by == 'range':
+            ordered = reversed(results) if reverse else results
+            return itertools.chain.from_iterable(ordered)
+        return heapq.merge(*results, key=key, reverse=reverse)
+
+    # --- Fan-out ---
+
+    def _use_pool(self, indexes, rows=None):
+        if rows is None:
+            rows = sum(len(self.partitions[i].data) for i in indexes)
+        return _CAN_FORK and self.workers > 1 and len(indexes) > 1 and rows >= self.parallel_threshold
+
+    def _fan_out(self, task, indexes, args, parallel=True):
+        """Runs task(partition, *args) for each partition index; returns the results in order."""
+        if not (parallel and self._use_pool(indexes)):
+            return [task(self.partitions[i], *args) for i in indexes]
+        if self._pool is None or self._pool_version != self._version:
+            self._shutdown_pool()
+            self._pool = self._fork_pool(self.partitions)
+            self._pool_version = self._version
+        futures = [self._pool.submit(_call, task, i, args) for i in indexes]
+        return [future.result() for future in futures]
+
+    @staticmethod
+    def _offloads(plan):
+        # A query is worth a worker when it filters or sorts, so that less
+        # comes back than is read.
+        return bool(plan.residual or plan.sort)
+
+    def _fork_pool(self, payload):
+        pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('fork'),
+                                   initializer=_adopt, initargs=(payload,))
+        # Fork workers start on the first submit. Holding the write locks
+        # keeps another thread from being copied halfway through a change.
+        with contextlib.ExitStack() as stack:
+            for partition in self.partitions:
+                stack.enter_context(partition._write_lock)
+            pool.submit(int).result()
+        return pool
+
+    def _shutdown_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    # --- Writes ---
+
+    def insert(self, record):
+        row = self.codec.encode(record)
+        with self._write_lock:
+            if not self.partitions[self._route(self.codec.key_of(row))].insert(record):
+                return False
+            self._version += 1
+            if self._log is not None:
+                self._log('insert', record)
+        return True
+
+    def insert_many(self, records, fill_factor=1.0):
+        with _gc_paused():
+            return self._insert_many(list(records), fill_factor)
+
+    def _insert_many(self, records, fill_factor):
+        batches = [[] for _ in self.partitions]
+        record_key, route = self.codec.record_key, self._route
+        for record in records:
+            try:
+                key = record_key(record)
+            except (TypeError, KeyError):
+                self.codec.encode(record)  # raises the codec's error for a malformed record
+                raise
+            batches[route(key)].append(record)
+
+        # Every batch is validated before any partition changes, as in Table.
+        items = list(zip(self.partitions, batches))
+        if self._use_pool(range(len(items)), len(records)):
+            with self._fork_pool(items) as pool:
+                futures = [pool.submit(_call, _encode_task, i, ()) for i in range(len(items))]
+                prepared = [future.result() for future in futures]
+        else:
+            prepared = [_encode_task(item) for item in items]
+
+        inserted = duplicates = 0
+        with self._write_lock:
+            for partition, batch, (unique, skipped) in zip(self.partitions, batches, prepared):
+                if unique:
+                    count, rejected = partition._load_batch(unique, fill_factor, batch)
+                    inserted += count
+                    skipped += rejected
+                duplicates += skipped
+            self._version += 1
+            if self._log is not None and inserted:
+                self._log('insert_many', records, fill_factor)
+        if duplicates:
+            print(f"{duplicates} duplicate keys skipped.")
+        print(f'{inserted} records inserted successfully')
+        return inserted
+
+    def update(self, record_id, new_record):
+        with self._write_lock:
+            if not self.partitions[self._route(record_id)].update(record_id, new_record):
+                return False
+            self._version += 1
+            if self._log is not None:
+                self._log('update', record_id, new_record)
+        return True
+
+    def delete(self, record_id):
+        with self._write_lock:
+            if not self.partitions[self._route(record_id)].delete(record_id):
+                return False
+            self._version += 1
+            if self._log is not None:
+                self._log('delete', record_id)
+        return True
+
+    def delete_range(self, start=None, end=None, inclusive=(True, True), lazy=False):
+        """Deletes the records with keys between start and end; see Table.delete_range."""
+        with self._write_lock:
+            removed = sum(self.partitions[index].delete_range(start, end, inclusive, lazy)
+                          for index in self._covering(start, end))
+            if removed:
+                self._version += 1
+                if self._log is not None:
+                    self._log('delete_range', start, end, inclusive, lazy)
+        return removed
+
+    def compact(self):
+        for partition in self.partitions:
+            partition.compact()
+
+    # --- Reads ---
+
+    def get(self, record_id, as_rows=False):
+        return self.partitions[self._route(record_id)].get(record_id, as_rows)
+
+    def get_many(self, record_ids, as_rows=False):
+        """Returns the records for record_ids in the same order, None where missing."""
+        groups = {}
+        for i, key in enumerate(record_ids):
+            groups.setdefault(self._route(key), []).append(i)
+        results = [None] * len(record_ids)
+        for index, positions in groups.items():
+            found = self.partitions[index].get_many([record_ids[i] for i in positions], as_rows)
+            for i, record in zip(positions, found):
+                results[i] = record
+        return results
+
+    def get_all(self, as_rows=False):
+        return list(self.scan(as_rows=as_rows))
+
+    def range_query(self, start_value, end_value, as_rows=False):
+        return list(self.scan(start_value, end_value, as_rows=as_rows))
+
+    def scan(self, start=None, end=None, inclusive=(True, True), reverse=False, limit=None, offset=0,
+             as_rows=False):
+        """Lazily yields (key, record) pairs in key order; see BPlusTree.scan for the arguments.
+
+        Each partition's cursor is read only as far as the merge needs it.
+        """
+        stop = None if limit is None else offset + limit
+        indexes = self._covering(start, end)
+        # Shipping every row back from a worker costs more than reading it
+        # here, so plain scans stay in-process.
+        cursors = [self.partitions[i].data.scan(start, end, inclusive, reverse, stop) for i in indexes]
+        pairs = itertools.islice(self._merge(cursors, operator.itemgetter(0), reverse), offset, stop)
+        if as_rows:
+            return pairs
+        decode = self.codec.decode
+        return ((key, decode(row)) for key, row in pairs)
+
+    def scan_prefix(self, prefix, reverse=False, limit=None, offset=0, as_rows=False):
+        """Yields the (key, record) pairs whose key starts with prefix; see Table.scan_prefix."""
+        start, end, inclusive = prefix_bounds(prefix)
+        return self.scan(start, end, inclusive, reverse, limit, offset, as_rows)
+
+    def select(self, where=None, columns=None, order_by=None, limit=None, offset=0):
+        """Returns the records matching where; see Table.select."""
+        if offset < 0:
+            raise ValueError("limit and offset must not be negative")
+        stop = None if limit is None else offset + limit
+        plan = query.plan(self.partitions[0], where, columns, order_by, stop)
+        indexes = self._prune(plan)
+        results = self._fan_out(_select_task, indexes, (where, order_by, stop), self._offloads(plan))
+        if plan.sort:
+            found = query.sort_rows(itertools.chain.from_iterable(results), plan.sort,
+                                    self.codec.positions, stop)
+        else:
+            found = self._merge(results, self.codec.key_of, plan.reverse)
+        return query.project(self.codec, columns, itertools.islice(found, offset, stop))
+
+    def explain(self, where=None, columns=None, order_by=None, limit=None, offset=0):
+        """Returns the plan select() would run, with the per-partition plan below the merge."""
+        stop = None if limit is None else offset + limit
+        plan = query.plan(self.partitions[0], where, None, order_by, stop)
+        indexes = self._prune(plan)
+        lines = []
+        if columns is not None:
+            lines.append(f"Project {', '.join([columns] if isinstance(columns, str) else columns)}")
+        if limit is not None or offset:
+            lines.append(f"Limit {limit if limit is not None else 'all'} offset {offset}")
+        mode = 'parallel' if self._offloads(plan) and self._use_pool(indexes) else 'serial'
+        lines.append(f"{'SortMerge' if plan.sort else 'Merge'} {len(indexes)} of "
+                     f"{len(self.partitions)} partitions ({self.partition_by}, {mode})")
+        text = ['  ' * depth + line for depth, line in enumerate(lines)]
+        text.extend('  ' * len(lines) + line for line in plan.explain().split('\n'))
+        return '\n'.join(text)
+
+    def count(self, where=None, column=None):
+        return self._aggregate('count', column, where)
+
+    def sum(self, column, where=None):
+        return self._aggregate('sum', column, where)
+
+    def min(self, column, where=None):
+        return self._aggregate('min', column, where)
+
+    def max(self, column, where=None):
+        return self._aggregate('max', column, where)
+
+    def _aggregate(self, func, column, where):
+        if column is not None and column not in self.schema:
+            raise KeyError(f"Field '{column}' is not in the schema.")
+        indexes = self._prune(query.plan(self.partitions[0], where))
+        results = self._fan_out(_aggregate_task, indexes, (func, column, where))
+        if func in ('count', 'sum'):
+            return sum(results)
+        found = [value for value in results if value is not None]
+        return (min if func == 'min' else max)(found, default=None)
+
+    # --- Secondary indexes ---
+
+    def create_index(self, field, unique=False):
+        if unique:
+            raise ValueError("Unique indexes are not supported on partitioned tables")
+        if field not in self.schema:
+            raise KeyError(f"Field '{field}' is not in the schema of table '{self.name}'.")
+        with self._write_lock:
+            if field in self.partitions[0].indexes:
+                print(f"Index on '{field}' already exists in table '{self.name}'.")
+                return
+            for partition in self.partitions:
+                partition.create_index(field)
+            self._version += 1
+            if self._log is not None:
+                self._log('create_index', field, unique)
+
+    def drop_index(self, field):
+        with self._write_lock:
+            if field not in self.partitions[0].indexes:
+                print(f"No index on '{field}' in table '{self.name}'.")
+                return
+            for partition in self.partitions:
+                partition.drop_index(field)
+            self._version += 1
+            if self._log is not None:
+                self._log('drop_index', field)
+
+    def get_by(self, field, value):
+        """Returns the records whose indexed field equals value, in key order."""
+        results = [partition.get_by(field, value) for partition in self.partitions]
+        return list(self._merge(results, self.codec.record_key, False))
+
+    def range_query_by(self, field, start_value, end_value):
+        """Returns (value, record) pairs with start_value <= field <= end_value, ordered by value."""
+        results = [partition.range_query_by(field, start_value, end_value) for partition in self.partitions]
+        return list(heapq.merge(*results, key=operator.itemgetter(0)))
+
+    def snapshot(self):
+        raise ValueError("Snapshots are not supported on partitioned tables")
+
+    # --- Metrics and lifecycle ---
+
+    def enable_metrics(self):
+        for partition in self.partitions:
+            partition.enable_metrics()
+
+    def disable_metrics(self):
+        for partition in self.partitions:
+            partition.disable_metrics()
+
+    def enable_cache(self, capacity=1024, max_bytes=None, policy='slru'):
+        # Each partition gets its own cache with an equal share of the bounds.
+        share = len(self.partitions)
+        for partition in self.partitions:
+            partition.enable_cache(None if capacity is None else max(capacity // share, 1),
+                                   None if max_bytes is None else max(max_bytes // share, 1), policy)
+
+    def disable_cache(self):
+        for partition in self.partitions:
+            partition.disable_cache()
+
+    def stats(self):
+        """Returns each partition's stats under 'partitions'."""
+        return {
+            'engine': self.engine,
+            'partition_by': self.partition_by,
+            'rows': len(self),
+            'partitions': [partition.stats() for partition in self.partitions],
+        }
+
+    def close(self):
+        self._shutdown_pool()
+        for partition in self.partitions:
+            partition.close()
+
+    def drop(self):
+        self._shutdown_pool()
+        for partition in self.partitions:
+            partition.drop()
@@ -0,0 +1,465 @@
+"""Predicate compilation and a small index-aware planner for Table queries.
+
+A predicate is one of:
+
+    {'dept': 'cs', 'year': 2024}          equality on every listed field
+    ('age', '>=', 21)                     comparison: == != < <= > >= in
+    [pred, pred, ...] or ('and', pred, ...)
+    ('or', pred, pred, ...)
+
+Conjuncts on the search key become scan bounds or point lookups; with a
+composite key, equalities on its leading fields and a range on the field
+after them do. Failing that, an equality, IN or range conjunct on an
+indexed field is answered from the index. Everything else is checked against the stored row tuples,
+and only rows that are returned get turned into dicts.
+"""
+import heapq
+import itertools
+import operator
+from keys import MAX
+
+COMPARISONS = {
+    '==': operator.eq, '!=': operator.ne,
+    '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+}
+OPERATORS = tuple(COMPARISONS) + ('in',)
+
+
+# --- Predicates ---
+
+def normalize(where, schema):
+    """Returns the predicate as a list of AND-ed terms.
+
+    A term is a (field, op, value) comparison or an ('or', [terms...]) group
+    whose members are themselves lists of AND-ed terms.
+    """
+    if where is None:
+        return []
+    if isinstance(where, dict):
+        return [_term(field, '==', value, schema) for field, value in where.items()]
+    if isinstance(where, list):
+        return [term for part in where for term in normalize(part, schema)]
+    if isinstance(where, tuple) and where and where[0] in ('and', 'or'):
+        parts = [normalize(part, schema) for part in where[1:]]
+        if where[0] == 'and':
+            return [term for part in parts for term in part]
+        return [('or', parts)]
+    if isinstance(where, tuple) and len(where) == 3:
+        return [_term(*where, schema)]
+    raise ValueError(f"Cannot interpret predicate {where!r}")
+
+
+def _term(field, op, value, schema):
+    if field not in schema:
+        raise KeyError(f"Field '{field}' is not in the schema.")
+    if op not in OPERATORS:
+        raise ValueError(f"Unknown operator '{op}', expected one of {OPERATORS}")
+    if op == 'in':
+        value = frozenset(value)
+    return (field, op, value)
+
+
+def compile_terms(terms, positions):
+    """Builds a row -> bool function for AND-ed terms; None means always true.
+
+    Rows hold None for absent fields, and an absent field matches nothing.
+    """
+    checks = [_compile_term(term, positions) for term in terms]
+    if not checks:
+        return None
+    if len(checks) == 1:
+        return checks[0]
+    return lambda row: all(check(row) for check in checks)
+
+
+def _compile_term(term, positions):
+    if term[0] == 'or':
+        groups = [compile_terms(group, positions) or (lambda row: True) for group in term[1]]
+        return lambda row: any(group(row) for group in groups)
+    field, op, value = term
+    pos = positions[field]
+    if op == 'in':
+        return lambda row: row[pos] in value
+    compare = COMPARISONS[op]
+    return lambda row: row[pos] is not None and compare(row[pos], value)
+
+
+def describe_terms(terms):
+    parts = []
+    for term in terms:
+        if term[0] == 'or':
+            parts.append('(' + ' OR '.join(describe_terms(group) or 'TRUE' for group in term[1]) + ')')
+        else:
+            field, op, value = term
+            if op == 'in':
+                value = sorted(value, key=repr)
+            parts.append(f"{field} {op.upper() if op == 'in' else op} {value!r}")
+    return ' AND '.join(parts)
+
+
+# --- Planning ---
+
+class Plan:
+    """Access path plus the operators applied on top of it, as chosen by plan()."""
+
+    def __init__(self):
+        self.access = 'full'     # full | key_range | key_points | index_points | index_range | empty
+        self.low = self.high = None
+        self.include_low = self.include_high = True
+        self.points = None       # sorted keys for key_points, values for index_points
+        self.key = None          # the table's search key
+        self.index = None        # field answered from a secondary index
+        self.consumed = []       # terms answered by the access path
+        self.residual = []       # terms checked against each row
+        self.reverse = False     # walk the access path in descending key order
+        self.sort = []           # (field, descending) pairs when the output must be sorted
+        self.columns = None
+        self.limit = None
+        self.offset = 0
+        self.seeked = False      # offset already applied by rank on an augmented tree
+
+    def explain(self):
+        lines = []
+        if self.columns is not None:
+            lines.append(f"Project {', '.join(self.columns)}")
+        if self.limit is not None or self.offset:
+            lines.append(f"Limit {self.limit if self.limit is not None else 'all'} offset {self.offset}")
+        if self.sort:
+            order = ', '.join(f"{field} {'DESC' if desc else 'ASC'}" for field, desc in self.sort)
+            top = f" (top {self.offset + self.limit})" if self.limit is not None else ''
+            lines.append(f"Sort {order}{top}")
+        if self.residual:
+            lines.append(f"Filter {describe_terms(self.residual)}")
+        lines.append(self._describe_access())
+        return '\n'.join('  ' * depth + line for depth, line in enumerate(lines))
+
+    def _describe_access(self):
+        order = ' DESC' if self.reverse else ''
+        if self.access == 'empty':
+            return "Empty (predicate cannot match)"
+        if self.access == 'key_points':
+            return f"KeyLookup {self.key} IN {self.points!r}{order}"
+        if self.access == 'index_points':
+            return f"IndexLookup {self.index} IN {self.points!r}{order}"
+        if self.access == 'index_range':
+            return f"IndexRangeScan {self._describe_bounds(self.index)}{order}"
+        if self.access == 'key_range':
+            seek = ' (offset by rank)' if self.seeked else ''
+            return f"KeyRangeScan {self._describe_bounds(self.key)}{order}{seek}"
+        return f"FullScan{order}"
+
+    def _describe_bounds(self, name):
+        parts = []
+        if self.low is not None:
+            parts.append(f"{name} {'>=' if self.include_low else '>'} {self.low!r}")
+        if self.high is not None:
+            parts.append(f"{name} {'<=' if self.include_high else '<'} {self.high!r}")
+        return ' AND '.join(parts)
+
+
+def plan(table, where=None, columns=None, order_by=None, limit=None, offset=0):
+    """Chooses the access path and operators for a query against table."""
+    schema, search_key = table.schema, table.search_key
+    if columns is not None:
+        columns = [columns] if isinstance(columns, str) else list(columns)
+        for field in columns:
+            if field not in schema:
+                raise KeyError(f"Field '{field}' is not in the schema.")
+    if limit is not None and limit < 0 or offset < 0:
+        raise ValueError("limit and offset must not be negative")
+
+    result = Plan()
+    result.key = search_key
+    result.columns, result.limit, result.offset = columns, limit, offset
+    terms = normalize(where, schema)
+    key_terms = [term for term in terms if term[0] == search_key]
+    if isinstance(search_key, tuple):
+        _plan_composite_key(result, terms, search_key)
+        if result.access == 'full':
+            _plan_index(result, terms, table.indexes)
+    elif key_terms:
+        _plan_key(result, key_terms)
+    else:
+        _plan_index(result, terms, table.indexes)
+    result.residual = [term for term in terms if not any(term is used for used in result.consumed)]
+    _plan_order(result, order_by, schema, search_key)
+    if (offset and result.access in ('full', 'key_range') and not result.residual and not result.sort
+            and hasattr(table.data, 'count_range')):
+        _seek_offset(result, table.data)
+    return result
+
+
+def _plan_key(result, key_terms):
+    bounds = _Bounds()
+    points = None
+    for term in key_terms:
+        _, op, value = term
+        if op == '!=':
+            continue  # left for the filter
+        result.consumed.append(term)
+        if op == 'in' or op == '==':
+            values = value if op == 'in' else {value}
+            points = set(values) if points is None else points & values
+        else:
+            bounds.add(op, value)
+    if points is not None:
+        result.access = 'key_points'
+        result.points = sorted(point for point in points if bounds.admits(point))
+    elif bounds.low is not None or bounds.high is not None:
+        result.access = 'key_range'
+        bounds.apply(result)
+    if bounds.empty() or (points is not None and not result.points):
+        result.access = 'empty'
+
+
+def _plan_composite_key(result, terms, fields):
+    # Keys sharing their leading fields are one run of the tree, so
+    # equalities on a leading run of fields and a range on the next field
+    # bound a scan. MAX pads a bound past every key that extends it.
+    prefix = ()
+    for field in fields:
+        term = next((term for term in terms if term[0] == field and term[1] == '=='), None)
+        if term is None:
+            break
+        prefix += (term[2],)
+        result.consumed.append(term)
+    if len(prefix) == len(fields):
+        result.access = 'key_points'
+        result.points = [prefix]
+        return
+    bounds = _Bounds()
+    for term in terms:
+        if term[0] == fields[len(prefix)] and term[1] in ('<', '<=', '>', '>='):
+            bounds.add(term[1], term[2])
+            result.consumed.append(term)
+    if not prefix and bounds.low is None and bounds.high is None:
+        return
+    if bounds.empty():
+        result.access = 'empty'
+        return
+    result.access = 'key_range'
+    if bounds.low is None:
+        result.low = prefix
+    else:
+        result.low = prefix + ((bounds.low,) if bounds.include_low else (bounds.low, MAX))
+    if bounds.high is None:
+        result.high = prefix + (MAX,)
+    else:
+        result.high = prefix + ((bounds.high, MAX) if bounds.include_high else (bounds.high,))
+    result.include_low, result.include_high = True, False
+
+
+def _plan_index(result, terms, indexes):
+    # Equality and IN beat ranges; the first qualifying field wins.
+    ranged = None
+    for term in terms:
+        if term[0] == 'or' or term[0] not in indexes:
+            continue
+        field, op, value = term
+        if op in ('==', 'in'):
+            result.access = 'index_points'
+            result.index = field
+            result.points = sorted({value} if op == '==' else value)
+            result.consumed.append(term)
+            return
+        if op != '!=' and ranged is None:
+            ranged = field
+    if ranged is not None:
+        bounds = _Bounds()
+        for term in terms:
+            if term[0] == ranged and term[1] not in ('==', 'in', '!='):
+                bounds.add(term[1], term[2])
+                result.consumed.append(term)
+        result.access = 'empty' if bounds.empty() else 'index_range'
+        result.index = ranged
+        bounds.apply(result)
+
+
+def _plan_order(result, order_by, schema, search_key):
+    if order_by is None:
+        return
+    order = []
+    for item in [order_by] if isinstance(order_by, str) else order_by:
+        desc = item.startswith('-')
+        field = item[1:] if desc else item
+        if field not in schema:
+            raise KeyError(f"Field '{field}' is not in the schema.")
+        order.append((field, desc))
+    # Every access path produces rows in key order, so ordering by the key,
+    # or by leading fields of a composite key, in one direction only
+    # decides the direction of the walk.
+    key_fields = search_key if isinstance(search_key, tuple) else (search_key,)
+    if (tuple(field for field, _ in order) == key_fields[:len(order)]
+            and len({desc for _, desc in order}) == 1):
+        result.reverse = order[0][1]
+    else:
+        result.sort = order
+
+
+def _seek_offset(result, data):
+    # On an augmented tree the rows skipped by an offset are counted, not
+    # walked: select() finds the first row to return in O(log n).
+    below = 0 if result.low is None else data.count_range(None, result.low, (True, not result.include_low))
+    upto = len(data) if result.high is None else data.count_range(None, result.high, (True, result.include_high))
+    if result.reverse:
+        i = upto - 1 - result.offset
+        if i >= below:
+            result.high, result.include_high = data.select(i)[0], True
+    else:
+        i = below + result.offset
+        if i < upto:
+            result.low, result.include_low = data.select(i)[0], True
+    result.access = 'key_range' if below <= i < upto else 'empty'
+    result.offset = 0
+    result.seeked = True
+
+
+class _Bounds:
+    """Tightest [low, high] interval implied by a set of comparisons."""
+
+    def __init__(self):
+        self.low = self.high = None
+        self.include_low = self.include_high = True
+
+    def add(self, op, value):
+        if op in ('>', '>='):
+            inclusive = op == '>='
+            if self.low is None or value > self.low or (value == self.low and not inclusive):
+                self.low, self.include_low = value, inclusive
+        else:
+            inclusive = op == '<='
+            if self.high is None or value < self.high or (value == self.high and not inclusive):
+                self.high, self.include_high = value, inclusive
+
+    def admits(self, value):
+        if self.low is not None and (value < self.low or (value == self.low and not self.include_low)):
+            return False
+        if self.high is not None and (value > self.high or (value == self.high and not self.include_high)):
+            return False
+        return True
+
+    def empty(self):
+        if self.low is None or self.high is None:
+            return False
+        return self.low > self.high or (self.low == self.high and not (self.include_low and self.include_high))
+
+    def apply(self, result):
+        result.low, result.high = self.low, self.high
+        result.include_low, result.include_high = self.include_low, self.include_high
+
+
+# --- Execution ---
+
+def rows(table, query):
+    """Yields the stored row tuples selected by a plan, before sorting and projection."""
+    if query.access == 'empty':
+        return iter(())
+    if query.access in ('full', 'key_range'):
+        pairs = table.data.scan(query.low, query.high, (query.include_low, query.include_high),
+                                query.reverse)
+        found = (row for _, row in pairs)
+    else:
+        found = _fetch(table, _matching_keys(table, query), query.reverse)
+    check = compile_terms(query.residual, table.codec.positions)
+    return found if check is None else filter(check, found)
+
+
+def _matching_keys(table, query):
+    if query.access == 'key_points':
+        return query.points
+    with table._write_lock:
+        index = table.indexes[query.index]
+        if query.access == 'index_points':
+            postings = [keys for keys in index.search_many(query.points) if keys]
+        else:
+            postings = [keys for _, keys in index.scan(query.low, query.high,
+                                                      (query.include_low, query.include_high))]
+    return sorted(itertools.chain.from_iterable(postings))
+
+
+def _fetch(table, keys, reverse, batch=512):
+    # Fetches in batches so that a limit stops the lookups early.
+    if reverse:
+        keys = keys[::-1]
+    for start in range(0, len(keys), batch):
+        for row in table.data.search_many(keys[start:start + batch]):
+            if row is not None:
+                yield row
+
+
+def select(table, query):
+    """Runs a plan and returns the matching records as dicts."""
+    return project(table.codec, query.columns, ordered_rows(table, query))
+
+
+def ordered_rows(table, query):
+    """Runs a plan up to its sort, offset and limit; yields row tuples."""
+    found = rows(table, query)
+    stop = None if query.limit is None else query.offset + query.limit
+    if query.sort:
+        found = sort_rows(found, query.sort, table.codec.positions, stop)
+    return itertools.islice(found, query.offset, stop)
+
+
+def project(codec, columns, found):
+    """Turns row tuples into dicts holding columns, or every field if columns is None."""
+    if columns is None:
+        return list(map(codec.decode, found))
+    picks = [(field, codec.positions[field]) for field in columns]
+    return [{field: row[pos] for field, pos in picks if row[pos] is not None} for row in found]
+
+
+def sort_rows(found, order, positions, stop=None):
+    """Sorts rows by (field, descending) pairs, keeping only the first stop rows."""
+    # Absent values sort after present ones in either direction.
+    def sort_key(pos, desc):
+        absent = (not desc, 0)
+        return lambda row: absent if row[pos] is None else (desc, row[pos])
+
+    directions = {desc for _, desc in order}
+    if len(directions) == 1:
+        desc = directions.pop()
+        getters = [sort_key(positions[field], desc) for field, _ in order]
+        key = lambda row: tuple(get(row) for get in getters)
+        if stop is not None:
+            return (heapq.nlargest if desc else heapq.nsmallest)(stop, found, key=key)
+        return sorted(found, key=key, reverse=desc)
+    # Mixed directions: stable sorts from the least significant field up.
+    result = list(found)
+    for field, desc in reversed(order):
+        result.sort(key=sort_key(positions[field], desc), reverse=desc)
+    return result
+
+
+def aggregate(table, func, column=None, where=None):
+    """Computes count, sum, min or max of column over the rows matching where."""
+    if column is not None and column not in table.schema:
+        raise KeyError(f"Field '{column}' is not in the schema.")
+    query = plan(table, where)
+    # Augmented trees answer key-bounded aggregates from their node summaries.
+    summarized = (query.access in ('full', 'key_range') and not query.residual
+                  and hasattr(table.data, 'count_range'))
+    bounds = (query.low, query.high, (query.include_low, query.include_high))
+    if func == 'count' and column is None:
+        if query.access == 'full' and not query.residual:
+            return len(table.data)
+        if summarized:
+            return table.data.count_range(*bounds)
+        return sum(1 for _ in rows(table, query))
+    if column is None:
+        raise ValueError(f"{func} needs a column")
+    if summarized and column == table.augment and func in ('sum', 'min', 'max'):
+        return getattr(table.data, f'{func}_range')(*bounds)
+    if func in ('min', 'max') and column == table.search_key and query.access in ('full', 'key_range'):
+        # Rows arrive in key order, so the first one is the answer.
+        query.reverse = func == 'max'
+        return next((row[table.codec.key_position] for row in rows(table, query)), None)
+    pos = table.codec.positions[column]
+    values = (value for value in map(operator.itemgetter(pos), rows(table, query)) if value is not None)
+    if func == 'count':
+        return sum(1 for _ in values)
+    if func == 'sum':
+        return sum(values)
+    if func in ('min', 'max'):
+        return (min if func == 'min' else max)(values, default=None)
+    raise ValueError(f"Unknown aggregate '{func}'")
@@ -0,0 +1,105 @@
+import operator
+
+
+def normalize_key(search_key):
+    # A composite search key is a tuple of fields; a list is taken as one
+    # and a single field on its own is just that field.
+    if isinstance(search_key, (tuple, list)):
+        return search_key[0] if len(search_key) == 1 else tuple(search_key)
+    return search_key
+
+
+class RecordCodec:
+    """Converts between the dict records of the Table API and stored rows.
+
+    A row is a plain tuple with one slot per schema field, in schema order,
+    and None for a field the record leaves out. A tuple costs a fraction of
+    a dict and shares nothing per row but the values themselves. The
+    encoder (which also validates) and the decoder are generated once per
+    schema, so a row is checked without looping over the schema.
+
+    The search key is one field or, for a composite key, a tuple of them;
+    key_of(row) and record_key(record) return the key of a row or record,
+    the tuple of the fields' values for a composite key.
+    """
+
+    def __init__(self, schema, search_key=None):
+        self.schema = dict(schema)
+        self.search_key = search_key = normalize_key(search_key)
+        self.fields = tuple(self.schema)
+        self.positions = {field: i for i, field in enumerate(self.fields)}
+        self.key_fields = search_key if isinstance(search_key, tuple) else (search_key,)
+        if all(field in self.positions for field in self.key_fields):
+            # An int, or a tuple of ints for a composite key.
+            self.key_position = operator.itemgetter(*self.key_fields)(self.positions)
+            self.key_of = operator.itemgetter(*map(self.positions.get, self.key_fields))
+            self.record_key = operator.itemgetter(*self.key_fields)
+        else:
+            self.key_position = self.key_of = self.record_key = None
+        self.encode = self._compile_encoder()
+        self.decode = self._compile_decoder()
+
+    def __getstate__(self):
+        # Generated functions cannot be pickled; they are rebuilt on load.
+        return {'schema': self.schema, 'search_key': self.search_key}
+
+    def __setstate__(self, state):
+        self.__init__(state['schema'], state['search_key'])
+
+    def getter(self, field):
+        """Returns a callable that reads field from a stored row."""
+        return operator.itemgetter(self.positions[field])
+
+    def _compile_encoder(self):
+        # Fast path for a complete, well-typed record: one subscript and one
+        # isinstance per field. Anything else goes through _encode_slow,
+        # which finds the offending field and fills absent ones with None.
+        if self.key_position is None:
+            return self._encode_slow  # every record is rejected for lacking the key
+        count = len(self.fields)
+        names = [f'v{i}' for i in range(count)]
+        namespace = {'slow': self._encode_slow}
+        namespace.update((f't{i}', self.schema[field]) for i, field in enumerate(self.fields))
+        loads = ''.join(f'        {name} = record[{field!r}]\n' for field, name in zip(self.fields, names))
+        checks = ' and '.join(f'isinstance({name}, t{i})' for i, name in enumerate(names)) or 'True'
+        row = f"({', '.join(names)}{',' if count == 1 else ''})"
+        source = ('def encode(record):\n'
+                  f'    if not isinstance(record, dict) or len(record) != {count}:\n'
+                  '        return slow(record)\n'
+                  '    try:\n'
+                  f'{loads}'
+                  '        pass\n'
+                  '    except KeyError:\n'
+                  '        return slow(record)\n'
+                  f'    if not ({checks}):\n'
+                  '        return slow(record)\n'
+                  f'    return {row}\n')
+        exec(source, namespace)
+        return namespace['encode']
+
+    def _compile_decoder(self):
+        names = [f'v{i}' for i in range(len(self.fields))]
+        if not names:
+            return lambda row: {}
+        unpack = ', '.join(names) + (',' if len(names) == 1 else '')
+        missing = ' or '.join(f'{name} is None' for name in names)
+        items = ', '.join(f'{field!r}: {name}' for field, name in zip(self.fields, names))
+        namespace = {'FIELDS': self.fields}
+        source = ('def decode(row):\n'
+                  f'    {unpack} = row\n'
+                  f'    if {missing}:\n'
+                  '        return {field: value for field, value in zip(FIELDS, row) if value is not None}\n'
+                  f'    return {{{items}}}\n')
+        exec(source, namespace)
+        return namespace['decode']
+
+    def _encode_slow(self, record):
+        if not isinstance(record, dict):
+            raise TypeError("Record must be a dictionary.")
+        for field, value in record.items():
+            if not isinstance(value, self.schema[field]):
+                raise TypeError(f"Field {field} expects {self.schema[field]}, got {type(value)}")
+        for field in self.key_fields:
+            if field not in record:
+                raise KeyError(field)
+        return tuple(record.get(field) for field in self.fields)
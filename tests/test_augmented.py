@@ -0,0 +1,82 @@
+import itertools
+import random
+
+import pytest
+
+from augmented import AugmentedBPlusTree
+from table import Table
+
+
+def check_statistics(tree, items, rng):
+    keys = [key for key, _ in items]
+    measured = {key: value for key, value in items if value is not None}
+    assert len(tree) == tree.root.count == len(items)
+    for i in (0, len(items) // 2, -1):
+        if items:
+            assert tree.select(i) == items[i]
+    for _ in range(20):
+        key = rng.randrange(-5, 505)
+        assert tree.rank(key) == sum(k < key for k in keys)
+        start, end = sorted((rng.randrange(-5, 505), rng.randrange(-5, 505)))
+        for inclusive in itertools.product((True, False), repeat=2):
+            inside = [k for k in keys if (k > start or (inclusive[0] and k == start))
+                      and (k < end or (inclusive[1] and k == end))]
+            values = [measured[k] for k in inside if k in measured]
+            assert tree.count_range(start, end, inclusive) == len(inside)
+            assert tree.sum_range(start, end, inclusive) == sum(values)
+            assert tree.min_range(start, end, inclusive) == min(values, default=None)
+            assert tree.max_range(start, end, inclusive) == max(values, default=None)
+    assert tree.count_range() == len(items)
+
+
+def test_summaries_follow_every_write():
+    tree = AugmentedBPlusTree(order=4, measure=lambda value: value)
+    tree.bulk_load((i, i % 7 or None) for i in range(0, 500, 5))
+    expected = dict(tree.get_all())
+    rng = random.Random(0)
+    for step in range(1500):
+        key, op = rng.randrange(500), rng.random()
+        value = rng.choice([None, rng.randrange(-100, 100)])
+        if op < 0.4:
+            if tree.insert_if_absent(key, value):
+                expected[key] = value
+        elif op < 0.6:
+            if tree.update(key, value):
+                expected[key] = value
+        elif op < 0.9:
+            if tree.delete(key):
+                del expected[key]
+        else:
+            tree.delete_range(key, key + 20, lazy=rng.random() < 0.5)
+            expected = {k: v for k, v in expected.items() if not key <= k <= key + 20}
+        if step % 100 == 0:
+            tree.compact()
+            tree.validate()
+            check_statistics(tree, sorted(expected.items()), rng)
+    tree.compact()
+    tree.validate()
+    check_statistics(tree, sorted(expected.items()), rng)
+
+
+def test_counts_without_a_measure():
+    tree = AugmentedBPlusTree(order=5)
+    for i in range(100):
+        tree.insert(i, str(i))
+    assert tree.rank(50) == 50 and tree.select(-1) == (99, '99')
+    assert tree.count_range(10, 20, (False, False)) == 9
+    with pytest.raises(ValueError):
+        tree.sum_range()
+    with pytest.raises(IndexError):
+        tree.select(100)
+
+
+def test_augmented_table_answers_from_summaries():
+    table = Table('t', {'id': int, 'score': int}, order=4, search_key='id', augment='score')
+    table.insert_many({'id': i, 'score': i % 10} for i in range(1000))
+    assert table.count([('id', '>=', 100), ('id', '<', 200)]) == 100
+    assert table.sum('score', ('id', '<', 100)) == 450
+    assert table.max('score', ('id', '<', 5)) == 4
+    assert table.select(limit=2, offset=500) == [{'id': 500, 'score': 0}, {'id': 501, 'score': 1}]
+    assert table.explain(limit=2, offset=500).endswith('(offset by rank)')
+    with pytest.raises(ValueError):
+        Table('t', {'id': int, 'name': str}, search_key='id', augment='name')
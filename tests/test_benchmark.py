@@ -0,0 +1,42 @@
+import json
+import random
+
+import pytest
+
+import benchmark
+
+
+@pytest.mark.parametrize('distribution', benchmark.DISTRIBUTIONS)
+def test_positions_are_reproducible_and_in_range(distribution):
+    first = benchmark.positions(distribution, 100, 500, random.Random(1))
+    assert first == benchmark.positions(distribution, 100, 500, random.Random(1))
+    assert len(first) == 500 and all(0 <= position < 100 for position in first)
+    with pytest.raises(ValueError):
+        benchmark.positions('uniform', 100, 5, random.Random(1))
+
+
+def test_run_and_compare_from_the_command_line(tmp_path, capsys):
+    output = str(tmp_path / 'base.json')
+    assert benchmark.main(['run', '--engines', 'memory', 'paged', '--orders', '8', '--sizes', '200',
+                           '--ops', '50', '--trials', '2', '--warmup', '0', '-o', output]) == 0
+    with open(output) as f:
+        document = json.load(f)
+    assert document['version'] == benchmark.RESULT_VERSION
+    results = document['results']
+    assert len(results) == 2 * len(benchmark.WORKLOADS) * len(benchmark.DISTRIBUTIONS)
+    for result in results:
+        assert result['ops_per_sec'] > 0 and len(result['trial_seconds']) == 2
+        assert result['latency_ns']['p50'] <= result['latency_ns']['p99'] <= result['latency_ns']['max']
+        assert result['memory']
+
+    slower = json.loads(json.dumps(document))
+    for result in slower['results']:
+        result['ops_per_sec'] /= 2
+    slower_path = str(tmp_path / 'new.json')
+    with open(slower_path, 'w') as f:
+        json.dump(slower, f)
+    assert benchmark.main(['compare', output, output]) == 0
+    assert benchmark.main(['compare', output, slower_path]) == 1
+    assert 'REGRESSION' in capsys.readouterr().out
+    rows = benchmark.compare_results(document, slower, threshold=0.6)
+    assert len(rows) == len(results) and not any(row[-1] for row in rows)
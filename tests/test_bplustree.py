@@ -0,0 +1,280 @@
+import gc
+import itertools
+import os
+import pickle
+import random
+
+import pytest
+
+from bplustree import BPlusTree, LeafNode
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def load_fixture(name):
+    # baseline.pkl was written by save_database before nodes had __slots__:
+    # a 'school' database whose 'students' table (order 4, key 'roll') holds
+    # rolls 0-59 except 7 as dicts. indexed.pkl is the same data written
+    # after secondary indexes were added, with an index on 'year'.
+    with open(os.path.join(FIXTURES, name), 'rb') as f:
+        return pickle.load(f)
+
+
+def test_unpickles_trees_saved_before_slotted_nodes():
+    tree = load_fixture('baseline.pkl')['school']['students'].data
+    tree.validate()
+    assert len(tree) == 59
+    assert [key for key, _ in tree.get_all()] == [i for i in range(60) if i != 7]
+    leaf = tree._find_leaf(0)
+    assert type(leaf) is LeafNode and leaf.next is not None
+    tree.insert(7, 'back')
+    tree.validate()
+    assert tree.search(7) == 'back'
+
+
+def test_pickle_round_trip():
+    tree = BPlusTree(order=5)
+    for i in range(200):
+        tree.insert(i, str(i))
+    copy = pickle.loads(pickle.dumps(tree))
+    copy.validate()
+    assert copy.get_all() == tree.get_all()
+
+
+def test_bulk_load_matches_inserts():
+    for order in (3, 4, 5, 8, 33):
+        for count in (0, 1, 2, order, 1000):
+            for fill_factor in (0.5, 0.7, 1.0):
+                tree = BPlusTree(order=order)
+                tree.bulk_load(((i, -i) for i in range(count)), fill_factor)
+                tree.validate()
+                assert len(tree) == count
+                assert tree.get_all() == [(i, -i) for i in range(count)]
+                tree.insert(count, 'next')
+                tree.delete(0)
+                tree.validate()
+
+
+def test_bulk_load_rejects_unsorted_input_and_full_trees():
+    tree = BPlusTree(order=4)
+    with pytest.raises(ValueError):
+        tree.bulk_load([(1, 'a'), (0, 'b')])
+    with pytest.raises(ValueError):
+        tree.bulk_load([(0, 'a')], fill_factor=0)
+    tree.insert(0, 'a')
+    with pytest.raises(ValueError):
+        tree.bulk_load([(1, 'b')])
+
+
+def tree_factories():
+    from augmented import AugmentedBPlusTree
+    from concurrency import ConcurrentBPlusTree
+    from paged_bplustree import PagedBPlusTree
+    return {
+        'memory': lambda tmp_path: BPlusTree(order=4),
+        'augmented': lambda tmp_path: AugmentedBPlusTree(order=4),
+        'concurrent': lambda tmp_path: ConcurrentBPlusTree(order=4),
+        'paged': lambda tmp_path: PagedBPlusTree(str(tmp_path / 'scan.pages'), order=4, pool_size=16),
+    }
+
+
+@pytest.mark.parametrize('kind', ['memory', 'augmented', 'concurrent', 'paged'])
+def test_scan_matches_a_sorted_list(kind, tmp_path):
+    tree = tree_factories()[kind](tmp_path)
+    keys = list(range(0, 300, 3))
+    for key in keys:
+        tree.insert(key, -key)
+    bounds = [None, -5, 0, 1, 3, 150, 151, 297, 400]
+    for start in bounds:
+        for end in bounds:
+            for inclusive in itertools.product((True, False), repeat=2):
+                expected = [(k, -k) for k in keys
+                            if (start is None or k > start or (k == start and inclusive[0]))
+                            and (end is None or k < end or (k == end and inclusive[1]))]
+                assert list(tree.scan(start, end, inclusive)) == expected
+                assert list(tree.scan(start, end, inclusive, reverse=True)) == expected[::-1]
+    for reverse in (False, True):
+        expected = sorted(((k, -k) for k in keys), reverse=reverse)
+        for limit, offset in ((None, 5), (0, 0), (10, 0), (10, 95), (1000, 1)):
+            end = None if limit is None else offset + limit
+            assert list(tree.scan(reverse=reverse, limit=limit, offset=offset)) == expected[offset:end]
+
+
+def test_scan_is_lazy():
+    tree = BPlusTree(order=4)
+    tree.bulk_load((i, i) for i in range(10_000))
+    metrics = tree.enable_metrics()
+    cursor = tree.scan(500)
+    assert next(cursor) == (500, 500)
+    assert next(tree.scan(end=500, reverse=True)) == (500, 500)
+    assert metrics.leaf_hops <= 1
+
+
+@pytest.mark.parametrize('kind', ['memory', 'augmented', 'concurrent', 'paged'])
+def test_search_many_matches_search(kind, tmp_path):
+    tree = tree_factories()[kind](tmp_path)
+    for key in range(0, 1000, 2):
+        tree.insert(key, str(key))
+    rng = random.Random(0)
+    for size in (0, 1, 10, 500):
+        keys = [rng.randrange(-10, 1010) for _ in range(size)]
+        assert tree.search_many(keys) == [tree.search(key) for key in keys]
+    assert tree.search_many([998, 0, 998, 1]) == ['998', '0', '998', None]
+
+
+def test_search_many_reuses_descents():
+    tree = BPlusTree(order=4)
+    tree.bulk_load((i, i) for i in range(10_000))
+    metrics = tree.enable_metrics()
+    tree.search_many(range(5000, 5100))
+    batched = metrics.node_visits
+    metrics.node_visits = 0
+    for key in range(5000, 5100):
+        tree.search(key)
+    assert batched * 2 < metrics.node_visits
+
+
+def test_nodes_are_slotted():
+    tree = BPlusTree(order=4)
+    for i in range(20):
+        tree.insert(i, i)
+    leaf, internal = tree._find_leaf(0), tree.root
+    assert not internal.is_leaf
+    for node in (leaf, internal):
+        assert not hasattr(node, '__dict__')
+        with pytest.raises(AttributeError):
+            node.extra = 1
+    assert not hasattr(internal, 'next')
+
+
+def test_debug_descent_checks_invariants_and_fast_path_does_not():
+    rng = random.Random(0)
+    trees = [BPlusTree(order=4, debug=True), BPlusTree(order=4)]
+    for _ in range(2000):
+        key, insert = rng.randrange(300), rng.random() < 0.6
+        for tree in trees:
+            if insert:
+                tree.insert_if_absent(key, key)
+            else:
+                tree.delete(key)
+    for tree in trees:
+        tree.validate()
+        first = tree._find_leaf(-1)
+        first.parent = None  # break the invariant the checked descent asserts
+    assert trees[0].get_all() == trees[1].get_all()
+    with pytest.raises(AssertionError):
+        trees[0].search(first.keys[0])
+    assert trees[1].search(first.keys[0]) == first.keys[0]
+
+
+@pytest.mark.parametrize('kind', ['memory', 'augmented'])
+def test_snapshots_keep_their_contents(kind, tmp_path):
+    tree = tree_factories()[kind](tmp_path)
+    rng = random.Random(0)
+    expected = {}
+    views = []
+    for step in range(3000):
+        key = rng.randrange(400)
+        op = rng.random()
+        if op < 0.5:
+            if tree.insert_if_absent(key, step):
+                expected[key] = step
+        elif op < 0.7:
+            if tree.update(key, -step):
+                expected[key] = -step
+        elif op < 0.95:
+            if tree.delete(key):
+                del expected[key]
+        else:
+            tree.delete_range(key, key + 10)
+            for k in range(key, key + 11):
+                expected.pop(k, None)
+        if step % 300 == 0:
+            views.append((tree.snapshot(), sorted(expected.items())))
+    tree.validate()
+    assert tree.get_all() == sorted(expected.items())
+    for view, items in views:
+        assert len(view) == len(items)
+        assert view.get_all() == items
+        assert list(view.scan(100, 200, reverse=True)) == [item for item in items if 100 <= item[0] <= 200][::-1]
+        assert [view.search(key) for key in range(400)] == [dict(items).get(key) for key in range(400)]
+        if kind == 'augmented':
+            assert view.count_range(100, 200) == sum(100 <= key <= 200 for key, _ in items)
+    view = views[0][0]
+    with pytest.raises(TypeError):
+        view.insert(1, 1)
+    with pytest.raises(TypeError):
+        view.delete(1)
+    assert pickle.loads(pickle.dumps(view)).get_all() == views[0][1]
+
+
+def test_dropped_snapshots_stop_copy_on_write():
+    tree = BPlusTree(order=4)
+    tree.bulk_load((i, i) for i in range(100))
+    view = tree.snapshot()
+    root = tree.root
+    tree.insert(1000, 1000)
+    assert tree.root is not root and view.root is root
+    del view
+    gc.collect()
+    assert tree._pins == {} and tree._shared_epoch == -1
+    root = tree.root
+    tree.insert(1001, 1001)
+    assert tree.root is root
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+@pytest.mark.parametrize('kind', ['memory', 'augmented', 'concurrent', 'paged'])
+def test_delete_range_matches_a_sorted_list(kind, lazy, tmp_path):
+    tree = tree_factories()[kind](tmp_path)
+    rng = random.Random(0)
+    expected = {}
+    for step in range(600):
+        if rng.random() < 0.7:
+            key = rng.randrange(2000)
+            if tree.insert_if_absent(key, step):
+                expected[key] = step
+            continue
+        start = rng.choice([None, rng.randrange(2000)])
+        end = rng.choice([None, rng.randrange(2000)]) if start is None else start + rng.randrange(300)
+        inclusive = (rng.random() < 0.5, rng.random() < 0.5)
+        gone = [key for key in expected
+                if (start is None or key > start or (key == start and inclusive[0]))
+                and (end is None or key < end or (key == end and inclusive[1]))]
+        assert tree.delete_range(start, end, inclusive, lazy=lazy) == len(gone)
+        for key in gone:
+            del expected[key]
+        items = sorted(expected.items())
+        assert list(tree.scan()) == items
+        assert list(tree.scan(reverse=True)) == items[::-1]
+        assert len(tree) == len(items)
+        if rng.random() < 0.2:
+            tree.compact()
+    tree.compact()
+    if hasattr(tree, 'validate'):
+        tree.validate()
+    assert tree.get_all() == sorted(expected.items())
+    assert tree.delete_range() == len(expected)
+    assert tree.get_all() == [] and len(tree) == 0
+    tree.insert(5, 5)
+    assert tree.get_all() == [(5, 5)]
+
+
+def test_delete_range_unlinks_whole_subtrees(monkeypatch):
+    tree = BPlusTree(order=8)
+    tree.bulk_load((i, i) for i in range(100_000))
+    visited = []
+    trim = tree._trim
+    monkeypatch.setattr(tree, '_trim', lambda node, *args: visited.append(node) or trim(node, *args))
+    assert tree.delete_range(1000, 98_999) == 98_000
+    assert len(visited) < 30  # the nodes on two root-to-leaf paths, not the ~14,000 leaves dropped
+    monkeypatch.undo()
+    tree.validate()
+    assert [key for key, _ in tree.get_all()] == list(range(1000)) + list(range(99_000, 100_000))
+
+    tree.delete_range(0, 500, lazy=True)
+    tree.delete_range(600, 99_500, lazy=True)
+    assert [key for key, _ in tree.scan(495, 610)] == list(range(501, 600))
+    tree.compact()
+    tree.validate()
+    assert [key for key, _ in tree.get_all()] == list(range(501, 600)) + list(range(99_501, 100_000))
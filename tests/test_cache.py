@@ -0,0 +1,102 @@
+import pytest
+
+from cache import LookupCache
+from table import Table
+
+
+def fill(cache, keys):
+    for key in keys:
+        if cache.get(key) is None:
+            cache.put(key, (key,), cache.token)
+
+
+def test_lru_evicts_the_least_recently_used():
+    cache = LookupCache(capacity=3, policy='lru')
+    fill(cache, [1, 2, 3])
+    assert cache.get(1) == (1,)  # 2 is now the oldest
+    fill(cache, [4])
+    assert len(cache) == 3
+    assert cache.peek(2) is None
+    assert [cache.peek(key) for key in (1, 3, 4)] == [(1,), (3,), (4,)]
+    assert cache.stats()['evictions'] == 1
+
+
+def test_slru_keeps_the_hot_set_through_a_scan():
+    cache = LookupCache(capacity=10, policy='slru')
+    hot = list(range(5))
+    fill(cache, hot)
+    fill(cache, hot)  # a second hit promotes them
+    fill(cache, range(100, 200))
+    assert all(cache.peek(key) == (key,) for key in hot)
+    assert len(cache) == 10
+
+    lru = LookupCache(capacity=10, policy='lru')
+    fill(lru, hot)
+    fill(lru, hot)
+    fill(lru, range(100, 200))
+    assert all(lru.peek(key) is None for key in hot)
+
+
+def test_byte_bound():
+    cache = LookupCache(capacity=None, max_bytes=2000)
+    for key in range(200):
+        cache.put(key, (key, 'x' * (key % 50)), cache.token)
+        assert cache.stats()['bytes'] <= 2000 or len(cache) == 1
+    assert 0 < len(cache) < 200
+    assert cache.stats()['max_bytes'] == 2000
+    cache.clear()
+    assert len(cache) == 0 and cache.stats()['bytes'] == 0
+
+
+def test_rows_read_before_an_invalidation_are_not_installed():
+    cache = LookupCache(capacity=4)
+    token = cache.token
+    cache.invalidate(1)
+    cache.put(1, ('stale',), token)
+    assert cache.peek(1) is None
+    cache.put(1, ('fresh',), cache.token)
+    assert cache.get(1) == ('fresh',)
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'policy': 'lfu'},
+    {'capacity': None},
+    {'capacity': 0},
+    {'capacity': None, 'max_bytes': 0},
+])
+def test_rejects_bad_arguments(kwargs):
+    with pytest.raises(ValueError):
+        LookupCache(**kwargs)
+
+
+def test_stats_count_hits_and_misses():
+    cache = LookupCache(capacity=4)
+    fill(cache, [1, 2])
+    fill(cache, [1, 3])
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 3, 3)
+    assert stats['hit_ratio'] == 0.25
+
+
+@pytest.mark.parametrize('policy', ['lru', 'slru'])
+def test_table_writes_invalidate_cached_rows(policy):
+    table = Table('t', {'id': int, 'v': int}, order=4, search_key='id')
+    table.create_index('v')
+    table.insert_many({'id': i, 'v': i % 5} for i in range(100))
+    cache = table.enable_cache(capacity=16, policy=policy)
+    for _ in range(2):
+        assert table.get_many(list(range(10))) == [{'id': i, 'v': i % 5} for i in range(10)]
+    assert table.update(3, {'id': 3, 'v': 99})
+    assert table.get(3) == {'id': 3, 'v': 99}
+    assert table.get_by('v', 99) == [{'id': 3, 'v': 99}]
+    assert table.delete(4)
+    assert table.get(4) is None
+    assert not table.insert({'id': 5, 'v': 0})  # duplicate found in the cache
+    assert table.insert({'id': 4, 'v': 4})
+    assert table.get(4) == {'id': 4, 'v': 4}
+    assert table.delete_range(0, 2) == 3
+    assert table.get_many([0, 1, 2, 6]) == [None, None, None, {'id': 6, 'v': 1}]
+    assert len(table.get_by('v', 0)) == 19  # 0 left and 5 kept its row
+    assert table.stats()['cache']['hits'] == cache.hits > 0
+    table.disable_cache()
+    assert table.cache is None and 'cache' not in table.stats()
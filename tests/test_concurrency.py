@@ -0,0 +1,98 @@
+import random
+import threading
+
+import pytest
+
+from concurrency import ConcurrentBPlusTree
+from table import Table
+
+
+@pytest.mark.parametrize('order', [3, 4, 5, 8])
+def test_concurrent_writers_readers_and_scans(order, threads=4, operations=1500, key_space=600, seed=0):
+    # Every thread owns a disjoint slice of the key space for its writes, so
+    # the final contents are known exactly, but reads and scans the whole tree.
+    tree = ConcurrentBPlusTree(order=order)
+    expected = [dict() for _ in range(threads)]
+    errors = []
+    barrier = threading.Barrier(threads)
+
+    def worker(n):
+        rng = random.Random(seed + n)
+        mine = expected[n]
+        keys = range(n, key_space, threads)
+        barrier.wait()
+        try:
+            for _ in range(operations):
+                op = rng.random()
+                key = rng.choice(keys)
+                if op < 0.4:
+                    assert tree.insert_if_absent(key, key * 10) == (key not in mine)
+                    mine[key] = key * 10
+                elif op < 0.7:
+                    assert tree.delete(key) == (key in mine)
+                    mine.pop(key, None)
+                elif op < 0.9:
+                    value = tree.search(rng.randrange(key_space))
+                    assert value is None or value % 10 == 0
+                else:
+                    low = rng.randrange(key_space)
+                    found = [k for k, _ in tree.scan(low, low + 50, reverse=rng.random() < 0.5)]
+                    assert found in (sorted(found), sorted(found, reverse=True))
+                    assert len(set(found)) == len(found)
+        except Exception as e:  # re-raised in the main thread below
+            errors.append(e)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    if errors:
+        raise errors[0]
+    tree.validate()
+    assert tree.get_all() == sorted(item for mine in expected for item in mine.items())
+
+
+def test_snapshot_is_refused():
+    tree = ConcurrentBPlusTree(order=4)
+    tree.insert(1, 'a')
+    with pytest.raises(TypeError):
+        tree.snapshot()
+
+
+def test_concurrent_table_with_an_index():
+    table = Table('t', {'id': int, 'v': int}, order=4, search_key='id', concurrent=True)
+    table.create_index('v')
+    threads = 4
+    errors = []
+
+    def worker(n):
+        keys = range(n, 400, threads)
+        try:
+            for key in keys:
+                assert table.insert({'id': key, 'v': key % 10})
+            for key in keys[::2]:
+                assert table.update(key, {'id': key, 'v': -1})
+            for key in keys[1::4]:
+                assert table.delete(key)
+            assert len(table.get_many(list(range(400)))) == 400
+        except Exception as e:  # re-raised in the main thread below
+            errors.append(e)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    if errors:
+        raise errors[0]
+    table.data.validate()
+    expected = [key for n in range(threads) for key in range(n, 400, threads)
+                if key not in range(n, 400, threads)[1::4]]
+    assert [key for key, _ in table.get_all()] == sorted(expected)
+    updated = [key for n in range(threads) for key in range(n, 400, threads)[::2]]
+    assert sorted(record['id'] for record in table.get_by('v', -1)) == sorted(updated)
+    for _, record in table.get_all():
+        assert (record['v'] == -1) == (record['id'] in updated)
+    with pytest.raises(ValueError):
+        table.snapshot()
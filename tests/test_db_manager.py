@@ -0,0 +1,268 @@
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+
+import pytest
+
+from db_manager import DatabaseManager
+
+SCHEMA = {'id': int, 'v': int}
+
+
+def durable_manager(directory, **options):
+    manager = DatabaseManager()
+    assert manager.enable_durability(str(directory), **options) == (None, True)
+    manager.create_database('db')
+    return manager
+
+
+def run_threads(targets, timeout=60):
+    threads = [threading.Thread(target=target, daemon=True) for target in targets]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + timeout
+    for thread in threads:
+        thread.join(max(0, deadline - time.monotonic()))
+    assert not any(thread.is_alive() for thread in threads), "threads deadlocked"
+
+
+def crash_after(script, directory):
+    # Runs script with a durable manager m in directory, then kills the
+    # process without closing anything, as a crash would.
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    child = textwrap.dedent('''
+        import contextlib, io, os, sys
+        sys.path.insert(0, {root!r})
+        from db_manager import DatabaseManager
+        with contextlib.redirect_stdout(io.StringIO()):
+            m = DatabaseManager()
+            assert m.enable_durability({directory!r}, synchronous=True) == (None, True)
+            m.create_database('db')
+    ''').format(root=root, directory=str(directory))
+    child += textwrap.indent(textwrap.dedent(script), '    ') + '\nos._exit(0)\n'
+    subprocess.run([sys.executable, '-c', child], check=True)
+
+
+def recover(directory):
+    manager = DatabaseManager()
+    assert manager.load_database(str(directory)) == (None, True)
+    return manager
+
+
+def test_recovery_replays_the_log_after_a_crash(tmp_path):
+    crash_after('''
+        m.create_table('db', 't', {'id': int, 'v': int}, search_key='id')
+        t = m.get_table('db', 't')
+        t.insert_many({'id': i, 'v': i % 5} for i in range(100))
+        t.create_index('v')
+        m.checkpoint()
+        for i in range(0, 100, 2):
+            t.delete(i)
+        t.update(1, {'id': 1, 'v': 99})
+        t.insert({'id': 500, 'v': 4})
+        m.create_table('db', 'gone', {'id': int}, search_key='id')
+        m.get_table('db', 'gone').insert({'id': 1})
+        m.delete_table('db', 'gone')
+        m.create_database('other')
+    ''', tmp_path)
+    for _ in range(2):  # recovering again must give the same answer
+        manager = recover(tmp_path)
+        assert sorted(manager.list_databases()) == ['db', 'other']
+        assert manager.list_tables('db') == ['t']
+        table = manager.get_table('db', 't')
+        assert [key for key, _ in table.get_all()] == list(range(1, 100, 2)) + [500]
+        assert table.get(1) == {'id': 1, 'v': 99}
+        assert [record['id'] for record in table.get_by('v', 4)] == [9, 19, 29, 39, 49, 59, 69, 79, 89, 99, 500]
+        manager.close()
+
+
+def test_recovery_of_paged_tables_after_a_crash(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # paged tables keep their page file in the working directory
+    crash_after('''
+        m.create_table('db', 'p', {'id': int, 'v': int}, order=4, search_key='id', engine='paged', pool_size=16)
+        t = m.get_table('db', 'p')
+        for i in range(300):
+            t.insert({'id': i, 'v': i})
+        m.checkpoint()
+        for i in range(150):
+            t.delete(i)
+        for i in range(1000, 1100):
+            t.insert({'id': i, 'v': -i})
+    ''', tmp_path / 'store')
+    for _ in range(2):
+        manager = recover(tmp_path / 'store')
+        keys = [key for key, _ in manager.get_table('db', 'p').scan()]
+        assert keys == list(range(150, 300)) + list(range(1000, 1100))
+        manager.close()
+
+
+def test_checkpoints_against_concurrent_inserts(tmp_path):
+    manager = durable_manager(tmp_path)
+    manager.create_table('db', 'a', SCHEMA, search_key='id')
+    manager.create_table('db', 'b', SCHEMA, search_key='id')
+    manager.get_table('db', 'b').create_index('v')  # index writes hold the table lock too
+    done = threading.Event()
+
+    def writer(name, base):
+        table = manager.get_table('db', name)
+        for i in range(400):
+            table.insert({'id': base + i, 'v': i})
+        done.set()
+
+    def checkpointer():
+        while not done.is_set():
+            assert manager.checkpoint() == (None, True)
+
+    run_threads([lambda: writer('a', 0), lambda: writer('b', 10_000), checkpointer])
+    manager.close()
+
+    recovered = DatabaseManager()
+    assert recovered.load_database(str(tmp_path)) == (None, True)
+    assert [key for key, _ in recovered.get_table('db', 'a').get_all()] == list(range(400))
+    b = recovered.get_table('db', 'b')
+    assert [key for key, _ in b.get_all()] == list(range(10_000, 10_400))
+    assert [record['id'] for record in b.get_by('v', 7)] == [10_007]
+
+
+def test_automatic_checkpoints_from_writer_threads(tmp_path):
+    manager = durable_manager(tmp_path, checkpoint_bytes=4096)
+    manager.create_table('db', 't', SCHEMA, search_key='id')
+    table = manager.get_table('db', 't')
+    table.create_index('v')
+
+    def writer(base):
+        for i in range(300):
+            table.insert({'id': base + i, 'v': i})
+
+    run_threads([lambda: writer(0), lambda: writer(1000)])
+    manager.close()
+    assert manager._wal is None
+
+    recovered = DatabaseManager()
+    assert recovered.load_database(str(tmp_path)) == (None, True)
+    keys = [key for key, _ in recovered.get_table('db', 't').get_all()]
+    assert keys == list(range(300)) + list(range(1000, 1300))
+
+
+def saved_store(directory, tables=('t0', 't1'), rows=100):
+    manager = DatabaseManager()
+    manager.create_database('db')
+    for name in tables:
+        manager.create_table('db', name, {'id': int}, search_key='id')
+        manager.get_table('db', name).insert_many({'id': i} for i in range(rows))
+    manager.save_database(str(directory))
+    return manager._catalog[('db', tables[0])]['bytes']
+
+
+def test_write_through_evicted_reference_is_kept(tmp_path):
+    size = saved_store(tmp_path)
+    manager = DatabaseManager(memory_budget=int(size * 1.5))
+    manager.load_database(str(tmp_path))
+    kept = manager.get_table('db', 't0')
+    manager.get_table('db', 't1')  # evicts t0
+    assert manager.databases['db']._tables['t0'] is None
+    assert kept.insert({'id': -1})
+    assert manager.databases['db']._tables['t0'] is kept
+    manager.save_database()
+    reopened = DatabaseManager()
+    reopened.load_database(str(tmp_path))
+    assert reopened.get_table('db', 't0').get(-1) == {'id': -1}
+
+
+def test_write_through_reloaded_reference_raises(tmp_path):
+    size = saved_store(tmp_path)
+    manager = DatabaseManager(memory_budget=int(size * 1.5))
+    manager.load_database(str(tmp_path))
+    stale = manager.get_table('db', 't0')
+    manager.get_table('db', 't1')  # evicts t0
+    live = manager.get_table('db', 't0')  # and loads it again
+    assert live is not stale
+    with pytest.raises(RuntimeError, match='reloaded or dropped'):
+        stale.insert({'id': -9})
+    assert live.insert({'id': -8})
+    manager.save_database()
+    reopened = DatabaseManager()
+    reopened.load_database(str(tmp_path))
+    assert reopened.get_table('db', 't0').get(-8) == {'id': -8}
+
+
+def test_write_through_dropped_reference_raises(tmp_path):
+    manager = durable_manager(tmp_path)
+    manager.create_table('db', 't', SCHEMA, search_key='id')
+    table = manager.get_table('db', 't')
+    manager.delete_table('db', 't')
+    with pytest.raises(RuntimeError):
+        table.insert({'id': 1, 'v': 1})
+    manager.close()
+    recovered = DatabaseManager()
+    assert recovered.load_database(str(tmp_path)) == (None, True)
+    assert recovered.list_tables('db') == []
+
+
+def catalog_files(manager):
+    return {table_name: entry['file'] for (_, table_name), entry in manager._catalog.items()}
+
+
+def test_opening_a_store_loads_tables_on_first_use(tmp_path):
+    saved_store(tmp_path, tables=('t0', 't1', 't2'))
+    manager = DatabaseManager()
+    assert manager.load_database(str(tmp_path)) == (None, True)
+    assert manager.list_tables('db') == ['t0', 't1', 't2']
+    assert all(table is None for table in manager.databases['db']._tables.values())
+    assert manager.stats()['databases']['db']['t2']['loaded'] is False
+    assert manager.get_table('db', 't1').get(5) == {'id': 5}
+    assert [name for name, table in manager.databases['db']._tables.items() if table is not None] == ['t1']
+
+
+def test_saves_rewrite_only_changed_tables(tmp_path):
+    saved_store(tmp_path, tables=('t0', 't1', 't2'))
+    manager = DatabaseManager()
+    manager.load_database(str(tmp_path))
+    before = catalog_files(manager)
+    manager.get_table('db', 't0')  # read only
+    manager.get_table('db', 't1').delete(3)
+    manager.delete_table('db', 't2')
+    assert manager.save_database() == (None, True)
+    after = catalog_files(manager)
+    assert after['t0'] == before['t0'] and after['t1'] != before['t1'] and 't2' not in after
+    files = set(os.listdir(tmp_path / 'tables'))
+    assert os.path.basename(before['t1']) not in files and os.path.basename(before['t2']) not in files
+
+    reopened = DatabaseManager()
+    reopened.load_database(str(tmp_path))
+    assert reopened.list_tables('db') == ['t0', 't1']
+    assert reopened.get_table('db', 't1').get(3) is None
+    assert len(reopened.get_table('db', 't0').get_all()) == 100
+
+
+def test_memory_budget_unloads_clean_tables_only(tmp_path):
+    size = saved_store(tmp_path, tables=('t0', 't1', 't2', 't3'))
+    manager = DatabaseManager(memory_budget=int(size * 2.5))
+    manager.load_database(str(tmp_path))
+    manager.get_table('db', 't0').insert({'id': -1})  # dirty, so it stays loaded
+    for name in ('t1', 't2', 't3', 't1'):
+        assert len(manager.get_table('db', name).get_all()) == 100
+    loaded = {name for name, table in manager.databases['db']._tables.items() if table is not None}
+    assert 't0' in loaded and len(loaded) <= 3
+    assert manager.stats()['storage']['dirty_tables'] == 1
+    manager.save_database()
+    for name in ('t2', 't3', 't1'):
+        manager.get_table('db', name)
+    assert manager.databases['db']._tables['t0'] is None
+    assert manager.get_table('db', 't0').get(-1) == {'id': -1}
+
+
+def test_single_file_pickles_still_save_and_load(tmp_path):
+    path = str(tmp_path / 'all.pkl')
+    manager = DatabaseManager()
+    manager.create_database('db')
+    manager.create_table('db', 't', SCHEMA, search_key='id')
+    manager.get_table('db', 't').insert({'id': 1, 'v': 2})
+    assert manager.save_database(path) == (None, True)
+    loaded = DatabaseManager()
+    assert loaded.load_database(path) == (None, True)
+    assert loaded.get_table('db', 't').get(1) == {'id': 1, 'v': 2}
+    assert loaded.load_database(str(tmp_path / 'missing.pkl'))[1] is False
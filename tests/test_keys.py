@@ -0,0 +1,113 @@
+import pickle
+import random
+
+import pytest
+
+from bplustree import BPlusTree
+from keys import MAX, prefix_bounds, shortest_separator
+from paged_bplustree import PagedBPlusTree
+from table import Table
+
+
+def random_string(rng):
+    return ''.join(rng.choice('ab\U0010ffff') for _ in range(rng.randrange(6)))
+
+
+def test_shortest_separator_lies_between_its_arguments():
+    rng = random.Random(0)
+    for _ in range(5000):
+        low, high = sorted([random_string(rng), random_string(rng)])
+        if low == high:
+            continue
+        separator = shortest_separator(low, high)
+        assert low < separator <= high and len(separator) <= len(high)
+        pair_low, pair_high = sorted([(low, rng.randrange(3)), (high, rng.randrange(3))])
+        separator = shortest_separator(pair_low, pair_high)
+        assert pair_low < separator <= pair_high
+    assert shortest_separator('apple/1234', 'apricot/99') == 'apr'
+    assert shortest_separator('abc', 'abcdef') == 'abcd'
+    assert shortest_separator(('CS', 'long name', 5), ('EE', 'other', 1)) == ('E',)
+    assert shortest_separator(('CS',), ('CS', 1)) == ('CS', 1)
+    assert shortest_separator(3, 10) == 10
+
+
+def test_prefix_bounds_select_exactly_the_prefixed_keys():
+    keys = sorted({'', 'a', 'ab', 'abc', 'ab\U0010ffff', 'ab\U0010ffffz', 'ac', 'b', '\U0010ffff', '\U0010ffffa'})
+    for prefix in ['', 'a', 'ab', 'ab\U0010ffff', '\U0010ffff', 'zz']:
+        start, end, (include_start, include_end) = prefix_bounds(prefix)
+        selected = [key for key in keys
+                    if (key > start or (key == start and include_start))
+                    and (end is None or key < end or (key == end and include_end))]
+        assert selected == [key for key in keys if key.startswith(prefix)]
+    start, end, inclusive = prefix_bounds(('CS',))
+    assert inclusive == (True, False)
+    assert start <= ('CS', -10**9) < end and start <= ('CS', 'zzz') < end
+    assert not (start <= ('CT',) < end) and ('CR', 99) < start
+    with pytest.raises(TypeError):
+        prefix_bounds(3)
+
+
+def test_max_sorts_last_and_pickles_as_itself():
+    assert sorted([('a', MAX), ('a', 'z'), ('a',), ('b',)]) == [('a',), ('a', 'z'), ('a', MAX), ('b',)]
+    assert pickle.loads(pickle.dumps(MAX)) is MAX
+    assert MAX <= MAX and not MAX < MAX
+
+
+@pytest.mark.parametrize('kind', ['memory', 'paged'])
+def test_string_keys_get_short_separators(kind, tmp_path):
+    if kind == 'paged':
+        tree = PagedBPlusTree(str(tmp_path / 'keys.pages'), order=8, pool_size=16)
+    else:
+        tree = BPlusTree(order=8)
+    rng = random.Random(1)
+    expected = {}
+    for _ in range(3000):
+        key = f'/home/user/projects/{rng.randrange(50):02d}/{rng.randrange(400):04d}.txt'
+        if rng.random() < 0.7:
+            tree.insert_if_absent(key, len(key))
+            expected.setdefault(key, len(key))
+        else:
+            assert tree.delete(key) == (expected.pop(key, None) is not None)
+    assert tree.get_all() == sorted(expected.items())
+    assert all(tree.search(key) == value for key, value in expected.items())
+    if kind == 'memory':
+        tree.validate()
+        separators = []
+        nodes = [tree.root]
+        while nodes:
+            node = nodes.pop()
+            if not node.is_leaf:
+                separators.extend(node.keys)
+                nodes.extend(node.values)
+        assert separators and max(map(len, separators)) < len(min(expected))
+
+
+def test_composite_search_keys():
+    table = Table('t', {'dept': str, 'roll': int, 'name': str}, order=4, search_key=['dept', 'roll'])
+    assert table.search_key == ('dept', 'roll')
+    records = [{'dept': dept, 'roll': roll, 'name': f'{dept}{roll}'}
+               for dept in ('CS', 'CSE', 'EE') for roll in range(40)]
+    random.Random(2).shuffle(records)
+    table.insert_many(records)
+    assert table.get(('CSE', 7)) == {'dept': 'CSE', 'roll': 7, 'name': 'CSE7'}
+    assert table.get(('CS', 40)) is None
+    assert not table.insert({'dept': 'CS', 'roll': 1, 'name': 'again'})
+    assert not table.update(('CS', 1), {'dept': 'EE', 'roll': 1, 'name': 'moved'})
+    assert table.update(('CS', 1), {'dept': 'CS', 'roll': 1, 'name': 'renamed'})
+    assert table.get(('CS', 1))['name'] == 'renamed'
+    assert [key for key, _ in table.scan_prefix(('CS',))] == [('CS', roll) for roll in range(40)]
+    assert [key for key, _ in table.scan_prefix(('CS',), reverse=True, limit=3)] == [('CS', 39), ('CS', 38), ('CS', 37)]
+    assert [key for key, _ in table.scan_prefix(('CSE', 3))] == [('CSE', 3)]
+    assert list(table.scan_prefix(('ME',))) == []
+    assert table.delete(('EE', 0))
+    assert len(table.get_all()) == 119
+
+
+def test_string_prefix_scans():
+    table = Table('t', {'path': str}, order=4, search_key='path')
+    paths = [f'{top}/{n}' for top in ('a', 'ab', 'b') for n in range(30)]
+    table.insert_many({'path': path} for path in paths)
+    assert [key for key, _ in table.scan_prefix('a/')] == sorted(p for p in paths if p.startswith('a/'))
+    assert [key for key, _ in table.scan_prefix('ab/1', reverse=True)] == \
+        sorted((p for p in paths if p.startswith('ab/1')), reverse=True)
+    assert len(list(table.scan_prefix(''))) == len(paths)
@@ -0,0 +1,73 @@
+import pytest
+
+from bplustree import BPlusTree
+from db_manager import DatabaseManager
+from metrics import LatencyHistogram
+from paged_bplustree import PagedBPlusTree
+from table import Table
+
+
+def test_histogram_percentiles_are_bucket_bounds():
+    histogram = LatencyHistogram()
+    assert histogram.percentile(99) == 0
+    for ns in range(1, 1001):
+        histogram.record(ns)
+    assert histogram.count == 1000 and histogram.max_ns == 1000
+    assert histogram.percentile(50) == 512  # 500 falls in [256, 512)
+    assert histogram.percentile(99) == 1000  # capped at the largest latency seen
+    summary = histogram.as_dict()
+    assert summary['mean_ns'] == 500.5
+    assert sum(summary['buckets'].values()) == 1000
+
+
+@pytest.mark.parametrize('paged', [False, True])
+def test_tree_counters_and_structure(paged, tmp_path):
+    if paged:
+        tree = PagedBPlusTree(str(tmp_path / 'm.pages'), order=4, pool_size=16)
+    else:
+        tree = BPlusTree(order=4)
+    metrics = tree.enable_metrics()
+    for i in range(200):
+        tree.insert(i, i)
+    assert metrics.splits > 0 and metrics.merges == metrics.borrows == 0
+    for i in range(0, 200, 2):
+        tree.delete(i)
+    assert metrics.merges + metrics.borrows > 0
+    stats = tree.stats()
+    assert stats['size'] == 100
+    assert stats['levels'][-1]['keys'] == 100
+    assert stats['leaves'] == stats['levels'][-1]['nodes']
+    assert stats['counters'] == metrics.as_dict()
+
+    metrics.reset()
+    tree.search(51)
+    assert metrics.node_visits == stats['height']
+    list(tree.scan())
+    assert stats['leaves'] - 1 <= metrics.leaf_hops <= stats['leaves']
+    tree.disable_metrics()
+    tree.search(51)
+    assert metrics.node_visits == stats['height'] and 'counters' not in tree.stats()
+
+
+def test_table_latencies_and_manager_export():
+    manager = DatabaseManager()
+    manager.create_database('db')
+    manager.create_table('db', 'before', {'id': int}, search_key='id')
+    exported = []
+    manager.enable_metrics(hook=exported.append)
+    manager.create_table('db', 'after', {'id': int}, search_key='id')
+    for name in ('before', 'after'):
+        table = manager.get_table('db', name)
+        table.insert_many({'id': i} for i in range(10))
+        for i in range(5):
+            table.get(i)
+        latency = table.stats()['latency']
+        assert latency['get']['count'] == 5 and latency['insert_many']['count'] == 1
+        assert table.stats()['tree']['counters']['node_visits'] >= 5
+
+    stats = manager.export_metrics()
+    assert exported == [stats] and stats['metrics_enabled']
+    assert stats['databases']['db']['after']['rows'] == 10
+    manager.disable_metrics()
+    table = manager.get_table('db', 'before')
+    assert 'latency' not in table.stats() and 'get' not in vars(table)
@@ -0,0 +1,125 @@
+import random
+
+import pytest
+
+from paged_bplustree import PagedBPlusTree
+from table import Table
+
+
+def open_tree(tmp_path, **kwargs):
+    kwargs.setdefault('order', 8)
+    kwargs.setdefault('page_size', 512)
+    kwargs.setdefault('pool_size', 16)
+    return PagedBPlusTree(str(tmp_path / 'tree.pages'), **kwargs)
+
+
+def contents(tree):
+    tree.flush()
+    items = tree.get_all()
+    assert len(items) == len(tree)
+    return items
+
+
+def test_matches_a_dict_through_evictions_and_reopening(tmp_path):
+    tree = open_tree(tmp_path, order=5, page_size=256)
+    rng = random.Random(0)
+    expected = {}
+    for _ in range(4000):
+        key = rng.randrange(1000)
+        if rng.random() < 0.6:
+            assert tree.insert_if_absent(key, -key) == (key not in expected)
+            expected[key] = -key
+        else:
+            assert tree.delete(key) == (key in expected)
+            expected.pop(key, None)
+    assert tree.stats()['pool']['evictions'] > 0
+    assert all(tree.search(key) == expected.get(key) for key in range(1000))
+    assert contents(tree) == sorted(expected.items())
+    tree.close()
+    reopened = open_tree(tmp_path, order=5, page_size=256)
+    assert contents(reopened) == sorted(expected.items())
+    assert reopened.search_many([3, 500, 999]) == [expected.get(k) for k in (3, 500, 999)]
+
+
+def test_freed_pages_are_reused(tmp_path):
+    tree = open_tree(tmp_path)
+    for i in range(2000):
+        tree.insert(i, i)
+    pages = tree.pager.page_count
+    for i in range(2000):
+        assert tree.delete(i)
+    for i in range(2000):
+        tree.insert(i, i)
+    assert tree.pager.page_count <= pages
+    assert contents(tree) == [(i, i) for i in range(2000)]
+
+
+def test_rejects_files_that_are_not_page_files(tmp_path):
+    path = tmp_path / 'other'
+    path.write_bytes(b'not a page file' * 100)
+    with pytest.raises(ValueError):
+        PagedBPlusTree(str(path))
+
+
+def test_paged_table(tmp_path):
+    table = Table('t', {'id': int, 'v': str}, order=8, search_key='id', engine='paged',
+                  path=str(tmp_path / 't.pages'), pool_size=16)
+    table.insert_many({'id': i, 'v': str(i)} for i in range(500))
+    assert table.insert({'id': 500, 'v': 'last'})
+    assert table.delete(0)
+    assert table.get(250) == {'id': 250, 'v': '250'}
+    assert [record['id'] for _, record in table.scan(495, reverse=True)] == [500, 499, 498, 497, 496, 495]
+    assert len(table.get_all()) == 500
+
+
+def test_oversized_value_leaves_tree_unchanged(tmp_path):
+    tree = open_tree(tmp_path)
+    for i in range(50):
+        tree.insert(i, 'x' * 10)
+    before = contents(tree)
+    with pytest.raises(ValueError):
+        tree.insert(100, 'x' * 600)
+    with pytest.raises(ValueError):
+        tree.update(3, 'x' * 600)
+    assert contents(tree) == before
+
+
+def test_values_that_fill_a_leaf_are_rejected_before_it_is_changed(tmp_path):
+    tree = open_tree(tmp_path)
+    rejected = set()
+    for i in range(200):
+        try:
+            tree.insert(i, str(i) * random.Random(i).randrange(10, 70))
+        except ValueError:
+            rejected.add(i)
+    assert rejected  # seven values of up to 200 bytes overflow a 512-byte page
+    assert [key for key, _ in contents(tree)] == [i for i in range(200) if i not in rejected]
+    tree.close()
+    reopened = open_tree(tmp_path)
+    assert [key for key, _ in contents(reopened)] == [i for i in range(200) if i not in rejected]
+
+
+def test_deletes_skip_merges_that_would_overflow(tmp_path):
+    tree = open_tree(tmp_path)
+    keys = []
+    for key in range(300):
+        try:
+            tree.insert(key, str(key) * (40 if key % 3 else 2))
+            keys.append(key)
+        except ValueError:
+            pass
+    random.Random(1).shuffle(keys)
+    for n, key in enumerate(keys):
+        assert tree.delete(key)
+        if n % 25 == 0:
+            assert [k for k, _ in contents(tree)] == sorted(keys[n + 1:])
+    assert contents(tree) == []
+
+
+def test_bulk_load_of_oversized_leaves_leaves_tree_unchanged(tmp_path):
+    tree = open_tree(tmp_path)
+    with pytest.raises(ValueError):
+        tree.bulk_load((i, f'{i:0100d}') for i in range(100))
+    assert contents(tree) == []
+    tree.bulk_load((i, f'{i:010d}') for i in range(100))
+    assert [key for key, _ in contents(tree)] == list(range(100))
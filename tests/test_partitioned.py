@@ -0,0 +1,98 @@
+import random
+
+import pytest
+
+from partitioned import PartitionedTable, partition_hash
+from table import Table
+
+SCHEMA = {'id': int, 'dept': str, 'score': int}
+
+
+def twin_tables(**options):
+    # A partitioned table and a plain one holding the same rows.
+    partitioned = PartitionedTable('p', SCHEMA, order=4, search_key='id', **options)
+    plain = Table('t', SCHEMA, order=4, search_key='id')
+    rng = random.Random(0)
+    records = [{'id': i, 'dept': rng.choice('abc'), 'score': rng.randrange(100)} for i in range(400)]
+    rng.shuffle(records)
+    for table in (partitioned, plain):
+        table.insert_many(records[:300])
+        for record in records[300:]:
+            table.insert(record)
+        table.create_index('dept')
+    return partitioned, plain
+
+
+LAYOUTS = [{'partitions': 4}, {'partitions': 3, 'partition_by': 'range', 'boundaries': [100, 250]},
+           {'partitions': 1}]
+
+
+@pytest.mark.parametrize('options', LAYOUTS)
+def test_matches_an_unpartitioned_table(options):
+    partitioned, plain = twin_tables(**options)
+    rng = random.Random(1)
+    for _ in range(200):
+        key = rng.randrange(450)
+        op = rng.random()
+        record = {'id': key, 'dept': rng.choice('abc'), 'score': rng.randrange(100)}
+        if op < 0.3:
+            assert partitioned.insert(record) == plain.insert(record)
+        elif op < 0.6:
+            assert partitioned.update(key, record) == plain.update(key, record)
+        elif op < 0.9:
+            assert partitioned.delete(key) == plain.delete(key)
+        else:
+            assert partitioned.delete_range(key, key + 5) == plain.delete_range(key, key + 5)
+    assert len(partitioned) == len(plain.data)
+    assert partitioned.get_all() == plain.get_all()
+    assert partitioned.get_many([5, 500, 17]) == plain.get_many([5, 500, 17])
+    for args in ((None, None, (True, True), True, 7, 3), (50, 300, (False, True), False, None, 10),
+                 (120, 130, (True, False), True, None, 0)):
+        assert list(partitioned.scan(*args)) == list(plain.scan(*args))
+    queries = [dict(), dict(where={'dept': 'a'}), dict(where=('score', '>', 50), order_by='-score', limit=5),
+               dict(where=[('id', '>=', 90), ('id', '<', 260)], order_by='-id', limit=4, offset=2),
+               dict(where=('id', 'in', {3, 150, 399}), columns=['id'])]
+    for kwargs in queries:
+        expected = plain.select(**kwargs)
+        if 'order_by' in kwargs and kwargs['order_by'] == '-score':
+            # Ties in score may come from any partition first.
+            assert [r['score'] for r in partitioned.select(**kwargs)] == [r['score'] for r in expected]
+        else:
+            assert partitioned.select(**kwargs) == expected
+    for where in (None, {'dept': 'b'}, ('id', '<', 200)):
+        assert partitioned.count(where) == plain.count(where)
+        assert partitioned.sum('score', where) == plain.sum('score', where)
+        assert partitioned.max('score', where) == plain.max('score', where)
+    assert partitioned.get_by('dept', 'c') == plain.get_by('dept', 'c')
+    # Values are merged across partitions; rows with the same value keep no order.
+    by_value = sorted(partitioned.range_query_by('dept', 'a', 'b'), key=lambda item: (item[0], item[1]['id']))
+    assert by_value == plain.range_query_by('dept', 'a', 'b')
+
+
+def test_worker_pool_sees_writes():
+    partitioned, plain = twin_tables(partitions=4, workers=2)
+    partitioned.parallel_threshold = 0
+    try:
+        where = ('score', '>=', 50)
+        assert partitioned.explain(where).splitlines()[0].endswith('(hash, parallel)')
+        assert partitioned.select(where) == plain.select(where)
+        partitioned.insert({'id': 1000, 'dept': 'a', 'score': 99})
+        assert partitioned.select(where)[-1] == {'id': 1000, 'dept': 'a', 'score': 99}
+        assert partitioned.count(where) == plain.count(where) + 1
+    finally:
+        partitioned.close()
+
+
+def test_range_partitions_prune_and_validate_options():
+    partitioned, _ = twin_tables(partitions=3, partition_by='range', boundaries=[100, 250])
+    assert partitioned.explain(('id', '<', 50)).startswith('Merge 1 of 3 partitions')
+    assert [len(partition.data) for partition in partitioned.partitions] == [100, 150, 150]
+    with pytest.raises(ValueError):
+        PartitionedTable('p', SCHEMA, search_key='id', partitions=3, partition_by='range', boundaries=[5])
+    with pytest.raises(ValueError):
+        PartitionedTable('p', SCHEMA, search_key='id', partitions=3, partition_by='range', boundaries=[5, 5])
+    with pytest.raises(ValueError):
+        partitioned.create_index('score', unique=True)
+    with pytest.raises(ValueError):
+        partitioned.snapshot()
+    assert partition_hash('abc') == partition_hash('abc') == 891568578
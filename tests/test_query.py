@@ -0,0 +1,99 @@
+import operator
+import random
+
+import pytest
+
+from table import Table
+
+SCHEMA = {'id': int, 'dept': str, 'score': int, 'note': str}
+OPS = {'==': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le,
+       '>': operator.gt, '>=': operator.ge, 'in': lambda value, values: value in values}
+
+
+def make_table(**options):
+    table = Table('t', SCHEMA, order=4, search_key='id', **options)
+    rng = random.Random(0)
+    records = []
+    for i in range(0, 300, 3):
+        record = {'id': i, 'dept': rng.choice('abcd'), 'score': rng.randrange(50)}
+        if rng.random() < 0.3:
+            record['note'] = rng.choice(['x', 'y'])
+        records.append(record)
+    table.insert_many(records)
+    table.create_index('dept')
+    return table, records
+
+
+def matches(record, where):
+    # Reference semantics: an absent field matches no comparison.
+    if isinstance(where, dict):
+        return all(matches(record, (field, '==', value)) for field, value in where.items())
+    if isinstance(where, list):
+        return all(matches(record, part) for part in where)
+    if where[0] == 'and':
+        return all(matches(record, part) for part in where[1:])
+    if where[0] == 'or':
+        return any(matches(record, part) for part in where[1:])
+    field, op, value = where
+    return field in record and OPS[op](record[field], value)
+
+
+def predicates(rng):
+    fields = {'id': lambda: rng.randrange(-10, 310), 'dept': lambda: rng.choice('abcde'),
+              'score': lambda: rng.randrange(50), 'note': lambda: rng.choice('xyz')}
+
+    def comparison():
+        field = rng.choice(list(fields))
+        op = rng.choice(list(OPS))
+        value = {fields[field]() for _ in range(3)} if op == 'in' else fields[field]()
+        return (field, op, value)
+
+    shapes = [
+        lambda: comparison(),
+        lambda: {'dept': fields['dept']()},
+        lambda: [comparison(), comparison()],
+        lambda: ('and', ('id', '>=', fields['id']()), ('id', '<', fields['id']()), comparison()),
+        lambda: ('or', comparison(), [comparison(), comparison()]),
+    ]
+    return rng.choice(shapes)()
+
+
+@pytest.mark.parametrize('augment', [None, 'score'])
+def test_select_and_aggregates_match_a_filter(augment):
+    table, records = make_table(augment=augment)
+    rng = random.Random(1)
+    for _ in range(300):
+        where = predicates(rng)
+        expected = [record for record in records if matches(record, where)]
+        assert table.select(where) == expected, (where, table.explain(where))
+        assert table.count(where) == len(expected)
+        assert table.count(where, 'note') == sum('note' in record for record in expected)
+        scores = [record['score'] for record in expected]
+        assert table.sum('score', where) == sum(scores)
+        assert table.min('score', where) == min(scores, default=None)
+        assert table.max('id', where) == max((record['id'] for record in expected), default=None)
+
+
+def test_order_limit_offset_and_projection():
+    table, records = make_table()
+    by_score = sorted(records, key=lambda record: (-record['score'], record['id']))
+    assert table.select(order_by=['-score', 'id'], limit=10, offset=5) == by_score[5:15]
+    assert table.select(order_by='-id', limit=3) == records[::-1][:3]
+    assert table.select({'dept': 'a'}, columns=['id']) == [
+        {'id': record['id']} for record in records if record['dept'] == 'a']
+    with pytest.raises(KeyError):
+        table.select(order_by='missing')
+    with pytest.raises(KeyError):
+        table.select(('missing', '==', 1))
+    with pytest.raises(ValueError):
+        table.select(('id', '~', 1))
+
+
+def test_explain_picks_the_access_path():
+    table, _ = make_table()
+    assert table.explain(('id', '==', 30)).startswith('KeyLookup')
+    assert table.explain([('id', '>=', 30), ('id', '<', 60)]) == 'KeyRangeScan id >= 30 AND id < 60'
+    assert table.explain({'dept': 'b'}) == "IndexLookup dept IN ['b']"
+    assert table.explain(('score', '>', 3)).splitlines() == ['Filter score > 3', '  FullScan']
+    assert table.explain([('id', '>', 10), ('id', '<', 5)]).startswith('Empty')
+    assert table.explain(order_by='-id', limit=2).splitlines()[-1].strip() == 'FullScan DESC'
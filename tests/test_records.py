@@ -0,0 +1,55 @@
+import pickle
+
+import pytest
+
+from records import RecordCodec
+
+SCHEMA = {'id': int, 'name': str, 'score': float}
+
+
+def test_rows_are_tuples_in_schema_order():
+    codec = RecordCodec(SCHEMA, 'id')
+    row = codec.encode({'score': 1.5, 'id': 3, 'name': 'a'})
+    assert row == (3, 'a', 1.5)
+    assert codec.key_of(row) == 3 and codec.record_key({'id': 3}) == 3
+    assert codec.decode(row) == {'id': 3, 'name': 'a', 'score': 1.5}
+    assert codec.getter('score')(row) == 1.5
+
+
+def test_missing_fields_are_stored_as_none_and_left_out_when_decoded():
+    codec = RecordCodec(SCHEMA, 'id')
+    row = codec.encode({'id': 3})
+    assert row == (3, None, None)
+    assert codec.decode(row) == {'id': 3}
+
+
+def test_invalid_records_are_rejected():
+    codec = RecordCodec(SCHEMA, 'id')
+    with pytest.raises(TypeError):
+        codec.encode({'id': '3', 'name': 'a', 'score': 1.5})  # complete, so the fast path checks it
+    with pytest.raises(TypeError):
+        codec.encode({'id': 3, 'name': 4})
+    with pytest.raises(TypeError):
+        codec.encode([3, 'a', 1.5])
+    with pytest.raises(KeyError):
+        codec.encode({'name': 'a'})  # no search key
+    with pytest.raises(KeyError):
+        codec.encode({'id': 3, 'age': 4})  # not in the schema
+
+
+def test_composite_keys_and_single_field_schemas():
+    codec = RecordCodec(SCHEMA, ('name', 'id'))
+    assert codec.key_fields == ('name', 'id')
+    row = codec.encode({'id': 1, 'name': 'x', 'score': 0.0})
+    assert codec.key_of(row) == ('x', 1) == codec.record_key({'id': 1, 'name': 'x'})
+    assert RecordCodec(SCHEMA, ['id']).search_key == 'id'
+
+    single = RecordCodec({'id': int}, 'id')
+    assert single.encode({'id': 1}) == (1,)
+    assert single.decode((1,)) == {'id': 1}
+
+
+def test_codec_pickles_by_schema():
+    codec = pickle.loads(pickle.dumps(RecordCodec(SCHEMA, 'id')))
+    assert codec.encode({'id': 1, 'name': 'a', 'score': 2.0}) == (1, 'a', 2.0)
+    assert codec.decode((1, None, 2.0)) == {'id': 1, 'score': 2.0}
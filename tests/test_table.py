@@ -0,0 +1,180 @@
+import os
+import random
+
+import pytest
+
+from db_manager import DatabaseManager
+from table import Table
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def load_fixture(name):
+    # See tests/test_bplustree.py for what the fixtures hold.
+    manager = DatabaseManager()
+    assert manager.load_database(os.path.join(FIXTURES, name)) == (None, True)
+    return manager.get_table('school', 'students')
+
+
+def test_legacy_dict_rows_become_tuples():
+    for name in ('baseline.pkl', 'indexed.pkl'):
+        table = load_fixture(name)
+        assert table.data.search(5) == (5, 'student05', 2021)
+        assert table.get(5) == {'roll': 5, 'name': 'student05', 'year': 2021}
+        assert table.get(7) is None
+        assert len(table.get_all()) == 59
+        assert table.insert({'roll': 7, 'name': 'late', 'year': 2024})
+        assert table.data.search(7) == (7, 'late', 2024)
+
+
+def test_legacy_index_keeps_working():
+    table = load_fixture('indexed.pkl')
+    assert [record['roll'] for record in table.get_by('year', 2021)] == list(range(1, 60, 4))
+    assert table.explain({'year': 2021}).startswith('IndexLookup')
+    table.update(5, {'roll': 5, 'name': 'student05', 'year': 2023})
+    assert 5 not in [record['roll'] for record in table.get_by('year', 2021)]
+    assert 5 in [record['roll'] for record in table.get_by('year', 2023)]
+
+
+def test_pickled_table_round_trip(tmp_path):
+    table = Table('t', {'id': int, 'name': str}, order=4, search_key='id')
+    table.insert_many({'id': i, 'name': str(i)} for i in range(50))
+    table.create_index('name')
+    manager = DatabaseManager()
+    manager.create_database('db')
+    manager.databases['db']['t'] = table
+    path = str(tmp_path / 'db.pkl')
+    assert manager.save_database(path)[1]
+    loaded = DatabaseManager()
+    assert loaded.load_database(path) == (None, True)
+    copy = loaded.get_table('db', 't')
+    assert copy.get_all() == table.get_all()
+    assert copy.get_by('name', '42') == [{'id': 42, 'name': '42'}]
+
+
+def test_insert_many_skips_duplicates_and_merges_with_stored_rows():
+    table = Table('t', {'id': int, 'v': str}, order=4, search_key='id')
+    assert table.insert_many([{'id': i, 'v': 'first'} for i in range(0, 100, 2)]) == 50
+    batch = [{'id': i, 'v': 'second'} for i in range(100)] + [{'id': 1, 'v': 'again'}]
+    assert table.insert_many(batch) == 50
+    table.data.validate()
+    assert [record['v'] for _, record in table.get_all()] == ['first', 'second'] * 50
+    assert table.insert_many([{'id': 200, 'v': 'x'}]) == 1  # small batches insert per key
+    assert len(table.data) == 101
+
+
+def postings(table, field):
+    # Rebuilds an index's expected contents from the stored records.
+    expected = {}
+    for key, record in table.get_all():
+        if record.get(field) is not None:
+            expected.setdefault(record[field], []).append(key)
+    return sorted(expected.items())
+
+
+def test_secondary_indexes_follow_every_write():
+    table = Table('t', {'id': int, 'v': int, 'email': str}, order=4, search_key='id')
+    table.insert_many({'id': i, 'v': i % 7, 'email': f'{i}@x'} for i in range(50))
+    table.create_index('v')
+    table.create_index('email', unique=True)
+    rng = random.Random(0)
+    for _ in range(500):
+        key = rng.randrange(80)
+        record = {'id': key, 'v': rng.choice([1, 2, 3]), 'email': f'{rng.randrange(100)}@x'}
+        if rng.random() < 0.2:
+            del record['v']  # missing values are not indexed
+        op = rng.random()
+        if op < 0.4:
+            table.insert(record)
+        elif op < 0.7:
+            table.update(key, record)
+        elif op < 0.9:
+            table.delete(key)
+        else:
+            table.delete_range(key, key + 3)
+        for field in ('v', 'email'):
+            assert table.indexes[field].get_all() == postings(table, field)
+    assert all(len(keys) == 1 for _, keys in postings(table, 'email'))
+    assert table.get_by('v', 2) == [record for _, record in table.get_all() if record.get('v') == 2]
+    assert [value for value, _ in table.range_query_by('v', 1, 2)] == sorted(
+        record['v'] for _, record in table.get_all() if record.get('v') in (1, 2))
+
+
+def test_unique_indexes_reject_duplicates():
+    table = Table('t', {'id': int, 'email': str}, order=4, search_key='id')
+    table.insert_many([{'id': 1, 'email': 'a'}, {'id': 2, 'email': 'a'}])
+    with pytest.raises(ValueError):
+        table.create_index('email', unique=True)
+    assert 'email' not in table.indexes
+    table.delete(2)
+    table.create_index('email', unique=True)
+    assert not table.insert({'id': 3, 'email': 'a'})
+    assert table.update(1, {'id': 1, 'email': 'a'})  # keeping its own value is fine
+    assert table.insert_many([{'id': 4, 'email': 'b'}, {'id': 5, 'email': 'b'}]) == 1
+    assert [record['id'] for record in table.get_by('email', 'b')] == [4]
+    with pytest.raises(KeyError):
+        table.create_index('missing')
+    table.drop_index('email')
+    with pytest.raises(KeyError):
+        table.get_by('email', 'a')
+    assert table.insert({'id': 3, 'email': 'a'})
+
+
+def test_table_scan_decodes_lazily():
+    table = Table('t', {'id': int, 'v': str}, order=4, search_key='id')
+    table.insert_many({'id': i, 'v': str(i)} for i in range(100))
+    assert list(table.scan(10, 20, (False, True), reverse=True, limit=3, offset=1)) == [
+        (19, {'id': 19, 'v': '19'}), (18, {'id': 18, 'v': '18'}), (17, {'id': 17, 'v': '17'})]
+    assert next(table.scan(as_rows=True)) == (0, (0, '0'))
+
+
+def test_get_many_keeps_the_callers_order():
+    table = Table('t', {'id': int, 'v': str}, order=4, search_key='id')
+    table.insert_many({'id': i, 'v': str(i)} for i in range(0, 100, 2))
+    ids = [40, 3, 0, 98, 40, 1000]
+    expected = [table.get(record_id) for record_id in ids]
+    assert expected[1] is None and expected[0] == {'id': 40, 'v': '40'}
+    assert table.get_many(ids) == expected
+    table.enable_cache(capacity=8)
+    assert table.get_many(ids) == expected
+    assert table.get_many(ids) == expected  # now partly from the cache
+    assert table.get_many(ids, as_rows=True)[0] == (40, '40')
+
+
+def test_table_snapshot_sees_rows_and_indexes_as_they_were():
+    table = Table('t', {'id': int, 'v': int}, order=4, search_key='id')
+    table.insert_many({'id': i, 'v': i % 3} for i in range(60))
+    table.create_index('v')
+    view = table.snapshot()
+    before = table.get_all()
+    table.delete_range(0, 29)
+    table.update(40, {'id': 40, 'v': 2})
+    table.insert({'id': 100, 'v': 0})
+    assert view.get_all() == before
+    assert len(view) == 60
+    assert [record['id'] for record in view.get_by('v', 1)] == list(range(1, 60, 3))
+    assert view.count({'v': 0}) == 20
+    assert [record['id'] for record in table.get_by('v', 1)] == [i for i in range(31, 60, 3) if i != 40]
+    assert not hasattr(view, 'insert')
+    with pytest.raises(ValueError):
+        Table('c', {'id': int}, search_key='id', concurrent=True).snapshot()
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_delete_range_keeps_indexes_in_step(lazy):
+    table = Table('t', {'id': int, 'v': int}, order=4, search_key='id')
+    table.create_index('v')
+    table.insert_many({'id': i, 'v': i % 7} for i in range(1000))
+    assert table.delete_range(100, 899, lazy=lazy) == 800
+    assert table.delete_range(100, 899, lazy=lazy) == 0
+    assert table.delete_range(950, inclusive=(False, True), lazy=lazy) == 49
+    table.compact()
+    table.data.validate()
+    kept = list(range(100)) + list(range(900, 951))
+    assert [key for key, _ in table.get_all()] == kept
+    assert table.indexes['v'].get_all() == postings(table, 'v')
+    assert [record['id'] for record in table.get_by('v', 3)] == [i for i in kept if i % 7 == 3]
+    assert table.delete_range(lazy=lazy) == len(kept)
+    assert table.get_all() == [] and table.indexes['v'].get_all() == []
+    assert table.insert({'id': 1, 'v': 1})
+    assert table.get_by('v', 1) == [{'id': 1, 'v': 1}]
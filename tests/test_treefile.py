@@ -0,0 +1,127 @@
+import threading
+
+import pytest
+
+from table import Table
+
+SCHEMA = {'id': int, 'v': int}
+
+
+def test_save_while_writing_is_consistent(tmp_path):
+    table = Table('t', SCHEMA, order=8, search_key='id')
+    table.create_index('v')
+    table.insert_many({'id': i, 'v': i % 10} for i in range(2000))
+    stop = threading.Event()
+
+    def writer():
+        i = 2000
+        while not stop.is_set():
+            table.insert({'id': i, 'v': i % 10})
+            table.delete(i - 2000)
+            i += 1
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        for n in range(5):
+            table.save(str(tmp_path / f'{n}.bpt'))
+    finally:
+        stop.set()
+        thread.join()
+    for n in range(5):
+        loaded = Table.load(str(tmp_path / f'{n}.bpt'))
+        loaded.data.validate()
+        keys = [key for key, _ in loaded.get_all()]
+        assert len(keys) in (2000, 2001)  # between an insert and its delete
+        indexed = sorted(record['id'] for v in range(10) for record in loaded.get_by('v', v))
+        assert indexed == keys
+
+
+def filled_table(**kwargs):
+    table = Table('t', {'id': int, 'name': str, 'score': float}, order=8, search_key='id', **kwargs)
+    table.create_index('name')
+    table.insert_many({'id': i, 'name': f'user{i % 37:03d}', 'score': i / 4} for i in range(1000))
+    return table
+
+
+def test_round_trip_keeps_rows_and_indexes(tmp_path):
+    table = filled_table()
+    table.save(str(tmp_path / 't.bpt'))
+    loaded = Table.load(str(tmp_path / 't.bpt'))
+    loaded.data.validate()
+    assert loaded.get_all() == table.get_all()
+    assert loaded.get_by('name', 'user005') == table.get_by('name', 'user005')
+    assert loaded.insert({'id': 1000, 'name': 'new', 'score': 0.5})
+    assert loaded.get_by('name', 'new') == [{'id': 1000, 'name': 'new', 'score': 0.5}]
+
+
+def test_concurrent_tables_load_as_concurrent(tmp_path):
+    table = filled_table(concurrent=True)
+    table.save(str(tmp_path / 't.bpt'))
+    loaded = Table.load(str(tmp_path / 't.bpt'))
+    assert loaded.concurrent
+    assert loaded.get_all() == table.get_all()
+
+
+def test_mapped_load_reads_from_the_file(tmp_path):
+    table = filled_table()
+    table.save(str(tmp_path / 't.bpt'))
+    mapped = Table.load(str(tmp_path / 't.bpt'), mmap=True)
+    try:
+        assert len(mapped) == 1000
+        assert mapped.get(500) == table.get(500)
+        assert mapped.get(5000) is None
+        assert mapped.get_many([1, 2, 5000]) == table.get_many([1, 2, 5000])
+        assert list(mapped.scan(990, reverse=True)) == list(table.scan(990, reverse=True))
+        assert list(mapped.scan(100, 300, (False, True), limit=20, offset=5)) == \
+            list(table.scan(100, 300, (False, True), limit=20, offset=5))
+        assert mapped.get_by('name', 'user036') == table.get_by('name', 'user036')
+        assert mapped.data.rank(300) == 300
+        assert mapped.data.select(-1)[0] == 999
+        assert mapped.data.count_range(10, 20, (True, False)) == 10
+        assert not hasattr(mapped, 'insert')
+    finally:
+        mapped.close()
+
+
+def test_composite_and_string_keys(tmp_path):
+    table = Table('t', {'dept': str, 'roll': int, 'name': str}, order=4, search_key=('dept', 'roll'))
+    table.insert_many({'dept': dept, 'roll': roll, 'name': f'{dept}-{roll}'}
+                      for dept in ('CS', 'EE', 'ME') for roll in range(300))
+    table.save(str(tmp_path / 'c.bpt'))
+    assert Table.load(str(tmp_path / 'c.bpt')).get_all() == table.get_all()
+    mapped = Table.load(str(tmp_path / 'c.bpt'), mmap=True)
+    try:
+        assert mapped.get(('EE', 42)) == {'dept': 'EE', 'roll': 42, 'name': 'EE-42'}
+        assert [key for key, _ in mapped.scan_prefix(('ME',))] == [('ME', roll) for roll in range(300)]
+    finally:
+        mapped.close()
+
+    # Shared prefixes are front coded; lookups must rebuild them exactly.
+    names = Table('n', {'name': str}, order=8, search_key='name')
+    names.insert_many({'name': f'prefix/shared/{i:05d}'} for i in range(700))
+    names.save(str(tmp_path / 'n.bpt'))
+    mapped = Table.load(str(tmp_path / 'n.bpt'), mmap=True)
+    try:
+        assert mapped.get('prefix/shared/00321') == {'name': 'prefix/shared/00321'}
+        assert [key for key, _ in mapped.scan_prefix('prefix/shared/0069')] == \
+            [f'prefix/shared/{i:05d}' for i in range(690, 700)]
+    finally:
+        mapped.close()
+
+
+@pytest.mark.parametrize('data', [b'', b'BPTF', b'not a tree file' * 10, b'XXXX' + bytes(20)])
+def test_rejects_files_that_are_not_tree_files(tmp_path, data):
+    path = tmp_path / 'bad.bpt'
+    path.write_bytes(data)
+    for mmap in (False, True):
+        with pytest.raises(ValueError):
+            Table.load(str(path), mmap=mmap)
+
+
+def test_only_memory_tables_are_saved(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    table = Table('t', SCHEMA, order=8, search_key='id', engine='paged', path=str(tmp_path / 't.pages'))
+    with pytest.raises(ValueError):
+        table.save(str(tmp_path / 't.bpt'))
+    table.close()
@@ -0,0 +1,42 @@
+import os
+
+from wal import WriteAheadLog
+
+
+def test_replay_after_reopening_skips_a_torn_tail(tmp_path):
+    path = str(tmp_path / 'wal.log')
+    log = WriteAheadLog(path, group_size=4, group_interval=0)
+    lsns = [log.append(('insert', 'db', 't', {'id': i})) for i in range(10)]
+    assert lsns == list(range(1, 11))
+    log.close()
+    size = os.path.getsize(path)
+    with open(path, 'ab') as f:
+        f.write(b'\x40\x00\x00\x00torn')  # a frame cut short by a crash
+
+    assert [lsn for lsn, _ in WriteAheadLog.replay(path)] == lsns
+    assert [entry[3]['id'] for _, entry in WriteAheadLog.replay(path, after_lsn=7)] == [7, 8, 9]
+    log = WriteAheadLog(path, group_interval=0)
+    assert os.path.getsize(path) == size
+    assert log.append(('insert', 'db', 't', {'id': 10}), wait=True) == 11
+    log.close()
+    assert [lsn for lsn, _ in WriteAheadLog.replay(path)] == lsns + [11]
+
+
+def test_group_commit_from_the_flusher_thread(tmp_path):
+    path = str(tmp_path / 'wal.log')
+    log = WriteAheadLog(path, group_size=1000, group_interval=0.001)
+    last = [log.append(i) for i in range(50)][-1]
+    log.wait_durable(last)
+    assert log.durable_lsn >= last
+    assert [entry for _, entry in WriteAheadLog.replay(path)] == list(range(50))
+    log.reset()
+    assert log.size == 0 and os.path.getsize(path) == 0
+    log.close()
+
+
+def test_replay_starts_numbering_after_a_checkpoint(tmp_path):
+    path = str(tmp_path / 'wal.log')
+    log = WriteAheadLog(path, group_interval=0, start_lsn=41)
+    assert log.append('a', wait=True) == 42
+    log.close()
+    assert list(WriteAheadLog.replay(path, after_lsn=41)) == [(42, 'a')]
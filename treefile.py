@@ -0,0 +1,489 @@
+"""Compact binary files for the sorted contents of B+ trees.
+
+A file holds one or more sections, each the entries of one tree in key
+order, cut into blocks of up to BLOCK_ROWS entries. A block stores its
+entries column by column: integers as packed arrays of the narrowest
+width that fits (a sorted integer key column as deltas), floats as
+doubles, and anything else, strings included, marshalled or, failing
+that, pickled. String key columns whose neighbours share prefixes are
+front coded: each key as the length it shares with the one before and
+the rest. Rows of a table are stored as their fields alone, since the
+key is one of them, or, for a composite key, a few of them.
+
+Layout (little-endian):
+
+    header   magic, version, flags, meta offset, meta length
+    blocks   each a u32 length followed by the marshalled columns
+    meta     pickle of the caller's metadata, which names its sections;
+             a section lists its blocks with their first keys and counts
+
+TreeFile.items() decodes a whole section for bulk_load. MappedTree maps
+the file instead and decodes only the blocks a lookup or scan touches,
+so opening a file costs one read of its meta.
+"""
+import bisect
+import itertools
+import marshal
+import mmap
+import operator
+import pickle
+import struct
+import sys
+from array import array
+from collections import OrderedDict
+from metrics import TreeMetrics
+
+HEADER = struct.Struct('<4sHHQQ')  # magic, version, flags, meta offset, meta length
+BLOCK_HEADER = struct.Struct('<I')  # payload length
+MAGIC = b'BPTF'
+VERSION = 2  # 2 added front coding and composite keys
+READ_VERSIONS = (1, 2)
+BLOCK_ROWS = 256  # a mapped lookup decodes one block
+
+# Column encodings
+INTS, DELTA_INTS, FLOATS, MARSHALLED, PICKLED, FRONT_CODED = range(6)
+INT_CODES = ('b', 'h', 'i', 'q')
+
+
+# --- Columns ---
+
+def _to_bytes(packed):
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _from_bytes(code, data):
+    packed = array(code)
+    packed.frombytes(data)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tolist()
+
+
+def _pack_ints(values):
+    # (typecode, bytes) in the narrowest signed width holding every value,
+    # or None if one needs more than 64 bits.
+    if not values:
+        return 'b', b''
+    low, high = min(values), max(values)
+    for code in INT_CODES:
+        limit = 1 << (array(code).itemsize * 8 - 1)
+        if -limit <= low and high < limit:
+            return code, _to_bytes(array(code, values))
+    return None
+
+
+def _encode_column(values, is_key):
+    kinds = set(map(type, values))
+    if kinds == {int}:
+        if is_key:
+            # Sorted keys are stored as gaps from their predecessor, which stay
+            # narrow even when the keys themselves are large.
+            packed = _pack_ints(list(map(operator.sub, values[1:], values[:-1])))
+            if packed is not None:
+                return (DELTA_INTS, values[0]) + packed
+        else:
+            packed = _pack_ints(values)
+            if packed is not None:
+                return (INTS,) + packed
+    elif kinds == {float}:
+        return FLOATS, _to_bytes(array('d', values))
+    elif kinds == {str} and is_key:
+        coded = _front_code(values)
+        if coded is not None:
+            return coded
+    try:
+        return MARSHALLED, marshal.dumps(values)
+    except ValueError:  # a type marshal does not know, e.g. a user class
+        return PICKLED, pickle.dumps(values, pickle.HIGHEST_PROTOCOL)
+
+
+def _front_code(values):
+    # Each string as the length of the prefix it shares with the block's
+    # first one plus the rest, so any one of them can be rebuilt alone.
+    # None unless that saves a quarter of the characters.
+    first = values[0]
+    n = len(first)
+    shared = []
+    for value in values:
+        # Sorted keys share ever less of the first one; otherwise a shorter
+        # prefix than possible is recorded, which is still right.
+        while not value.startswith(first[:n]):
+            n -= 1
+        shared.append(n)
+    if 4 * sum(shared) < sum(map(len, values)):
+        return None
+    packed = _pack_ints(shared)
+    return (FRONT_CODED, first) + packed + ([value[k:] for value, k in zip(values, shared)],)
+
+
+class _FrontCoded:
+    """A front-coded column that rebuilds only the strings it is asked for.
+
+    MappedTree bisects it directly, so a point lookup decodes the few keys
+    it compares instead of the whole block.
+    """
+    __slots__ = ('first', 'shared', 'suffixes')
+
+    def __init__(self, first, shared, suffixes):
+        self.first = first
+        self.shared = shared
+        self.suffixes = suffixes
+
+    def __len__(self):
+        return len(self.shared)
+
+    def __getitem__(self, i):
+        return self.first[:self.shared[i]] + self.suffixes[i]
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def tolist(self):
+        first = self.first
+        prefixes = {n: first[:n] for n in set(self.shared)}
+        return list(map(operator.add, map(prefixes.__getitem__, self.shared), self.suffixes))
+
+
+def _decode_column(column, lazy=False):
+    kind = column[0]
+    if kind == INTS:
+        return _from_bytes(column[1], column[2])
+    if kind == DELTA_INTS:
+        return list(itertools.accumulate(_from_bytes(column[2], column[3]), initial=column[1]))
+    if kind == FLOATS:
+        return _from_bytes('d', column[1])
+    if kind == MARSHALLED:
+        return list(marshal.loads(column[1]))
+    if kind == PICKLED:
+        return list(pickle.loads(column[1]))
+    if kind == FRONT_CODED:
+        values = _FrontCoded(column[1], _from_bytes(column[2], column[3]), column[4])
+        return values if lazy else values.tolist()
+    raise ValueError(f"Unknown column encoding {kind}")
+
+
+def _encode_block(keys, values, key_position):
+    if key_position is None:
+        columns = [_encode_column(keys, True), _encode_column(values, False)]
+    else:
+        # A composite key's fields are all key columns.
+        key_columns = key_position if isinstance(key_position, tuple) else (key_position,)
+        columns = [_encode_column(list(field), i in key_columns) for i, field in enumerate(zip(*values))]
+    return marshal.dumps(tuple(columns))
+
+
+def _keys(columns, key_position):
+    if key_position is None:
+        return columns[0]
+    if isinstance(key_position, tuple):
+        return list(zip(*[columns[i] for i in key_position]))
+    return columns[key_position]
+
+
+def _entries(columns, key_position, keys=None):
+    # The keys and values of a block from its decoded columns.
+    if keys is None:
+        keys = _keys(columns, key_position)
+    if key_position is None:
+        return keys, columns[1]
+    return keys, list(zip(*columns))
+
+
+# --- Writing ---
+
+class TreeWriter:
+    """Writes sections of sorted entries, then the meta that names them.
+
+        with TreeWriter(path) as writer:
+            data = writer.write_section(tree.get_all())
+            writer.finish({'data': data})
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'wb')
+        self._file.write(HEADER.pack(MAGIC, VERSION, 0, 0, 0))
+        self._offset = HEADER.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+
+    def write_section(self, items, key_position=None):
+        """Writes (key, value) pairs sorted by key and returns the section for the meta.
+
+        With key_position, every value is a tuple holding its key at that
+        position, as table rows do, and the keys are not stored separately;
+        a tuple of positions stands for a composite key made of those fields.
+        """
+        section = {'rows': 0, 'key_position': key_position, 'blocks': [], 'first_keys': [], 'ends': []}
+        items = iter(items)
+        while True:
+            chunk = list(itertools.islice(items, BLOCK_ROWS))
+            if not chunk:
+                return section
+            keys, values = map(list, zip(*chunk))
+            payload = _encode_block(keys, values, key_position)
+            self._file.write(BLOCK_HEADER.pack(len(payload)))
+            self._file.write(payload)
+            section['blocks'].append((self._offset + BLOCK_HEADER.size, len(payload)))
+            section['first_keys'].append(keys[0])
+            section['rows'] += len(keys)
+            section['ends'].append(section['rows'])
+            self._offset += BLOCK_HEADER.size + len(payload)
+
+    def finish(self, meta):
+        payload = pickle.dumps(meta, pickle.HIGHEST_PROTOCOL)
+        self._file.write(payload)
+        self._file.seek(0)
+        self._file.write(HEADER.pack(MAGIC, VERSION, 0, self._offset, len(payload)))
+        self._file.flush()
+
+
+# --- Reading ---
+
+def _mmap(f):
+    # TreeFile's mmap argument shadows the module there.
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class TreeFile:
+    """An open tree file: its meta, and its sections as entries or as MappedTrees.
+
+    With mmap=True the file is mapped read-only and blocks are read on
+    demand; otherwise it is read into memory at once.
+    """
+
+    def __init__(self, path, mmap=False):
+        self.path = path
+        with open(path, 'rb') as f:
+            if mmap:
+                self._buffer = _mmap(f)
+            else:
+                self._buffer = f.read()
+        if len(self._buffer) < HEADER.size:
+            self.close()
+            raise ValueError(f"'{path}' is not a B+ tree file")
+        magic, version, _, meta_offset, meta_length = HEADER.unpack_from(self._buffer)
+        if magic != MAGIC or version not in READ_VERSIONS:
+            self.close()
+            raise ValueError(f"'{path}' is not a B+ tree file")
+        self.meta = pickle.loads(self._buffer[meta_offset:meta_offset + meta_length])
+
+    def close(self):
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        self._buffer = b''
+
+    def columns(self, section, i, lazy=False):
+        """Returns the decoded columns of the i-th block of section.
+
+        With lazy=True front-coded columns come back as sequences that
+        rebuild each string on access.
+        """
+        offset, length = section['blocks'][i]
+        return [_decode_column(column, lazy) for column in marshal.loads(self._buffer[offset:offset + length])]
+
+    def block(self, section, i):
+        """Returns the keys and values of the i-th block of section."""
+        return _entries(self.columns(section, i), section['key_position'])
+
+    def items(self, section):
+        """Yields the (key, value) pairs of section in key order."""
+        for i in range(len(section['blocks'])):
+            yield from zip(*self.block(section, i))
+
+    def mapped(self, section):
+        return MappedTree(self, section)
+
+
+class MappedTree:
+    """Read-only tree over a section of a mapped TreeFile.
+
+    Offers the read side of BPlusTree (search, search_many, scan,
+    range_query, get_all) plus rank, select and count_range, which the
+    per-block counts make O(log n). A lookup bisects the first keys of the
+    blocks, decodes one block and keeps it in a small LRU cache.
+    """
+    metrics = None
+
+    def __init__(self, source, section, cache_blocks=64):
+        self.source = source
+        self.section = section
+        self.cache_blocks = cache_blocks
+        self._first_keys = section['first_keys']
+        self._ends = section['ends']
+        self._key_position = section['key_position']
+        # Block number -> (keys, decoded columns), least recently used first.
+        # Rows are built per lookup, so a cached block holds a few lists.
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return self.section['rows']
+
+    def snapshot(self):
+        return self
+
+    def close(self):
+        self._cache.clear()
+        self.source.close()
+
+    def enable_metrics(self, metrics=None):
+        # node_visits counts block lookups, leaf_hops steps to a neighbouring block.
+        self.metrics = metrics if metrics is not None else TreeMetrics()
+        return self.metrics
+
+    def disable_metrics(self):
+        self.__dict__.pop('metrics', None)
+
+    def stats(self):
+        stats = {
+            'size': len(self),
+            'blocks': len(self._first_keys),
+            'cached_blocks': len(self._cache),
+            'bytes': sum(length for _, length in self.section['blocks']),
+        }
+        if self.metrics is not None:
+            stats['counters'] = self.metrics.as_dict()
+        return stats
+
+    def _load(self, i):
+        if self.metrics is not None:
+            self.metrics.node_visits += 1
+        entry = self._cache.get(i)
+        if entry is not None:
+            self._cache.move_to_end(i)
+            return entry
+        columns = self.source.columns(self.section, i, lazy=True)
+        entry = self._cache[i] = _keys(columns, self._key_position), columns
+        if len(self._cache) > self.cache_blocks:
+            self._cache.popitem(last=False)
+        return entry
+
+    def _value(self, columns, idx):
+        if self._key_position is None:
+            return columns[1][idx]
+        return tuple([column[idx] for column in columns])
+
+    def _block(self, i):
+        # Scans read every entry, so a block's front-coded columns are
+        # decoded in full, once.
+        keys, columns = self._load(i)
+        if any(type(column) is _FrontCoded for column in columns):
+            columns = [column.tolist() if type(column) is _FrontCoded else column for column in columns]
+            keys = _keys(columns, self._key_position)
+            self._cache[i] = keys, columns
+        return _entries(columns, self._key_position, keys)
+
+    def search(self, key):
+        i = bisect.bisect_right(self._first_keys, key) - 1
+        if i < 0:
+            return None
+        keys, columns = self._load(i)
+        idx = bisect.bisect_left(keys, key)
+        if idx < len(keys) and keys[idx] == key:
+            return self._value(columns, idx)
+        return None
+
+    def search_many(self, keys):
+        return [self.search(key) for key in keys]
+
+    def range_query(self, start_key, end_key):
+        return list(self._scan_forward(start_key, end_key, True, True))
+
+    def get_all(self):
+        result = []
+        for i in range(len(self._first_keys)):
+            result.extend(zip(*self.source.block(self.section, i)))
+        return result
+
+    def scan(self, start=None, end=None, inclusive=(True, True), reverse=False, limit=None, offset=0):
+        """Lazily yields (key, value) pairs between start and end; see BPlusTree.scan."""
+        include_start, include_end = inclusive
+        if reverse:
+            items = self._scan_reverse(start, end, include_start, include_end)
+        else:
+            items = self._scan_forward(start, end, include_start, include_end)
+        if offset or limit is not None:
+            items = itertools.islice(items, offset, None if limit is None else offset + limit)
+        return items
+
+    def _scan_forward(self, start, end, include_start, include_end):
+        if not self._first_keys:
+            return
+        i = 0 if start is None else max(bisect.bisect_right(self._first_keys, start) - 1, 0)
+        keys, values = self._block(i)
+        idx = 0 if start is None else (bisect.bisect_left if include_start else bisect.bisect_right)(keys, start)
+        while True:
+            for j in range(idx, len(keys)):
+                key = keys[j]
+                if end is not None and (key > end or (key == end and not include_end)):
+                    return
+                yield key, values[j]
+            i += 1
+            if i == len(self._first_keys):
+                return
+            if self.metrics is not None:
+                self.metrics.leaf_hops += 1
+            keys, values = self._block(i)
+            idx = 0
+
+    def _scan_reverse(self, start, end, include_start, include_end):
+        i = len(self._first_keys) - 1 if end is None else bisect.bisect_right(self._first_keys, end) - 1
+        if i < 0:
+            return
+        keys, values = self._block(i)
+        if end is None:
+            j = len(keys) - 1
+        else:
+            j = (bisect.bisect_right if include_end else bisect.bisect_left)(keys, end) - 1
+        while True:
+            while j >= 0:
+                key = keys[j]
+                if start is not None and (key < start or (key == start and not include_start)):
+                    return
+                yield key, values[j]
+                j -= 1
+            i -= 1
+            if i < 0:
+                return
+            if self.metrics is not None:
+                self.metrics.leaf_hops += 1
+            keys, values = self._block(i)
+            j = len(keys) - 1
+
+    # --- Order statistics ---
+
+    def _position(self, key, include):
+        # Number of keys below key (or up to it, if include).
+        i = bisect.bisect_right(self._first_keys, key) - 1
+        if i < 0:
+            return 0
+        keys = self._load(i)[0]
+        return (self._ends[i - 1] if i else 0) + (bisect.bisect_right if include else bisect.bisect_left)(keys, key)
+
+    def rank(self, key):
+        """Returns the number of keys smaller than key."""
+        return self._position(key, False)
+
+    def select(self, i):
+        """Returns the i-th smallest (key, value) pair; negative i counts from the end."""
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("select index out of range")
+        block = bisect.bisect_right(self._ends, i)
+        keys, columns = self._load(block)
+        i -= self._ends[block - 1] if block else 0
+        return keys[i], self._value(columns, i)
+
+    def count_range(self, start=None, end=None, inclusive=(True, True)):
+        """Counts keys between start and end; bounds as in scan()."""
+        include_start, include_end = inclusive
+        below = 0 if start is None else self._position(start, not include_start)
+        upto = len(self) if end is None else self._position(end, include_end)
+        return max(upto - below, 0)
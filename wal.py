@@ -0,0 +1,141 @@
+import os
+import pickle
+import struct
+import threading
+import zlib
+
+FRAME = struct.Struct('<IIQ')  # payload length, crc32 of payload, lsn
+
+
+class WriteAheadLog:
+    """Append-only log of mutations with group-commit fsync batching.
+
+    Appends are buffered and written with a single fsync once ``group_size``
+    entries are pending or ``group_interval`` seconds have passed, whichever
+    comes first. Callers that need the entry on disk before returning pass
+    ``wait=True``; concurrent waiters share the same fsync.
+    """
+
+    def __init__(self, path, group_size=64, group_interval=0.005, start_lsn=0):
+        self.path = path
+        self.group_size = group_size
+        self.group_interval = group_interval
+        last_lsn, valid_bytes = start_lsn, 0
+        for lsn, _, end in self._frames(path):
+            last_lsn, valid_bytes = max(last_lsn, lsn), end
+        self._file = open(path, 'ab')
+        self._file.truncate(valid_bytes)  # drop a torn tail left by a crash
+        self._bytes = valid_bytes
+        self.next_lsn = last_lsn + 1
+        self.durable_lsn = last_lsn
+        self._buffer = []
+        self._cond = threading.Condition()
+        self._io_lock = threading.Lock()
+        self._closed = False
+        self._flusher = None
+        if group_interval:
+            self._flusher = threading.Thread(target=self._flush_loop, name='wal-flusher', daemon=True)
+            self._flusher.start()
+
+    @staticmethod
+    def _frames(path):
+        # Yields (lsn, entry, end_offset) for every intact frame, stopping at
+        # the first short or corrupt one.
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as f:
+            offset = 0
+            while True:
+                header = f.read(FRAME.size)
+                if len(header) < FRAME.size:
+                    return
+                length, crc, lsn = FRAME.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    return
+                offset += FRAME.size + length
+                yield lsn, pickle.loads(payload), offset
+
+    @classmethod
+    def replay(cls, path, after_lsn=0):
+        """Yields (lsn, entry) for the intact log records newer than after_lsn."""
+        for lsn, entry, _ in cls._frames(path):
+            if lsn > after_lsn:
+                yield lsn, entry
+
+    @property
+    def size(self):
+        return self._bytes
+
+    def append(self, entry, wait=False):
+        payload = pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"Write-ahead log '{self.path}' is closed")
+            lsn = self.next_lsn
+            self.next_lsn += 1
+            self._buffer.append(FRAME.pack(len(payload), zlib.crc32(payload), lsn) + payload)
+            self._bytes += FRAME.size + len(payload)
+            full = len(self._buffer) >= self.group_size
+            if full and self._flusher is not None:
+                self._cond.notify_all()
+        if full and self._flusher is None:
+            self.sync()
+        if wait:
+            self.wait_durable(lsn)
+        return lsn
+
+    def wait_durable(self, lsn):
+        if self._flusher is None:
+            self.sync()
+            return
+        with self._cond:
+            while self.durable_lsn < lsn and not self._closed:
+                self._cond.notify_all()
+                self._cond.wait()
+
+    def sync(self):
+        """Writes and fsyncs every buffered record; returns the last durable LSN."""
+        with self._io_lock:
+            with self._cond:
+                frames, self._buffer = self._buffer, []
+                last = self.next_lsn - 1
+            if frames:
+                self._file.write(b''.join(frames))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            with self._cond:
+                self.durable_lsn = max(self.durable_lsn, last)
+                self._cond.notify_all()
+        return last
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                if len(self._buffer) < self.group_size:
+                    self._cond.wait(self.group_interval)
+                pending = bool(self._buffer)
+            if pending:
+                self.sync()
+
+    def reset(self):
+        """Empties the log once a checkpoint has made its records redundant."""
+        with self._io_lock:
+            with self._cond:
+                if self._buffer:
+                    raise RuntimeError("Cannot reset a log with unsynced records")
+                self._file.truncate(0)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._bytes = 0
+
+    def close(self):
+        self.sync()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._flusher is not None:
+            self._flusher.join()
+        self._file.close()